@@ -0,0 +1,80 @@
+"""
+Request pipeline benchmarks.
+
+Usage::
+
+    python -m benchmarks [--stacks bare,loggers] [--payloads small] [--concurrency 1,10,50]
+                         [--calls 2000] [--save baseline.json] [--compare baseline.json] [--threshold 10]
+"""
+import sys
+from argparse import ArgumentParser
+from asyncio import get_event_loop
+
+from .runner import compare, load_baseline, run_all, save_baseline, scenario_key
+from .server import LocalServer
+
+ROW_FMT = '{:<40} {:>10} {:>9} {:>9} {:>12}'
+
+
+def _list(value):
+    return [v for v in value.split(',') if v]
+
+
+def print_result(result):
+    print(ROW_FMT.format(scenario_key(result),
+                         '{:.0f}'.format(result['req_per_sec']),
+                         '{:.2f}'.format(result['p50_ms']),
+                         '{:.2f}'.format(result['p99_ms']),
+                         '{:.1f}'.format(result['peak_kib'])))
+    sys.stdout.flush()
+
+
+def print_comparison(comparison):
+    print()
+    print('{:<40} {:<24} {:>12} {:>12} {:>9}'.format('scenario', 'metric', 'baseline', 'current', 'change'))
+    for scenario, metric, base, value, change, regression in comparison:
+        print('{:<40} {:<24} {:>12.2f} {:>12.2f} {:>+8.1f}%{}'.format(
+            scenario, metric, base, value, change, ' REGRESSION' if regression else ''))
+
+
+async def main(args):
+    server = LocalServer()
+    await server.start()
+    try:
+        print(ROW_FMT.format('scenario', 'req/s', 'p50 ms', 'p99 ms', 'peak KiB'))
+        return await run_all(server.base_path,
+                             stacks=args.stacks,
+                             payloads=args.payloads,
+                             concurrency_levels=[int(c) for c in args.concurrency],
+                             calls=args.calls,
+                             report=print_result)
+    finally:
+        await server.stop()
+
+
+def parse_args(argv=None):
+    parser = ArgumentParser(prog='python -m benchmarks', description='Service client request pipeline benchmarks')
+    parser.add_argument('--stacks', type=_list, default=None, help='Comma separated plugin stacks')
+    parser.add_argument('--payloads', type=_list, default=None, help='Comma separated payload sizes')
+    parser.add_argument('--concurrency', type=_list, default=['1', '10', '50'],
+                        help='Comma separated concurrency levels')
+    parser.add_argument('--calls', type=int, default=2000, help='Calls for each scenario')
+    parser.add_argument('--save', default=None, help='Save results as baseline file')
+    parser.add_argument('--compare', default=None, help='Compare results with baseline file')
+    parser.add_argument('--threshold', type=float, default=10,
+                        help='Degradation percentage considered regression')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    results = get_event_loop().run_until_complete(main(args))
+
+    if args.save:
+        save_baseline(results, args.save)
+
+    if args.compare:
+        comparison = compare(results, load_baseline(args.compare), threshold=args.threshold)
+        print_comparison(comparison)
+        if any(c[-1] for c in comparison):
+            sys.exit(1)
@@ -0,0 +1,128 @@
+import gc
+import json
+import tracemalloc
+from asyncio import gather, sleep
+from time import perf_counter
+
+from .server import PAYLOADS
+from .stacks import STACKS
+
+
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(percent / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def _call(service_client, size, options):
+    if options.get('tokens'):
+        return await service_client.call('get_payload', size=size)
+    return await service_client.call('get_payload_{}'.format(size))
+
+
+async def _worker(service_client, size, options, calls, latencies):
+    for _ in range(calls):
+        start = perf_counter()
+        await _call(service_client, size, options)
+        latencies.append(perf_counter() - start)
+
+
+async def _measure_peak_memory(service_client, size, options, calls):
+    """
+    Mean peak of memory (bytes) traced by tracemalloc while a call is running. It is measured on a
+    sequential pass after throughput one, so tracing does not distort timings.
+    """
+    total = 0
+    gc.collect()
+    tracemalloc.start()
+    try:
+        for _ in range(calls):
+            tracemalloc.clear_traces()
+            await _call(service_client, size, options)
+            total += tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return total / calls
+
+
+async def run_scenario(base_path, stack, size, concurrency, calls, warmup=50, memory_calls=50):
+    service_client, options = STACKS[stack](base_path, concurrency)
+    try:
+        for _ in range(warmup):
+            await _call(service_client, size, options)
+
+        latencies = []
+        per_worker = max(1, calls // concurrency)
+        start = perf_counter()
+        await gather(*[_worker(service_client, size, options, per_worker, latencies)
+                       for _ in range(concurrency)])
+        elapsed = perf_counter() - start
+
+        peak = await _measure_peak_memory(service_client, size, options, memory_calls)
+    finally:
+        service_client.close()
+        await sleep(0)
+
+    latencies.sort()
+    return {'stack': stack,
+            'payload': size,
+            'concurrency': concurrency,
+            'calls': len(latencies),
+            'req_per_sec': len(latencies) / elapsed,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'peak_kib': peak / 1024}
+
+
+def scenario_key(result):
+    return '{stack}/{payload}/c{concurrency}'.format(**result)
+
+
+async def run_all(base_path, stacks=None, payloads=None, concurrency_levels=(1, 10, 50), calls=2000,
+                  report=None):
+    results = []
+    for stack in stacks or sorted(STACKS):
+        for size in payloads or sorted(PAYLOADS):
+            for concurrency in concurrency_levels:
+                result = await run_scenario(base_path, stack, size, concurrency, calls)
+                results.append(result)
+                if report:
+                    report(result)
+    return results
+
+
+def save_baseline(results, filename):
+    with open(filename, 'w') as f:
+        json.dump({scenario_key(r): r for r in results}, f, indent=2, sort_keys=True)
+
+
+def load_baseline(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+
+def compare(results, baseline, threshold=10):
+    """
+    Compares results against a baseline.
+
+    :param threshold: Percentage of degradation allowed on requests per second and p99 latency.
+    :return: List of tuples ``(scenario, metric, baseline_value, value, change_percent, is_regression)``.
+    """
+    comparison = []
+    for result in results:
+        try:
+            base = baseline[scenario_key(result)]
+        except KeyError:
+            continue
+
+        for metric, higher_is_better in (('req_per_sec', True),
+                                         ('p50_ms', False),
+                                         ('p99_ms', False),
+                                         ('peak_kib', False)):
+            if not base.get(metric):
+                continue
+            change = (result[metric] - base[metric]) / base[metric] * 100
+            regression = (-change if higher_is_better else change) > threshold
+            comparison.append((scenario_key(result), metric, base[metric], result[metric], change, regression))
+    return comparison
@@ -0,0 +1,47 @@
+import json
+
+from aiohttp import web
+
+PAYLOADS = {
+    'small': json.dumps({'id': 1, 'name': 'foo', 'tags': ['a', 'b', 'c']}).encode(),
+    'large': json.dumps({'items': [{'id': i,
+                                    'name': 'item {}'.format(i),
+                                    'description': 'x' * 100,
+                                    'values': list(range(10))} for i in range(5000)]}).encode()
+}
+
+
+async def payload_handler(request):
+    return web.Response(body=PAYLOADS[request.match_info['size']],
+                        content_type='application/json')
+
+
+def create_app():
+    app = web.Application()
+    app.router.add_get('/payload/{size}', payload_handler)
+    return app
+
+
+class LocalServer:
+    """
+    In-process aiohttp server listening on loopback.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    @property
+    def base_path(self):
+        return 'http://{}:{}'.format(self.host, self.port)
+
+    async def start(self):
+        self._runner = web.AppRunner(create_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        await self._runner.cleanup()
@@ -0,0 +1,98 @@
+import logging
+from io import StringIO
+
+from service_client import ServiceClient
+from service_client.formatters import ServiceClientFormatter
+from service_client.json import json_decoder, json_encoder
+from service_client.mocks import Mock
+from service_client.plugins import Headers, InnerLogger, OuterLogger, PathTokens, Pool, QueryParams, RateLimit
+
+from .server import PAYLOADS
+
+SPEC = {
+    'get_payload': {'path': '/payload/{size}',
+                    'method': 'get',
+                    'headers': {'X-Endpoint': 'get_payload'},
+                    'query_params': {'format': 'json'}},
+}
+
+
+def _static_spec():
+    return {'get_payload_{}'.format(size): {'path': '/payload/{}'.format(size),
+                                            'method': 'get'}
+            for size in PAYLOADS}
+
+
+def _mock_spec():
+    return {'get_payload_{}'.format(size): {'path': '/payload/{}'.format(size),
+                                            'method': 'get',
+                                            'mock': {'mock_type': 'default:RawDataMock',
+                                                     'data': payload,
+                                                     'headers': {'Content-Type': 'application/json'}}}
+            for size, payload in PAYLOADS.items()}
+
+
+def _create_logger():
+    logger = logging.getLogger('benchmarks.service_client')
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    if not logger.handlers:
+        handler = logging.StreamHandler(StringIO())
+        handler.setFormatter(ServiceClientFormatter(fmt='%(asctime)s %(service_name)s %(endpoint)s ',
+                                                    request_fmt='%(method)s %(full_url)s %(body)s',
+                                                    response_fmt='%(status_code)d %(status_text)s %(headers)s %(body)s',
+                                                    headers_fmt='%(name)s: %(value)s',
+                                                    headers_sep=', '))
+        logger.addHandler(handler)
+    return logger
+
+
+def bare(base_path, concurrency):
+    return ServiceClient(name='bare', spec=_static_spec(), base_path=base_path,
+                         parser=json_decoder, serializer=json_encoder), {}
+
+
+def tokens_headers_params(base_path, concurrency):
+    return ServiceClient(name='tokens_headers_params', spec=SPEC, base_path=base_path,
+                         plugins=[PathTokens(), Headers(default_headers={'X-Client': 'benchmark'}),
+                                  QueryParams(default_query_params={'client': 'benchmark'})],
+                         parser=json_decoder, serializer=json_encoder), {'tokens': True}
+
+
+def loggers(base_path, concurrency):
+    logger = _create_logger()
+    return ServiceClient(name='loggers', spec=_static_spec(), base_path=base_path,
+                         plugins=[InnerLogger(logger, max_body_length=200),
+                                  OuterLogger(logger, max_body_length=200)],
+                         parser=json_decoder, serializer=json_encoder), {}
+
+
+def loggers_queue(base_path, concurrency):
+    logger = _create_logger()
+    return ServiceClient(name='loggers_queue', spec=_static_spec(), base_path=base_path,
+                         plugins=[InnerLogger(logger, max_body_length=200, queue_size=10000),
+                                  OuterLogger(logger, max_body_length=200, queue_size=10000)],
+                         parser=json_decoder, serializer=json_encoder), {}
+
+
+def limits(base_path, concurrency):
+    return ServiceClient(name='limits', spec=_static_spec(), base_path=base_path,
+                         plugins=[Pool(limit=max(1, concurrency // 2)),
+                                  RateLimit(limit=100000, period=0.001)],
+                         parser=json_decoder, serializer=json_encoder), {}
+
+
+def mock(base_path, concurrency):
+    return ServiceClient(name='mock', spec=_mock_spec(), base_path=base_path,
+                         plugins=[Mock()],
+                         parser=json_decoder, serializer=json_encoder), {}
+
+
+STACKS = {
+    'bare': bare,
+    'tokens_headers_params': tokens_headers_params,
+    'loggers': loggers,
+    'loggers_queue': loggers_queue,
+    'limits': limits,
+    'mock': mock,
+}
@@ -1,5 +1,5 @@
 import logging
-from asyncio import Task, ensure_future, get_event_loop
+from asyncio import Task, TimeoutError, ensure_future, gather, get_event_loop, shield, wait_for
 from urllib.parse import urlparse, urlunsplit
 
 try:
@@ -8,24 +8,35 @@ except AttributeError:  # pragma: no cover
     from asyncio import current_task
 
 from aiohttp.client import ClientSession
-from aiohttp.client_reqrep import ClientResponse
+from aiohttp.client_reqrep import ClientRequest, ClientResponse
 from aiohttp.connector import TCPConnector
 from yarl import URL
 
+from .calls import AWAITING_HEADERS, CONNECTING, PARSING, READING, CallInfo
+from .connectors import connector_registry
+from .profiling import Profiler
 from .utils import ObjectWrapper
 
-__version__ = '0.7.2'
+__version__ = '0.8.0'
 
 
 class ServiceClient:
 
     def __init__(self, name='GenericService', spec=None, plugins=None, config=None,
-                 parser=None, serializer=None, base_path='', loop=None, logger=None):
+                 parser=None, serializer=None, base_path='', loop=None, logger=None, profile=False):
+        # attributes used by close() are set first, so a client which fails to build could be closed
         self._plugins = []
+        self.profiler = Profiler() if profile else None
+        self.shared_connector = None
+        self.session = None
+        self.warm_up_task = None
+        self.closing = False
+        self._active_calls = {}
+        self._drained = None
 
         self.logger = logger or logging.getLogger('serviceClient.{}'.format(name))
         self.name = name
-        self.spec = spec or {}
+        self.spec = spec if spec is not None else {}
         self.add_plugins(plugins or [])
         self.config = config or {}
         self.parser = parser or (lambda x, *args, **kwargs: x)
@@ -33,14 +44,102 @@ class ServiceClient:
         self.base_path = base_path
         self.loop = loop or get_event_loop()
 
-        self.connector = TCPConnector(loop=self.loop, **self.config.get('connector', {}))
+        session_config = dict(self.config.get('session', {}))
+        self._execute_plugin_hooks_sync('prepare_session_config', session_config=session_config)
+
+        connector_config = self.config.get('connector', {})
+        shared_connector = self.config.get('shared_connector')
+        if shared_connector is None:
+            self.connector = TCPConnector(loop=self.loop, **connector_config)
+        else:
+            self.connector = connector_registry.acquire(shared_connector, self.loop, **connector_config)
+            # it is set only when connector is acquired, so it is not released by a client which did not get it
+            self.shared_connector = shared_connector
+            self._add_connector_limit(connector_config)
         self.session = ClientSession(connector=self.connector, loop=self.loop,
+                                     connector_owner=shared_connector is None,
                                      response_class=self.create_response,
-                                     **self.config.get('session', {}))
+                                     **session_config)
+
+        warm_up = self.config.get('warm_up')
+        self.warm_up_task = ensure_future(self.warm_up(warm_up), loop=self.loop) if warm_up else None
+
+    def _add_connector_limit(self, connector_config):
+        """
+        Shared connector is built using configuration of first service client which acquires it, so
+        connection limits of this service client are enforced by a ``ConnectorLimit`` plugin when
+        they are different.
+        """
+        limit = connector_config.get('limit', self.connector.limit)
+        if limit == self.connector.limit:
+            limit = 0
+        limit_per_host = connector_config.get('limit_per_host', self.connector.limit_per_host)
+        if limit_per_host == self.connector.limit_per_host:
+            limit_per_host = 0
+
+        if limit or limit_per_host:
+            from .plugins import ConnectorLimit
+            self.add_plugins([ConnectorLimit(limit=limit, limit_per_host=limit_per_host)])
+
+    async def warm_up(self, connections=1):
+        """
+        Opens connections to base path host (or to each one, when base path is a list of backends) and
+        parks them on connector, so first requests do not wait for DNS resolution, TCP and TLS handshakes.
+        Connector keeps them alive as long as its ``keepalive_timeout``.
+
+        :param connections: Number of connections to open to each host. It is capped by connector limits
+            (connector ``limit`` is shared by all hosts).
+        :type connections: int
+        :return: Number of connections opened.
+        """
+        connector = self.connector
+
+        if isinstance(self.base_path, (list, tuple)):
+            base_paths = self.base_path
+        else:
+            base_paths = [self.base_path]
+
+        if connector.limit:
+            connections = min(connections, max(connector.limit // len(base_paths), 1))
+        if connector.limit_per_host:
+            connections = min(connections, connector.limit_per_host)
+
+        async def open_connection(request):
+            # connection is released as soon as it is opened in order to not keep connector slots
+            # busy while other connections are opening
+            connection = await connector.connect(request, [], self.session.timeout)
+            connection.release()
+
+        requests = [ClientRequest('GET', URL(base_path), loop=self.loop) for base_path in base_paths]
+        results = await gather(*[open_connection(request) for request in requests for _ in range(connections)],
+                               return_exceptions=True)
+
+        opened = 0
+        for result in results:
+            if isinstance(result, BaseException):
+                self.logger.warning("Exception warming up connection to {0}: {1}".format(self.base_path, result))
+            else:
+                opened += 1
+
+        self.logger.debug("Warmed up {0} connections to {1}".format(opened, self.base_path))
+        return opened
 
     def create_response(self, *args, **kwargs):
-        response = ObjectWrapper(ClientResponse(*args, **kwargs))
+        return self.wrap_response(ClientResponse(*args, **kwargs))
+
+    def wrap_response(self, response):
+        """
+        Wraps a response and calls ``prepare_response`` plugin hooks.
+
+        :param response: Response object.
+        :return: ObjectWrapper
+        """
+        response = ObjectWrapper(response)
         task = current_task(loop=self.loop)
+        try:
+            task.call_info.set_phase(AWAITING_HEADERS)
+        except AttributeError:
+            pass
 
         self._execute_plugin_hooks_sync('prepare_response',
                                         endpoint_desc=task.endpoint_desc, session=task.session,
@@ -49,14 +148,70 @@ class ServiceClient:
 
         return response
 
+    @property
+    def in_flight(self):
+        """
+        Number of calls in progress, including those waiting on limit plugins.
+        """
+        return len(self._active_calls)
+
+    @property
+    def active_calls(self):
+        """
+        Calls in progress (:class:`~service_client.calls.CallInfo`), oldest first.
+        """
+        return list(self._active_calls.values())
+
+    def count_active_calls(self, phase=None, endpoint=None, older_than=None):
+        """
+        Counts calls in progress.
+
+        :param phase: Only count calls on this phase.
+        :type phase: str
+        :param endpoint: Only count calls to this endpoint.
+        :type endpoint: str
+        :param older_than: Only count calls started more than these seconds ago.
+        :type older_than: float
+        :return: int
+        """
+        return sum(1 for call_info in self._active_calls.values()
+                   if (phase is None or call_info.phase == phase) and
+                   (endpoint is None or call_info.endpoint == endpoint) and
+                   (older_than is None or call_info.elapsed > older_than))
+
     async def call(self, endpoint, payload=None, **kwargs):
+        if self.closing:
+            raise ConnectionClosedError('Service client {0} is closed'.format(self.name))
+
+        call_info = CallInfo(endpoint)
+        key = id(call_info)
+        self._active_calls[key] = call_info
+        try:
+            return await self._call(call_info, endpoint, payload, **kwargs)
+        finally:
+            del self._active_calls[key]
+            if not self._active_calls and self._drained is not None:
+                self._drained.set_result(None)
+                self._drained = None
+
+    async def _call(self, call_info, endpoint, payload=None, **kwargs):
         self.logger.debug("Calling service {0}...".format(endpoint))
         endpoint_desc = self.spec[endpoint].copy()
         endpoint_desc['endpoint'] = endpoint
 
         request_params = kwargs
         session = await self.prepare_session(endpoint_desc, request_params)
+        call_info.session = session
+        session.override_attr('call_info', call_info)
+
+        try:
+            return await self._call_endpoint(call_info, endpoint, endpoint_desc, session, request_params, payload)
+        finally:
+            # it runs even when call is cancelled, so plugins could release resources taken by call
+            self._execute_plugin_hooks_sync('on_call_end', endpoint_desc=endpoint_desc, session=session,
+                                            request_params=request_params)
 
+    async def _call_endpoint(self, call_info, endpoint, endpoint_desc, session, request_params, payload):
         request_params['url'] = URL((await self.generate_path(endpoint_desc, session, request_params)))
         request_params['method'] = endpoint_desc.get('method', 'GET').upper()
 
@@ -67,6 +222,7 @@ class ServiceClient:
                                                                     request_params['url']))
 
         payload = await self.prepare_payload(endpoint_desc, session, request_params, payload)
+        profiler = self.profiler
         try:
             if request_params['method'] not in ['GET', 'DELETE']:
                 try:
@@ -77,17 +233,25 @@ class ServiceClient:
                     if stream_request:
                         request_params['data'] = payload
                     else:
-                        request_params['data'] = self.serializer(payload, session=session,
-                                                                 endpoint_desc=endpoint_desc,
-                                                                 request_params=request_params)
+                        serializer = self.serializer
+                        if profiler is not None:
+                            serializer = profiler.wrap(Profiler.SERIALIZER, endpoint, serializer)
+                        request_params['data'] = serializer(payload, session=session,
+                                                            endpoint_desc=endpoint_desc,
+                                                            request_params=request_params)
 
             await self.before_request(endpoint_desc, session, request_params)
             task = current_task(loop=self.loop)
             task.session = session
             task.endpoint_desc = endpoint_desc
             task.request_params = request_params
+            task.call_info = call_info
 
-            response = await session.request(**request_params)
+            call_info.set_phase(CONNECTING)
+            request = session.request
+            if profiler is not None:
+                request = profiler.wrap_async(Profiler.IO, endpoint, request)
+            response = await request(**request_params)
         except Exception as ex:
             self.logger.warning("Exception calling service {0}: {1}".format(endpoint, ex))
             await self.on_exception(endpoint_desc, session, request_params, ex)
@@ -101,14 +265,22 @@ class ServiceClient:
         except KeyError:
             pass
 
+        call_info.set_phase(READING)
+        parser = self.parser
+        read = response.read
+        if profiler is not None:
+            parser = profiler.wrap(Profiler.PARSER, endpoint, parser)
+            read = profiler.wrap_async(Profiler.IO, endpoint, read)
+
         try:
-            data = await response.read()
+            data = await read()
             await self.on_read(endpoint_desc, session, request_params, response)
             self.logger.info("Parsing response from {0}...".format(endpoint))
-            response.data = self.parser(data,
-                                        session=session,
-                                        endpoint_desc=endpoint_desc,
-                                        response=response)
+            call_info.set_phase(PARSING)
+            response.data = parser(data,
+                                   session=session,
+                                   endpoint_desc=endpoint_desc,
+                                   response=response)
             await self.on_parsed_response(endpoint_desc, session, request_params, response)
         except Exception as ex:
             self.logger.warning("[Response code: {0}] Exception parsing response from service "
@@ -125,14 +297,29 @@ class ServiceClient:
                                          request_params=request_params)
         return session
 
+    async def prepare_base_path(self, endpoint_desc, session, request_params):
+        base_path = self.base_path
+        hooks = self._get_hooks('prepare_base_path')
+        self.logger.debug("Calling {0} plugin hooks...".format('prepare_base_path'))
+        for func in hooks:
+            try:
+                base_path = await func(endpoint_desc=endpoint_desc, session=session,
+                                       request_params=request_params, base_path=base_path)
+            except Exception as ex:  # pragma: no cover
+                self.logger.error("Exception executing {0}".format(repr(func)))
+                self.logger.exception(ex)
+                raise
+
+        return base_path
+
     async def generate_path(self, endpoint_desc, session, request_params):
+        base_path = await self.prepare_base_path(endpoint_desc, session, request_params)
         path = endpoint_desc.get('path', '')
-        url = list(urlparse(self.base_path))
+        url = list(urlparse(base_path))
         url[2] = '/'.join([url[2].rstrip('/'), path.lstrip('/')])
         url.pop()
         path = urlunsplit(url)
-        hooks = [getattr(plugin, 'prepare_path') for plugin in self._plugins
-                 if hasattr(plugin, 'prepare_path')]
+        hooks = self._get_hooks('prepare_path')
         self.logger.debug("Calling {0} plugin hooks...".format('prepare_path'))
         for func in hooks:
             try:
@@ -150,8 +337,7 @@ class ServiceClient:
                                          session=session, request_params=request_params)
 
     async def prepare_payload(self, endpoint_desc, session, request_params, payload):
-        hooks = [getattr(plugin, 'prepare_payload') for plugin in self._plugins
-                 if hasattr(plugin, 'prepare_payload')]
+        hooks = self._get_hooks('prepare_payload')
         self.logger.debug("Calling {0} plugin hooks...".format('prepare_payload'))
         for func in hooks:
             try:
@@ -187,8 +373,19 @@ class ServiceClient:
         await self._execute_plugin_hooks('on_parsed_response', endpoint_desc=endpoint_desc, session=session,
                                          request_params=request_params, response=response)
 
+    def _get_hooks(self, hook, plugins=None, sync=False):
+        if plugins is None:
+            plugins = self._plugins
+
+        if self.profiler is None:
+            return [getattr(plugin, hook) for plugin in plugins if hasattr(plugin, hook)]
+
+        wrap = self.profiler.wrap if sync else self.profiler.wrap_async
+        return [wrap(Profiler.HOOKS, '{}.{}'.format(type(plugin).__name__, hook), getattr(plugin, hook))
+                for plugin in plugins if hasattr(plugin, hook)]
+
     async def _execute_plugin_hooks(self, hook, *args, **kwargs):
-        hooks = [getattr(plugin, hook) for plugin in self._plugins if hasattr(plugin, hook)]
+        hooks = self._get_hooks(hook)
         self.logger.debug("Calling {0} plugin hooks...".format(hook))
         for func in hooks:
             try:
@@ -202,7 +399,7 @@ class ServiceClient:
         self._execute_plugin_hooks_sync_base(self._plugins, hook, *args, **kwargs)
 
     def _execute_plugin_hooks_sync_base(self, plugins, hook, *args, **kwargs):
-        hooks = [getattr(plugin, hook) for plugin in plugins if hasattr(plugin, hook)]
+        hooks = self._get_hooks(hook, plugins, sync=True)
         self.logger.debug("Calling {0} plugin hooks...".format(hook))
         for func in hooks:
             try:
@@ -227,10 +424,69 @@ class ServiceClient:
         """
         Close service client and its plugins.
         """
+        self.closing = True
         self._execute_plugin_hooks_sync(hook='close')
 
-        if not self.session.closed:
-            ensure_future(self.session.close(), loop=self.loop)
+        for closing in self._close_session():
+            ensure_future(closing, loop=self.loop)
+
+    async def drain(self, timeout=None):
+        """
+        Waits until in-flight calls finish.
+
+        :param timeout: Maximum time to wait, in seconds. **Default:** no limit.
+        :type timeout: float
+        :return: True if every in-flight call finished, otherwise False.
+        """
+        if not self._active_calls:
+            return True
+
+        if self._drained is None:
+            self._drained = self.loop.create_future()
+
+        try:
+            await wait_for(shield(self._drained), timeout)
+        except TimeoutError:
+            return False
+        return True
+
+    async def aclose(self, drain_timeout=None):
+        """
+        Close service client gracefully. New calls raise ``ConnectionClosedError`` while in-flight
+        calls (even those waiting on limit plugins) are allowed to finish up to ``drain_timeout``
+        seconds. Then plugins are closed (awaiting their ``wait_closed`` hooks) and session is closed
+        and awaited.
+
+        :param drain_timeout: Maximum time to wait for in-flight calls, in seconds. **Default:** no limit.
+        :type drain_timeout: float
+        :return: True if every in-flight call finished, otherwise False.
+        """
+        self.closing = True
+        drained = await self.drain(drain_timeout)
+        if not drained:
+            self.logger.warning("Closing service client {0} with {1} calls in flight".format(self.name,
+                                                                                             self.in_flight))
+
+        self._execute_plugin_hooks_sync(hook='close')
+        await self._execute_plugin_hooks('wait_closed')
+
+        for closing in self._close_session():
+            await closing
+
+        return drained
+
+    def _close_session(self):
+        if self.warm_up_task is not None and not self.warm_up_task.done():
+            self.warm_up_task.cancel()
+
+        if self.session is not None and not self.session.closed:
+            yield self.session.close()
+
+        if self.shared_connector is not None:
+            connector_closed = connector_registry.release(self.shared_connector, self.loop)
+            self.shared_connector = None
+            if connector_closed is not None:
+                yield connector_closed
 
     def __del__(self):  # pragma: no cover
         self.close()
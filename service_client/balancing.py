@@ -0,0 +1,338 @@
+from asyncio import TimeoutError
+from bisect import bisect
+from hashlib import blake2b
+from itertools import count
+from random import Random
+from time import monotonic
+
+from aiohttp import ClientError
+
+from .plugins import BasePlugin
+
+
+class Backend:
+    """
+    Backend state used by balancing policies.
+    """
+
+    __slots__ = ('base_path', 'outstanding', 'ewma', 'requests', 'errors', 'consecutive_errors',
+                 'ejections', 'ejected_until')
+
+    def __init__(self, base_path):
+        self.base_path = base_path
+        self.outstanding = 0
+        self.ewma = None
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.ejections = 0
+        self.ejected_until = None
+
+    def is_ejected(self, now):
+        return self.ejected_until is not None and now < self.ejected_until
+
+    def as_dict(self):
+        return {'base_path': self.base_path,
+                'outstanding': self.outstanding,
+                'ewma': self.ewma,
+                'requests': self.requests,
+                'errors': self.errors,
+                'ejected': self.is_ejected(monotonic())}
+
+    def __repr__(self):
+        return '<Backend {}>'.format(self.base_path)
+
+
+class BasePolicy:
+    """
+    Balancing policy. It chooses a backend from a non-empty list of available backends.
+    """
+
+    def __init__(self, seed=None):
+        self.random = Random(seed)
+
+    def choose(self, backends, endpoint_desc, request_params):
+        raise NotImplementedError()
+
+
+class RoundRobinPolicy(BasePolicy):
+
+    def __init__(self, seed=None):
+        super(RoundRobinPolicy, self).__init__(seed=seed)
+        self._counter = count()
+
+    def choose(self, backends, endpoint_desc, request_params):
+        return backends[next(self._counter) % len(backends)]
+
+
+class LeastOutstandingPolicy(BasePolicy):
+    """
+    It chooses backend with less requests in progress. Ties are broken randomly.
+    """
+
+    def choose(self, backends, endpoint_desc, request_params):
+        least = min(b.outstanding for b in backends)
+        candidates = [b for b in backends if b.outstanding == least]
+        if len(candidates) == 1:
+            return candidates[0]
+        return self.random.choice(candidates)
+
+
+class PowerOfTwoChoicesPolicy(BasePolicy):
+    """
+    It chooses two backends randomly and it uses the one with less requests in progress.
+    """
+
+    def _score(self, backend):
+        return backend.outstanding
+
+    def choose(self, backends, endpoint_desc, request_params):
+        if len(backends) == 1:
+            return backends[0]
+
+        first, second = self.random.sample(backends, 2)
+        return first if self._score(first) <= self._score(second) else second
+
+
+class EWMAPolicy(PowerOfTwoChoicesPolicy):
+    """
+    Power of two choices using exponentially weighted moving average of latency (time to response headers)
+    multiplied by requests in progress. Backends without latency samples are preferred.
+    """
+
+    def _score(self, backend):
+        if backend.ewma is None:
+            return -1
+        return backend.ewma * (backend.outstanding + 1)
+
+
+_MASK64 = 0xffffffffffffffff
+
+
+def _hash(value):
+    return int.from_bytes(blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+
+def _mix(value):
+    # splitmix64 finalizer
+    value = ((value ^ (value >> 30)) * 0xbf58476d1ce4e5b9) & _MASK64
+    value = ((value ^ (value >> 27)) * 0x94d049bb133111eb) & _MASK64
+    return value ^ (value >> 31)
+
+
+class ConsistentHashPolicy(BasePolicy):
+    """
+    It chooses backend by consistent hashing of a request key, so requests with same key go to same backend
+    and adding or removing a backend only remaps keys of that backend. Requests without key are balanced
+    using ``fallback`` policy.
+
+    Key is taken from request parameters (path tokens), query parameters or endpoint defaults (``path_tokens``
+    and ``query_params``).
+
+    :param key: Name of path token or query parameter, or a function which gets ``endpoint_desc`` and
+        ``request_params`` and returns key (or None).
+    :param method: ``rendezvous`` (highest random weight, O(backends) per request) or ``ring``
+        (hash ring with virtual nodes, O(log(backends * virtual_nodes)) per request).
+    :type method: str
+    :param virtual_nodes: Virtual nodes by backend on ring.
+    :type virtual_nodes: int
+    :param fallback: Policy used for requests without key. **Default:** round robin.
+    """
+
+    def __init__(self, key, method='rendezvous', virtual_nodes=100, fallback=None, seed=None):
+        super(ConsistentHashPolicy, self).__init__(seed=seed)
+        if method not in ('rendezvous', 'ring'):
+            raise ValueError('Unknown consistent hash method: {}'.format(method))
+
+        self.key = key
+        self.method = method
+        self.virtual_nodes = virtual_nodes
+        self.fallback = fallback or RoundRobinPolicy()
+        self._backend_hashes = {}
+        self._ring_members = None
+        self._ring_hashes = None
+        self._ring_backends = None
+
+    def get_key(self, endpoint_desc, request_params):
+        if callable(self.key):
+            return self.key(endpoint_desc, request_params)
+
+        key = self.key
+        for values in (request_params, request_params.get('params') or {},
+                       endpoint_desc.get('path_tokens') or {}, endpoint_desc.get('query_params') or {}):
+            try:
+                return values[key]
+            except KeyError:
+                pass
+        return None
+
+    def _backend_hash(self, backend):
+        try:
+            return self._backend_hashes[backend.base_path]
+        except KeyError:
+            pass
+
+        value = self._backend_hashes[backend.base_path] = _hash(backend.base_path)
+        return value
+
+    def _choose_rendezvous(self, backends, key):
+        key_hash = _hash(str(key))
+        return max(backends, key=lambda backend: _mix(key_hash ^ self._backend_hash(backend)))
+
+    def _build_ring(self, backends):
+        ring = sorted(((_hash('{}#{}'.format(backend.base_path, i)), backend)
+                       for backend in backends for i in range(self.virtual_nodes)), key=lambda node: node[0])
+        self._ring_hashes = [h for h, _ in ring]
+        self._ring_backends = [backend for _, backend in ring]
+        self._ring_members = list(backends)
+
+    def _choose_ring(self, backends, key):
+        if self._ring_members != backends:
+            self._build_ring(backends)
+
+        index = bisect(self._ring_hashes, _hash(str(key)))
+        return self._ring_backends[index % len(self._ring_backends)]
+
+    def choose(self, backends, endpoint_desc, request_params):
+        key = self.get_key(endpoint_desc, request_params)
+        if key is None:
+            return self.fallback.choose(backends, endpoint_desc, request_params)
+
+        if len(backends) == 1:
+            return backends[0]
+
+        if self.method == 'ring':
+            return self._choose_ring(backends, key)
+        return self._choose_rendezvous(backends, key)
+
+
+POLICIES = {'round_robin': RoundRobinPolicy,
+            'least_outstanding': LeastOutstandingPolicy,
+            'power_of_two_choices': PowerOfTwoChoicesPolicy,
+            'ewma': EWMAPolicy}
+
+
+class LoadBalancer(BasePlugin):
+    """
+    Client-side load balancing. It chooses a backend base path for each request using a policy.
+    Backends which fail ``consecutive_errors`` times in a row (exceptions or server error responses)
+    are ejected during ``ejection_time`` seconds (doubled on each ejection, up to ``max_ejection_time``).
+    No more than ``max_ejection_ratio`` of backends are ejected at same time.
+
+    Latency is measured since ``before_request`` hook, so place it after limit plugins.
+
+    :param backends: Backend base paths. **Default:** service client ``base_path`` (a list of base paths).
+    :type backends: list
+    :param policy: Policy name (``round_robin``, ``least_outstanding``, ``power_of_two_choices`` or ``ewma``)
+        or policy object. **Default:** ``round_robin``
+    :param ewma_alpha: Weight of new latency samples on moving average.
+    :type ewma_alpha: float
+    :param consecutive_errors: Consecutive errors to eject a backend. ``None`` disables ejection.
+    :type consecutive_errors: int
+    :param ejection_time: Seconds a backend is ejected first time.
+    :type ejection_time: float
+    :param max_ejection_time: Maximum seconds a backend is ejected.
+    :type max_ejection_time: float
+    :param max_ejection_ratio: Maximum ratio of backends ejected.
+    :type max_ejection_ratio: float
+    """
+
+    def __init__(self, backends=None, policy='round_robin', ewma_alpha=0.3, consecutive_errors=5,
+                 ejection_time=30, max_ejection_time=300, max_ejection_ratio=0.5):
+        self.policy = POLICIES[policy]() if isinstance(policy, str) else policy
+        self.ewma_alpha = ewma_alpha
+        self.consecutive_errors = consecutive_errors
+        self.ejection_time = ejection_time
+        self.max_ejection_time = max_ejection_time
+        self.max_ejection_ratio = max_ejection_ratio
+        self.backends = []
+        if backends is not None:
+            self.set_backends(backends)
+
+    def set_backends(self, base_paths):
+        """
+        Replaces backends. State of backends which are kept (requests in progress, latency, ejection) is preserved.
+
+        :param base_paths: Backend base paths.
+        :type base_paths: list
+        """
+        if isinstance(base_paths, str):
+            base_paths = [base_paths]
+
+        current = {backend.base_path: backend for backend in self.backends}
+        self.backends = [current.get(base_path) or Backend(base_path) for base_path in base_paths]
+
+    def get_available_backends(self):
+        now = monotonic()
+        available = [backend for backend in self.backends if not backend.is_ejected(now)]
+        if not available:
+            return self.backends
+        return available
+
+    async def prepare_base_path(self, endpoint_desc, session, request_params, base_path):
+        if not self.backends:
+            self.set_backends(base_path)
+
+        backend = self.policy.choose(self.get_available_backends(), endpoint_desc, request_params)
+        backend.outstanding += 1
+        backend.requests += 1
+        session.override_attr('backend', backend)
+        return backend.base_path
+
+    async def before_request(self, endpoint_desc, session, request_params):
+        session.override_attr('backend_start', monotonic())
+
+    def _record_result(self, session, failed):
+        try:
+            backend = session.backend
+        except AttributeError:
+            return
+
+        if not failed:
+            backend.consecutive_errors = 0
+            return
+
+        backend.errors += 1
+        backend.consecutive_errors += 1
+        if self.consecutive_errors is not None and backend.consecutive_errors >= self.consecutive_errors:
+            self._eject(backend)
+
+    def _eject(self, backend):
+        now = monotonic()
+        if backend.is_ejected(now):
+            return
+
+        ejected = sum(1 for b in self.backends if b.is_ejected(now))
+        if ejected + 1 > len(self.backends) * self.max_ejection_ratio:
+            return
+
+        backend.ejected_until = now + min(self.ejection_time * 2 ** backend.ejections, self.max_ejection_time)
+        backend.ejections += 1
+        backend.consecutive_errors = 0
+        self.service_client.logger.warning("Backend {0} ejected".format(backend.base_path))
+
+    async def on_response(self, endpoint_desc, session, request_params, response):
+        try:
+            elapsed = monotonic() - session.backend_start
+        except AttributeError:
+            pass
+        else:
+            backend = session.backend
+            if backend.ewma is None:
+                backend.ewma = elapsed
+            else:
+                backend.ewma += self.ewma_alpha * (elapsed - backend.ewma)
+
+        self._record_result(session, response.status >= 500)
+
+    async def on_exception(self, endpoint_desc, session, request_params, ex):
+        # exceptions not related with backend (like limit plugins ones) are neither errors nor successes
+        if isinstance(ex, (ClientError, TimeoutError, OSError)):
+            self._record_result(session, True)
+
+    def on_call_end(self, endpoint_desc, session, request_params):
+        # it runs on cancelled calls and on errors before request, too
+        try:
+            session.backend.outstanding -= 1
+        except AttributeError:
+            pass
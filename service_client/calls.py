@@ -0,0 +1,64 @@
+from time import monotonic
+
+PREPARING = 'preparing'
+QUEUED = 'queued'
+CONNECTING = 'connecting'
+AWAITING_HEADERS = 'awaiting_headers'
+READING = 'reading'
+PARSING = 'parsing'
+
+PHASES = (PREPARING, QUEUED, CONNECTING, AWAITING_HEADERS, READING, PARSING)
+
+
+class CallInfo:
+    """
+    Service client call in progress. Service client keeps them while calls are in progress
+    (see ``ServiceClient.active_calls``) and updates their phase:
+
+    - ``preparing``: running plugin hooks before request.
+    - ``queued``: waiting on a limit plugin (``Pool`` or ``RateLimit``).
+    - ``connecting``: waiting for a connection (and sending request).
+    - ``awaiting_headers``: request sent, waiting for response headers.
+    - ``reading``: reading response body.
+    - ``parsing``: parsing response body.
+    """
+
+    __slots__ = ('endpoint', 'session', 'start', 'phase', 'phase_start')
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.session = None
+        self.start = self.phase_start = monotonic()
+        self.phase = PREPARING
+
+    def set_phase(self, phase):
+        self.phase = phase
+        self.phase_start = monotonic()
+
+    @property
+    def tracking_token(self):
+        return getattr(self.session, 'tracking_token', None)
+
+    @property
+    def elapsed(self):
+        """
+        Seconds since call started.
+        """
+        return monotonic() - self.start
+
+    @property
+    def phase_elapsed(self):
+        """
+        Seconds since call entered its current phase.
+        """
+        return monotonic() - self.phase_start
+
+    def as_dict(self):
+        return {'endpoint': self.endpoint,
+                'tracking_token': self.tracking_token,
+                'phase': self.phase,
+                'elapsed': self.elapsed,
+                'phase_elapsed': self.phase_elapsed}
+
+    def __repr__(self):
+        return '<CallInfo {} {} {:.3f}s>'.format(self.endpoint, self.phase, self.elapsed)
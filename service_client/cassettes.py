@@ -0,0 +1,203 @@
+import json
+import os
+from hashlib import sha1
+from time import monotonic
+
+from yarl import URL
+
+from .plugins import BasePlugin
+
+INDEX_FILENAME = 'index.ndjson'
+BODIES_DIRNAME = 'bodies'
+
+_SKIP_HEADERS = frozenset(['content-encoding', 'content-length', 'transfer-encoding'])
+
+
+class NoRecordError(KeyError):
+    pass
+
+
+def _body_bytes(data):
+    if data is None:
+        return b''
+    if isinstance(data, (bytes, bytearray)):
+        return bytes(data)
+    if isinstance(data, str):
+        return data.encode()
+    return str(data).encode()
+
+
+def fingerprint(method, url, params=None, data=None):
+    """
+    Builds request fingerprint using method, url (query parameters sorted) and body.
+
+    :param method: Request method.
+    :type method: str
+    :param url: Request url.
+    :type url: str or yarl.URL
+    :param params: Query parameters.
+    :param data: Request body.
+    :return: str
+    """
+    url = URL(url)
+    if params:
+        url = url.update_query(params)
+    query = sorted(url.query.items())
+    url = url.with_query(None)
+
+    h = sha1()
+    h.update(method.upper().encode())
+    h.update(b' ')
+    h.update(str(url).encode())
+    h.update(b'?')
+    h.update('&'.join('{}={}'.format(k, v) for k, v in query).encode())
+    h.update(b'\n')
+    h.update(_body_bytes(data))
+    return h.hexdigest()
+
+
+class Recorder(BasePlugin):
+    """
+    It records requests and responses on a cassette: a directory with an index file (one JSON line
+    by response) and a directory with response bodies, named by their hash.
+
+    Stream responses are not recorded.
+
+    :param path: Cassette directory.
+    :type path: str
+    :param endpoints: Endpoints to record. **Default:** all
+    :type endpoints: list
+    """
+
+    def __init__(self, path, endpoints=None):
+        self.path = path
+        self.endpoints = frozenset(endpoints) if endpoints is not None else None
+        self._index = None
+
+    def _must_record(self, endpoint_desc):
+        if endpoint_desc.get('stream_response', False):
+            return False
+        return self.endpoints is None or endpoint_desc['endpoint'] in self.endpoints
+
+    def _open_index(self):
+        if self._index is None:
+            os.makedirs(os.path.join(self.path, BODIES_DIRNAME), exist_ok=True)
+            self._index = open(os.path.join(self.path, INDEX_FILENAME), 'a')
+        return self._index
+
+    def _write_body(self, body):
+        name = sha1(body).hexdigest()
+        filename = os.path.join(self.path, BODIES_DIRNAME, name)
+        if not os.path.exists(filename):
+            with open(filename, 'wb') as f:
+                f.write(body)
+        return name
+
+    async def before_request(self, endpoint_desc, session, request_params):
+        if not self._must_record(endpoint_desc):
+            return
+
+        session.override_attr('recorder_start', monotonic())
+        session.override_attr('recorder_fingerprint', fingerprint(request_params['method'],
+                                                                  request_params['url'],
+                                                                  request_params.get('params'),
+                                                                  request_params.get('data')))
+
+    async def on_response(self, endpoint_desc, session, request_params, response):
+        if self._must_record(endpoint_desc):
+            session.override_attr('recorder_headers_elapsed', monotonic() - session.recorder_start)
+
+    async def on_read(self, endpoint_desc, session, request_params, response):
+        if not self._must_record(endpoint_desc):
+            return
+
+        index = self._open_index()
+        body = await response.read()
+        record = {'service_name': self.service_client.name,
+                  'endpoint': endpoint_desc['endpoint'],
+                  'method': request_params['method'],
+                  'url': str(request_params['url']),
+                  'fingerprint': session.recorder_fingerprint,
+                  'status': response.status,
+                  'headers': [[k, v] for k, v in response.headers.items() if k.lower() not in _SKIP_HEADERS],
+                  'body': self._write_body(body),
+                  'headers_elapsed': session.recorder_headers_elapsed,
+                  'elapsed': monotonic() - session.recorder_start}
+
+        index.write(json.dumps(record) + '\n')
+        index.flush()
+
+    def close(self):
+        if self._index is not None:
+            self._index.close()
+            self._index = None
+
+
+class Cassette:
+    """
+    Recorded responses indexed by request fingerprint. Responses with same fingerprint are
+    returned in recording order, starting again after the last one.
+
+    :param path: Cassette directory.
+    :type path: str
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.records = {}
+        self._positions = {}
+        self._bodies = {}
+
+        with open(os.path.join(path, INDEX_FILENAME)) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                self.records.setdefault(record['fingerprint'], []).append(record)
+
+    def next_record(self, fingerprint):
+        try:
+            records = self.records[fingerprint]
+        except KeyError:
+            raise NoRecordError(fingerprint)
+
+        position = self._positions.get(fingerprint, 0)
+        self._positions[fingerprint] = (position + 1) % len(records)
+        return records[position]
+
+    def load_body(self, record):
+        name = record['body']
+        try:
+            return self._bodies[name]
+        except KeyError:
+            pass
+
+        with open(os.path.join(self.path, BODIES_DIRNAME, name), 'rb') as f:
+            body = self._bodies[name] = f.read()
+        return body
+
+
+_cassettes = {}
+
+
+def load_cassette(path):
+    """
+    Loads a cassette. Cassettes are cached until their index file changes.
+
+    :param path: Cassette directory.
+    :type path: str
+    :return: Cassette
+    """
+    stat = os.stat(os.path.join(path, INDEX_FILENAME))
+    version = (stat.st_mtime_ns, stat.st_size)
+    try:
+        cached_version, cassette = _cassettes[path]
+    except KeyError:
+        pass
+    else:
+        if cached_version == version:
+            return cassette
+
+    cassette = Cassette(path)
+    _cassettes[path] = (version, cassette)
+    return cassette
@@ -0,0 +1,72 @@
+from aiohttp.connector import TCPConnector
+
+
+class ConnectorRegistry:
+    """
+    Named connectors shared by service clients. A connector is built when it is acquired first time
+    (using parameters of that acquisition, next acquisitions get same connector whatever their parameters
+    are) and it is closed when last service client releases it.
+
+    Connectors are bound to an event loop, so same name on different loops means different connectors.
+    """
+
+    def __init__(self):
+        self._connectors = {}
+        self._refs = {}
+
+    def acquire(self, name, loop, **kwargs):
+        """
+        Gets a shared connector and increases its reference counter.
+
+        :param name: Connector name.
+        :type name: str
+        :param loop: Event loop.
+        :param kwargs: ``TCPConnector`` parameters. They are only used when connector is built.
+        :return: aiohttp.TCPConnector
+        """
+        key = (name, loop)
+        try:
+            connector = self._connectors[key]
+        except KeyError:
+            connector = None
+
+        if connector is None or connector.closed:
+            connector = self._connectors[key] = TCPConnector(loop=loop, **kwargs)
+            self._refs[key] = 0
+
+        self._refs[key] += 1
+        return connector
+
+    def release(self, name, loop):
+        """
+        Decreases connector reference counter. Connector is closed when nobody uses it.
+
+        :param name: Connector name.
+        :type name: str
+        :param loop: Event loop.
+        :return: Connector close awaitable when it is closed, otherwise None.
+        """
+        key = (name, loop)
+        self._refs[key] -= 1
+        if self._refs[key] > 0:
+            return None
+
+        del self._refs[key]
+        return self._connectors.pop(key).close()
+
+    def get(self, name, loop):
+        """
+        Gets a shared connector without acquiring it.
+
+        :return: aiohttp.TCPConnector or None
+        """
+        return self._connectors.get((name, loop))
+
+    def ref_count(self, name, loop):
+        return self._refs.get((name, loop), 0)
+
+    def __len__(self):
+        return len(self._connectors)
+
+
+connector_registry = ConnectorRegistry()
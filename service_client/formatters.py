@@ -1,6 +1,13 @@
+import json
+import re
+from collections.abc import Mapping
+from datetime import timedelta
 from http.server import BaseHTTPRequestHandler
-from logging import Formatter, PercentStyle, StrFormatStyle, StringTemplateStyle
-from urllib.parse import urlencode
+from logging import Formatter, PercentStyle, StrFormatStyle, StringTemplateStyle, makeLogRecord
+from string import Formatter as StringFormatter, Template
+from urllib.parse import quote_plus, urlencode
+
+from .log_dispatchers import ExceptionSnapshot
 
 _STYLES = {
     '%': PercentStyle,
@@ -8,14 +15,87 @@ _STYLES = {
     '$': StringTemplateStyle,
 }
 
+_STATUS_TEXTS = {int(status): texts[0] for status, texts in BaseHTTPRequestHandler.responses.items()}
+
+_PERCENT_FIELD = re.compile(r'%\((\w+)\)')
+_TEMPLATE_FIELD = re.compile(r'\$(?:(\w+)|\{(\w+)\})')
+_FIELD_ROOT = re.compile(r'[.\[]')
+# '~' is not included because quote_plus escapes it before Python 3.7
+_SAFE_QUERY_VALUE = re.compile(r'[A-Za-z0-9_.-]*')
+
+_RECORD_ATTRS = frozenset(makeLogRecord({}).__dict__) | {'message', 'asctime'}
+
+
+def _referenced_fields(fmt, style):
+    if style == '%':
+        return set(_PERCENT_FIELD.findall(fmt))
+    if style == '$':
+        return {name or braced for name, braced in _TEMPLATE_FIELD.findall(fmt)}
+    return {_FIELD_ROOT.split(name, 1)[0] for _, name, _, _ in StringFormatter().parse(fmt) if name}
+
+
+def _compile_format(fmt, style):
+    """
+    Builds a function which renders format using a dictionary. Formats without fields are
+    rendered once.
+    """
+    if style == '%':
+        def render(data):
+            return fmt % data
+    elif style == '{':
+        render = fmt.format_map
+    else:
+        render = Template(fmt).substitute
+
+    if not _referenced_fields(fmt, style):
+        try:
+            text = render({})
+        except (KeyError, IndexError, ValueError):
+            return render
+
+        def render(data):
+            return text
+
+    return render
+
+
+def _quote_query_value(value):
+    if isinstance(value, bytes):
+        return quote_plus(value)
+    if not isinstance(value, str):
+        value = str(value)
+    if _SAFE_QUERY_VALUE.fullmatch(value):
+        return value
+    return quote_plus(value)
+
+
+def _urlencode(params):
+    """
+    Same result as ``urlencode(params)``, but keys and values which do not need quoting are not quoted.
+    """
+    try:
+        items = params.items()
+    except AttributeError:
+        return urlencode(params)
+    return '&'.join([_quote_query_value(k) + '=' + _quote_query_value(v) for k, v in items])
+
+
+def status_text(status_code):
+    return _STATUS_TEXTS.get(status_code, 'Unknown')
 
-class _FakeRecord:
 
-    def __init__(self, data):
-        self.__dict__.update(data)
+def exception_repr(ex):
+    if isinstance(ex, ExceptionSnapshot):
+        return repr(ex)
+    return "{type}('{message}')".format(type=type(ex).__name__, message=str(ex))
 
 
 class ServiceClientFormatter(Formatter):
+    """
+    Formats log records emitted by logger plugins. Formats are compiled when formatter is built and
+    derived fields (``headers``, ``elapsed``, ``status_text``, ``full_url``, ``query_params`` and
+    ``exception_repr``) are only computed when they are referenced by any format.
+    """
 
     def __init__(self, fmt=None, request_fmt='', response_fmt='',
                  exception_fmt='', parse_exception_fmt='',
@@ -24,67 +104,118 @@ class ServiceClientFormatter(Formatter):
 
         super(ServiceClientFormatter, self).__init__(fmt=fmt, datefmt=datefmt, style=style)
 
-        self._request_style = _STYLES[style](request_fmt)
-        self._response_style = _STYLES[style](response_fmt)
-        self._exception_style = _STYLES[style](exception_fmt)
-        self._parse_exception_style = _STYLES[style](parse_exception_fmt)
-        self._headers_style = _STYLES[style](headers_fmt)
+        self._format_request = _compile_format(request_fmt, style)
+        self._format_response = _compile_format(response_fmt, style)
+        self._format_exception = _compile_format(exception_fmt, style)
+        self._format_parse_exception = _compile_format(parse_exception_fmt, style)
+        self._format_header = _compile_format(headers_fmt, style)
         self._headers_sep = headers_sep
 
+        self._fields = set()
+        for f in (self._style._fmt, request_fmt, response_fmt, exception_fmt, parse_exception_fmt):
+            self._fields.update(_referenced_fields(f, style))
+
     def format_request_message(self, record):
-        return self._request_style.format(record)
+        return self._format_request(record.__dict__)
 
     def format_response_message(self, record):
-        return self._response_style.format(record)
+        return self._format_response(record.__dict__)
 
     def format_exception_message(self, record):
-        return self._exception_style.format(record)
+        return self._format_exception(record.__dict__)
 
     def format_parse_exception_message(self, record):
-        return self._parse_exception_style.format(record)
+        return self._format_parse_exception(record.__dict__)
 
     def formatMessage(self, record):
-        try:
-            record.headers = self._headers_sep.join([self._headers_style.format(_FakeRecord({'name': k, 'value': v}))
-                                                     for k, v in record.headers.items()])
-        except AttributeError:
-            pass
-
-        try:
-            record.elapsed = "{} ms".format(int(record.elapsed.total_seconds() * 1000))
-        except AttributeError:
-            pass
-
-        try:
-            record.status_text = BaseHTTPRequestHandler.responses[record.status_code][0]
-        except KeyError:
-            record.status_text = 'Unknown'
-        except AttributeError:
-            pass
-
-        record.full_url = record.url
-        try:
-            record.query_params = urlencode(record.params)
-            record.full_url = "?".join([record.full_url, record.query_params])
-        except AttributeError:
-            pass
-
-        try:
-            record.exception_repr = "{type}('{message}')".format(type=type(record.exception).__name__,
-                                                                 message=str(record.exception))
-        except AttributeError:
-            pass
+        fields = self._fields
+        data = record.__dict__
+
+        if 'headers' in fields:
+            try:
+                format_header = self._format_header
+                record.headers = self._headers_sep.join([format_header({'name': k, 'value': v})
+                                                         for k, v in record.headers.items()])
+            except AttributeError:
+                pass
+
+        if 'elapsed' in fields:
+            try:
+                record.elapsed = "{} ms".format(int(record.elapsed.total_seconds() * 1000))
+            except AttributeError:
+                pass
+
+        if 'status_text' in fields and 'status_code' in data:
+            record.status_text = status_text(data['status_code'])
+
+        if 'full_url' in fields or 'query_params' in fields:
+            record.full_url = record.url
+            if 'params' in data:
+                record.query_params = _urlencode(data['params'])
+                record.full_url = "?".join([record.full_url, record.query_params])
+
+        if 'exception_repr' in fields and 'exception' in data:
+            record.exception_repr = exception_repr(data['exception'])
 
         s = super(ServiceClientFormatter, self).formatMessage(record)
 
-        if record.action == 'REQUEST':
+        action = data.get('action')
+        if action == 'REQUEST':
             return s + self.format_request_message(record)
-        elif record.action == 'RESPONSE':
+        elif action == 'RESPONSE':
             return s + self.format_response_message(record)
-        elif record.action == 'EXCEPTION':
-            if hasattr(record, 'body'):
+        elif action == 'EXCEPTION':
+            if 'body' in data:
                 return s + self.format_parse_exception_message(record)
             else:
                 return s + self.format_exception_message(record)
         else:
             return s
+
+
+def _json_default(value):
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    if isinstance(value, Mapping):
+        return dict(value.items())
+    if isinstance(value, (BaseException, ExceptionSnapshot)):
+        return exception_repr(value)
+    if isinstance(value, bytes):
+        return value.decode('utf-8', errors='replace')
+    return str(value)
+
+
+class ServiceClientJsonFormatter(Formatter):
+    """
+    Formats log records as JSON lines. Each line contains ``timestamp``, ``level``, ``logger`` and
+    ``message`` keys besides fields added by logger plugins (or just ``fields`` when they are set).
+    Time deltas are written as seconds, exceptions using their representation and ``status_text``
+    is added to responses.
+
+    :param fields: Record fields to write. **Default:** all fields which are not standard log record attributes.
+    :type fields: list
+    """
+
+    def __init__(self, fields=None, datefmt=None):
+        super(ServiceClientJsonFormatter, self).__init__(datefmt=datefmt)
+        self.fields = tuple(fields) if fields is not None else None
+
+    def format(self, record):
+        data = record.__dict__
+        result = {'timestamp': self.formatTime(record, self.datefmt),
+                  'level': record.levelname,
+                  'logger': record.name,
+                  'message': record.getMessage()}
+
+        if self.fields is None:
+            result.update((k, v) for k, v in data.items() if k not in _RECORD_ATTRS)
+        else:
+            result.update((k, data[k]) for k in self.fields if k in data)
+
+        if 'status_code' in result:
+            result['status_text'] = status_text(result['status_code'])
+
+        if record.exc_info:
+            result['exc_info'] = self.formatException(record.exc_info)
+
+        return json.dumps(result, default=_json_default, ensure_ascii=False)
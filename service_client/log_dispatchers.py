@@ -0,0 +1,202 @@
+from collections.abc import Mapping
+from datetime import date, datetime, time as dt_time, timedelta
+from queue import Empty, Full, Queue
+from threading import Thread
+from time import time
+
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+
+_IMMUTABLE_TYPES = (str, bytes, int, float, bool, type(None), datetime, date, dt_time, timedelta, URL)
+
+
+class ExceptionSnapshot:
+    """
+    Immutable copy of an exception for log events emitted on a background thread.
+    """
+
+    __slots__ = ('type_name', 'message')
+
+    def __init__(self, ex):
+        self.type_name = type(ex).__name__
+        self.message = str(ex)
+
+    def __str__(self):
+        return self.message
+
+    def __repr__(self):
+        return "{}('{}')".format(self.type_name, self.message)
+
+
+class _Items(tuple):
+    """
+    Items of a mapping copied in a log event.
+    """
+
+
+class _CIItems(_Items):
+    """
+    Items of a case insensitive mapping (like headers) copied in a log event.
+    """
+
+
+def _snapshot(value):
+    if isinstance(value, _IMMUTABLE_TYPES):
+        return value
+    if isinstance(value, (CIMultiDict, CIMultiDictProxy)):
+        return _CIItems((str(k), _snapshot(v)) for k, v in value.items())
+    if isinstance(value, Mapping):
+        return _Items((str(k), _snapshot(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return tuple(_snapshot(v) for v in value)
+    if isinstance(value, BaseException):
+        return ExceptionSnapshot(value)
+    return str(value)
+
+
+def _restore(value):
+    if isinstance(value, _CIItems):
+        return CIMultiDictProxy(CIMultiDict((k, _restore(v)) for k, v in value))
+    if isinstance(value, _Items):
+        return {k: _restore(v) for k, v in value}
+    return value
+
+
+class QueueLogDispatcher:
+    """
+    It emits log events on a background thread, so log handlers I/O and formatting do not run on
+    event loop. Events are pushed to a bounded queue and, when it is full, they are dropped
+    depending on overflow policy:
+
+    - ``drop``: new event is dropped.
+    - ``drop_oldest``: oldest event on queue is dropped in order to enqueue new one.
+
+    Dropped events are counted on ``dropped`` attribute.
+
+    Log records are built on background thread, but their creation time is the moment event
+    was dispatched. Log data is copied when event is dispatched (mappings as tuples of items,
+    exceptions as :class:`ExceptionSnapshot` and other mutable objects as strings), so
+    background thread does not read objects used by calls.
+
+    :param logger: Logger used to emit events.
+    :type logger: logging.Logger
+    :param queue_size: Maximum number of events waiting to be emitted. **Default:** 1000
+    :type queue_size: int
+    :param overflow: Overflow policy. **Default:** ``drop``
+    :type overflow: str
+    """
+
+    OVERFLOW_DROP = 'drop'
+    OVERFLOW_DROP_OLDEST = 'drop_oldest'
+
+    def __init__(self, logger, queue_size=1000, overflow=OVERFLOW_DROP):
+        if overflow not in (self.OVERFLOW_DROP, self.OVERFLOW_DROP_OLDEST):
+            raise ValueError(overflow)
+
+        self.logger = logger
+        self.queue = Queue(maxsize=queue_size)
+        self.overflow = overflow
+        self.dropped = 0
+        self.errors = 0
+        self._thread = None
+        self._stopping = False
+        self._stop_requested = False
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+
+        self._stopping = self._stop_requested = False
+        self._thread = Thread(target=self._run, name='service_client-log-dispatcher', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=1):
+        """
+        Stops background thread after emitting events already dispatched.
+
+        Events dispatched while background thread is stopping are dropped. Once it has stopped, next
+        dispatched event starts it again.
+
+        :param timeout: Maximum seconds to wait for pending events. ``None`` means not to wait
+            (background thread stops after emitting them, use ``join`` to wait for it).
+        :type timeout: float
+        """
+        if not self.running:
+            return
+
+        if not self._stopping:
+            self._stopping = True
+            try:
+                self.queue.put_nowait(None)
+            except Full:
+                self._stop_requested = True
+
+        if timeout is not None:
+            self.join(timeout)
+
+    def join(self, timeout=1):
+        """
+        Waits for background thread to stop. It blocks, so do not call it on event loop.
+
+        :param timeout: Maximum seconds to wait.
+        :type timeout: float
+        :return: True if background thread is not running.
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                return False
+            self._thread = None
+        return True
+
+    def dispatch(self, level, message, log_data):
+        if not self.running:
+            self.start()
+        elif self._stopping:
+            self.dropped += 1
+            return
+
+        event = (time(), level, message, tuple((k, _snapshot(v)) for k, v in log_data.items()))
+        try:
+            self.queue.put_nowait(event)
+        except Full:
+            self.dropped += 1
+            if self.overflow == self.OVERFLOW_DROP_OLDEST:
+                try:
+                    self.queue.get_nowait()
+                except Empty:  # pragma: no cover
+                    pass
+                try:
+                    self.queue.put_nowait(event)
+                except Full:  # pragma: no cover
+                    pass
+
+    def _run(self):
+        while True:
+            event = self.queue.get()
+            if event is None:
+                break
+
+            try:
+                self.emit(*event)
+            except Exception:
+                self.errors += 1
+
+            if self._stop_requested and self.queue.empty():
+                break
+
+    def emit(self, created, level, message, log_data):
+        logger = self.logger
+        if not logger.isEnabledFor(level):
+            return
+
+        record = logger.makeRecord(logger.name, level, '(unknown file)', 0, message, (), None,
+                                   extra={k: _restore(v) for k, v in log_data})
+        record.relativeCreated -= (record.created - created) * 1000
+        record.created = created
+        record.msecs = (created - int(created)) * 1000
+        logger.handle(record)
@@ -0,0 +1,245 @@
+from math import frexp, inf, ldexp
+from time import monotonic
+
+from .plugins import BasePlugin
+
+
+class LatencyHistogram:
+    """
+    Log-bucketed histogram (HDR-like) for latencies in seconds. Every power of two of microseconds
+    is split in ``sub_buckets`` linear buckets, so relative error is bounded by ``1 / sub_buckets``
+    and memory is constant.
+
+    :param sub_buckets: Buckets for each power of two. **Default:** 8
+    :type sub_buckets: int
+    :param max_exponent: Greatest power of two of microseconds to track. Greater values
+        are counted in an overflow bucket. **Default:** 28 (~268 seconds)
+    :type max_exponent: int
+    """
+
+    def __init__(self, sub_buckets=8, max_exponent=28):
+        self.sub_buckets = sub_buckets
+        self.max_exponent = max_exponent
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * (self.max_exponent * self.sub_buckets + 2)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        micros = value * 1000000
+        if micros < 1:
+            return 0
+
+        mantissa, exponent = frexp(micros)
+        if exponent > self.max_exponent:
+            return len(self.counts) - 1
+
+        return (exponent - 1) * self.sub_buckets + int((mantissa * 2 - 1) * self.sub_buckets) + 1
+
+    def _upper_bound(self, index):
+        if index == 0:
+            return 0.000001
+        if index == len(self.counts) - 1:
+            return inf
+
+        exponent, sub = divmod(index - 1, self.sub_buckets)
+        return ldexp(1 + (sub + 1) / self.sub_buckets, exponent) / 1000000
+
+    def record(self, value):
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        """
+        Returns upper bound of bucket where percentile is placed. It never returns a value
+        greater than maximum recorded value.
+
+        :param percent: Percentile to calculate, from 0 to 100.
+        :type percent: float
+        :return: float or None if there are no values.
+        """
+        if not self.count:
+            return None
+
+        target = percent * self.count / 100
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if count and cumulative >= target:
+                return min(self._upper_bound(index), self.max)
+
+        return self.max  # pragma: no cover
+
+    def cumulative_buckets(self):
+        """
+        Cumulative counts for each power of two of microseconds. Bounds are always the same
+        in order to be used as Prometheus histogram buckets.
+
+        :return: Generator of tuples ``(upper_bound_seconds, cumulative_count)``.
+        """
+        cumulative = self.counts[0]
+        yield ldexp(1, 0) / 1000000, cumulative
+
+        for exponent in range(self.max_exponent):
+            start = exponent * self.sub_buckets + 1
+            cumulative += sum(self.counts[start:start + self.sub_buckets])
+            yield ldexp(1, exponent + 1) / 1000000, cumulative
+
+        yield inf, self.count
+
+    def snapshot(self):
+        return {'count': self.count,
+                'sum': self.sum,
+                'min': self.min,
+                'max': self.max,
+                'p50': self.percentile(50),
+                'p90': self.percentile(90),
+                'p99': self.percentile(99),
+                'p999': self.percentile(99.9)}
+
+
+class EndpointMetrics:
+
+    def __init__(self, sub_buckets=8):
+        self.responses = {}
+        self.latency = LatencyHistogram(sub_buckets=sub_buckets)
+        self.blocked_by_pool = LatencyHistogram(sub_buckets=sub_buckets)
+        self.blocked_by_ratelimit = LatencyHistogram(sub_buckets=sub_buckets)
+
+    def snapshot(self):
+        return {'responses': self.responses.copy(),
+                'latency': self.latency.snapshot(),
+                'blocked_by_pool': self.blocked_by_pool.snapshot(),
+                'blocked_by_ratelimit': self.blocked_by_ratelimit.snapshot()}
+
+
+class Metrics(BasePlugin):
+    """
+    It keeps counters of responses by status class and latency histograms for each endpoint.
+    Latency is measured from session preparation until response headers are received, so it includes
+    time blocked by Pool or RateLimit plugins. Time blocked by them is tracked on its own histograms too.
+
+    :param sub_buckets: Histograms buckets for each power of two. **Default:** 8
+    :type sub_buckets: int
+    """
+
+    EXCEPTION_STATUS_CLASS = 'exception'
+
+    def __init__(self, sub_buckets=8):
+        self.sub_buckets = sub_buckets
+        self.endpoints = {}
+
+    def reset(self):
+        self.endpoints = {}
+
+    def _get_endpoint_metrics(self, endpoint):
+        try:
+            return self.endpoints[endpoint]
+        except KeyError:
+            metrics = self.endpoints[endpoint] = EndpointMetrics(sub_buckets=self.sub_buckets)
+            return metrics
+
+    def _record(self, endpoint_desc, session, status_class):
+        metrics = self._get_endpoint_metrics(endpoint_desc['endpoint'])
+
+        try:
+            metrics.responses[status_class] += 1
+        except KeyError:
+            metrics.responses[status_class] = 1
+
+        try:
+            metrics.latency.record(monotonic() - session.metrics_start)
+        except AttributeError:  # pragma: no cover
+            pass
+
+        blocked = getattr(session, 'blocked_by_pool', None)
+        if blocked is not None:
+            metrics.blocked_by_pool.record(blocked)
+
+        blocked = getattr(session, 'blocked_by_ratelimit', None)
+        if blocked is not None:
+            metrics.blocked_by_ratelimit.record(blocked)
+
+    async def prepare_session(self, endpoint_desc, session, request_params):
+        session.override_attr('metrics_start', monotonic())
+
+    async def on_response(self, endpoint_desc, session, request_params, response):
+        self._record(endpoint_desc, session, '{}xx'.format(response.status // 100))
+
+    async def on_exception(self, endpoint_desc, session, request_params, ex):
+        self._record(endpoint_desc, session, self.EXCEPTION_STATUS_CLASS)
+
+    def snapshot(self):
+        return {'service_name': self.service_client.name,
+                'endpoints': {endpoint: metrics.snapshot()
+                              for endpoint, metrics in self.endpoints.items()}}
+
+    def to_prometheus(self):
+        return prometheus_exposition(self)
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    return ','.join('{}="{}"'.format(k, _escape_label(v)) for k, v in labels)
+
+
+def _format_value(value):
+    if value == inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _histogram_lines(name, labels, histogram):
+    for bound, count in histogram.cumulative_buckets():
+        yield '{}_bucket{{{}}} {}'.format(name, _format_labels(labels + [('le', _format_value(bound))]), count)
+    yield '{}_sum{{{}}} {}'.format(name, _format_labels(labels), _format_value(histogram.sum))
+    yield '{}_count{{{}}} {}'.format(name, _format_labels(labels), histogram.count)
+
+
+def prometheus_exposition(*metrics_plugins, prefix='service_client'):
+    """
+    Builds Prometheus text exposition format using data from several metrics plugins.
+
+    :param metrics_plugins: Metrics plugins to export.
+    :param prefix: Metrics names prefix. **Default:** ``service_client``
+    :type prefix: str
+    :return: str
+    """
+    responses = ['# HELP {0}_responses_total Responses by status class.'.format(prefix),
+                 '# TYPE {0}_responses_total counter'.format(prefix)]
+    histograms = [('request_duration_seconds', 'latency', 'Time until response headers were received.'),
+                  ('pool_wait_seconds', 'blocked_by_pool', 'Time blocked by pool.'),
+                  ('ratelimit_wait_seconds', 'blocked_by_ratelimit', 'Time blocked by rate limit.')]
+    histogram_lines = {attr: ['# HELP {}_{} {}'.format(prefix, name, help_text),
+                              '# TYPE {}_{} histogram'.format(prefix, name)]
+                       for name, attr, help_text in histograms}
+
+    for plugin in metrics_plugins:
+        service_name = plugin.service_client.name
+        for endpoint, metrics in sorted(plugin.endpoints.items()):
+            labels = [('service', service_name), ('endpoint', endpoint)]
+            for status_class, count in sorted(metrics.responses.items()):
+                responses.append('{}_responses_total{{{}}} {}'.format(
+                    prefix, _format_labels(labels + [('status_class', status_class)]), count))
+
+            for name, attr, _ in histograms:
+                histogram_lines[attr].extend(_histogram_lines('{}_{}'.format(prefix, name), labels,
+                                                              getattr(metrics, attr)))
+
+    lines = responses
+    for _, attr, _ in histograms:
+        lines.extend(histogram_lines[attr])
+
+    return '\n'.join(lines) + '\n'
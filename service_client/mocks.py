@@ -1,22 +1,122 @@
+import errno
 import json
-from asyncio import get_event_loop
+import os
+import random
+from asyncio import get_event_loop, sleep
 from asyncio.futures import Future
-from collections import Mapping
+from bisect import bisect_left
+from collections import Mapping, OrderedDict
 from functools import wraps
+from heapq import merge
+from http import HTTPStatus
+from itertools import count
+from math import log
 
-from aiohttp import RequestInfo
+from aiohttp import ClientOSError, ClientResponseError, RequestInfo, ServerDisconnectedError, ServerTimeoutError
 from aiohttp.helpers import TimerContext
 from dirty_loader import LoaderNamespaceReversedCached
 from multidict import CIMultiDict, CIMultiDictProxy
 from yarl import URL
 
+from .cassettes import fingerprint, load_cassette
 from .plugins import BasePlugin
+from .utils import ObjectWrapper
+
+try:
+    from contextvars import ContextVar
+except ImportError:  # pragma: no cover
+    ContextVar = None
 
 
 class NoMock(Exception):
     pass
 
 
+BODY_CACHE_SIZE = 128
+
+_file_bodies = OrderedDict()
+_json_bodies = OrderedDict()
+
+
+def _cache_get(cache, key):
+    try:
+        value = cache[key]
+    except KeyError:
+        return None
+    cache.move_to_end(key)
+    return value
+
+
+def _cache_set(cache, key, value):
+    cache[key] = value
+    if len(cache) > BODY_CACHE_SIZE:
+        cache.popitem(last=False)
+
+
+def clear_body_caches():
+    """
+    Clears cached mock bodies.
+    """
+    _file_bodies.clear()
+    _json_bodies.clear()
+
+
+_random_generators = {}
+
+
+def reset_random_generators():
+    """
+    Resets random generators used by mocks with ``seed``, so same sequence of latencies and faults
+    is generated again.
+    """
+    _random_generators.clear()
+
+
+def _sample_percentiles(rng, percentiles):
+    points = sorted((float(p), float(v)) for p, v in percentiles.items())
+    u = rng.random() * 100
+    i = bisect_left(points, (u, float('-inf')))
+    if i == 0:
+        return points[0][1]
+    if i == len(points):
+        return points[-1][1]
+
+    (p0, v0), (p1, v1) = points[i - 1], points[i]
+    return v0 + (v1 - v0) * (u - p0) / (p1 - p0)
+
+
+def sample_latency(rng, latency):
+    """
+    Samples a latency (seconds) from a latency definition:
+
+    - A number: fixed latency.
+    - ``{'distribution': 'fixed', 'value': 0.1}``
+    - ``{'distribution': 'uniform', 'min': 0.01, 'max': 0.1}``
+    - ``{'distribution': 'lognormal', 'median': 0.05, 'sigma': 0.5}``
+    - ``{'distribution': 'percentiles', 'percentiles': {50: 0.02, 90: 0.08, 99: 0.3, 100: 1}}``: it replays
+      recorded percentiles interpolating linearly between them.
+
+    :param rng: Random generator.
+    :type rng: random.Random
+    :param latency: Latency definition.
+    :return: float
+    """
+    if isinstance(latency, (int, float)):
+        return latency
+
+    distribution = latency.get('distribution', 'fixed')
+    if distribution == 'fixed':
+        return latency['value']
+    elif distribution == 'uniform':
+        return rng.uniform(latency.get('min', 0), latency['max'])
+    elif distribution == 'lognormal':
+        return rng.lognormvariate(log(latency['median']), latency.get('sigma', 1))
+    elif distribution == 'percentiles':
+        return _sample_percentiles(rng, latency['percentiles'])
+
+    raise ValueError(distribution)
+
+
 class BaseMockDefinition:
 
     def __init__(self, mock_manager, service_name=None, endpoint=None, offset=0, limit=1):
@@ -29,7 +129,7 @@ class BaseMockDefinition:
     def __call__(self, func):
         @wraps(func)
         async def inner(*args, **kwargs):
-            with self:
+            with self.mock_manager.scope(), self:
                 await func(*args, **kwargs)
 
         return inner
@@ -55,10 +155,105 @@ class UseMockDefinition(BaseMockDefinition):
         self.mock = mock
 
 
+class _MockEntry:
+    """
+    Mock definition pushed to manager. It keeps its own offset and limit counters, so a definition
+    could be pushed several times.
+    """
+
+    __slots__ = ('definition', 'seq', 'offset', 'limit', 'exhausted')
+
+    def __init__(self, definition, seq):
+        self.definition = definition
+        self.seq = seq
+        self.offset = definition.offset
+        self.limit = definition.limit
+        self.exhausted = False
+
+
+def _entry_seq(entry):
+    return entry.seq
+
+
+class _MockState:
+    """
+    Mock entries indexed by ``(service_name, endpoint)``. Wildcards are stored using ``None``.
+    Each bucket is sorted by push sequence.
+    """
+
+    def __init__(self, parent=None):
+        if parent is None:
+            self.buckets = {}
+        else:
+            self.buckets = {key: list(bucket) for key, bucket in parent.buckets.items()}
+
+
+class _GlobalVar:  # pragma: no cover
+    """
+    Fallback used when ``contextvars`` is not available. State is shared by all tasks.
+    """
+
+    def __init__(self, name, default):
+        self.value = default
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        token = self.value
+        self.value = value
+        return token
+
+    def reset(self, token):
+        self.value = token
+
+
+if ContextVar is None:  # pragma: no cover
+    ContextVar = _GlobalVar
+
+
+class _Scope:
+
+    def __init__(self, mock_manager):
+        self.mock_manager = mock_manager
+        self.token = None
+
+    def __enter__(self):
+        state = self.mock_manager._state
+        self.token = state.set(_MockState(state.get()))
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.mock_manager._state.reset(self.token)
+
+
 class MockManager:
+    """
+    Mock definitions are indexed by service name and endpoint. They are stored in a context
+    variable, so tasks running in a different scope (see :meth:`scope`) do not see each other's mocks.
+    Mocks used as decorators open a new scope automatically.
+    """
 
     def __init__(self):
-        self.mocks = []
+        self._seq = count()
+        self._state = ContextVar('mock_state_{}'.format(id(self)), default=_MockState())
+
+    @property
+    def mocks(self):
+        """
+        Active mock definitions in current scope, newest first.
+        """
+        entries = [entry for bucket in self._state.get().buckets.values() for entry in bucket
+                   if not entry.exhausted]
+        return [entry.definition for entry in sorted(entries, key=_entry_seq, reverse=True)]
+
+    def scope(self):
+        """
+        Context manager which isolates mocks pushed inside it. Mocks pushed before are still
+        available inside scope. Tasks created inside scope share it.
+
+        :return: Context manager
+        """
+        return _Scope(self)
 
     def patch_mock_desc(self, patch, *args, **kwarg):
         """
@@ -104,41 +299,80 @@ class MockManager:
         return UseMockDefinition(mock, self, *args, **kwarg)
 
     def push(self, mock_description):
-        self.mocks.insert(0, mock_description)
+        buckets = self._state.get().buckets
+        key = (mock_description.service_name, mock_description.endpoint)
+        try:
+            bucket = buckets[key]
+        except KeyError:
+            bucket = buckets[key] = []
+        bucket.append(_MockEntry(mock_description, next(self._seq)))
 
     def pop(self, mock_description):
+        buckets = self._state.get().buckets
+        key = (mock_description.service_name, mock_description.endpoint)
         try:
-            self.mocks.remove(mock_description)
-        except ValueError:  # pragma: no cover
-            pass
+            bucket = buckets[key]
+        except KeyError:  # pragma: no cover
+            return
+
+        for i in range(len(bucket) - 1, -1, -1):
+            if bucket[i].definition is mock_description:
+                del bucket[i]
+                break
+
+        if not bucket:
+            del buckets[key]
 
     def next_mock(self, service_name, endpoint):
-        for i in range(len(self.mocks)):
-            candidate = self.mocks[i]
-            if (candidate.service_name is not None and candidate.service_name != service_name) \
-                    or (candidate.endpoint is not None and candidate.endpoint != endpoint):
+        buckets = self._state.get().buckets
+        candidates = []
+        for key in {(service_name, endpoint), (service_name, None), (None, endpoint), (None, None)}:
+            try:
+                candidates.append(buckets[key])
+            except KeyError:
+                pass
+
+        if not candidates:
+            raise NoMock()
+
+        if len(candidates) == 1:
+            entries = reversed(candidates[0])
+        else:
+            entries = merge(*[reversed(bucket) for bucket in candidates], key=_entry_seq, reverse=True)
+
+        for entry in entries:
+            if entry.exhausted:
                 continue
 
-            if candidate.offset > 0:
-                candidate.offset -= 1
+            if entry.offset > 0:
+                entry.offset -= 1
                 continue
 
-            if candidate.limit > 1:
-                candidate.limit -= 1
+            if entry.limit > 1:
+                entry.limit -= 1
             else:
-                self.mocks.pop(i)
+                entry.exhausted = True
+                self._remove(buckets, entry)
 
-            return candidate
+            return entry.definition
 
         raise NoMock()
 
+    def _remove(self, buckets, entry):
+        key = (entry.definition.service_name, entry.definition.endpoint)
+        bucket = buckets[key]
+        bucket.remove(entry)
+        if not bucket:
+            del buckets[key]
+
 
 mock_manager = MockManager()
 
 
 class Mock(BasePlugin):
 
-    def __init__(self, namespaces=None):
+    def __init__(self, namespaces=None, lean_responses=False):
+        self.lean_responses = lean_responses
 
         self.loader = LoaderNamespaceReversedCached()
         self.loader.register_namespace('default', __name__)
@@ -147,6 +381,17 @@ class Mock(BasePlugin):
             for n, m in namespaces.items():
                 self.loader.register_namespace(n, m)
 
+        self._factories = {}
+
+    def _get_factory(self, mock_type):
+        try:
+            return self._factories[mock_type]
+        except KeyError:
+            pass
+
+        factory = self._factories[mock_type] = self.loader.get_factory_by_class(self.loader.load_class(mock_type))
+        return factory
+
     def _create_mock(self, endpoint_desc, session, request_params, mock_desc, loop):
         """
         The class imported should have the __call__ function defined to be an object directly callable
@@ -162,18 +407,19 @@ class Mock(BasePlugin):
         except NoMock:
             pass
 
-        return self.loader.factory(mock_desc.get('mock_type'),
-                                   endpoint_desc, session,
-                                   request_params, mock_desc,
-                                   service_client=self.service_client,
-                                   loop=loop)
+        return self._get_factory(mock_desc.get('mock_type'))(endpoint_desc, session,
+                                                             request_params, mock_desc,
+                                                             service_client=self.service_client,
+                                                             loop=loop)
 
     async def prepare_session(self, endpoint_desc, session, request_params):
-        mock_desc = endpoint_desc.get('mock', {})
+        mock_desc = endpoint_desc.get('mock', {}).copy()
+        if self.lean_responses:
+            mock_desc.setdefault('lean_response', True)
         session.override_attr('request', self._create_mock(endpoint_desc,
                                                            session,
                                                            request_params,
-                                                           mock_desc.copy(),
+                                                           mock_desc,
                                                            loop=self.service_client.loop))
 
         try:
@@ -182,6 +428,130 @@ class Mock(BasePlugin):
             pass
 
 
+class MockStreamReader:
+    """
+    Minimal ``StreamReader`` replacement used as ``MockResponse.content``. It reads from response body,
+    so streamed endpoints could be consumed on lean responses.
+    """
+
+    def __init__(self, response):
+        self._response = response
+        self._pos = 0
+
+    def at_eof(self):
+        return self._pos >= len(self._response.body)
+
+    async def read(self, n=-1):
+        body = self._response.body
+        end = len(body) if n < 0 else self._pos + n
+        data = body[self._pos:end]
+        self._pos += len(data)
+        return data
+
+    async def readany(self):
+        return await self.read()
+
+    async def readline(self):
+        body = self._response.body
+        end = body.find(b'\n', self._pos)
+        return await self.read(-1 if end < 0 else end + 1 - self._pos)
+
+    async def iter_chunked(self, n):
+        while not self.at_eof():
+            yield await self.read(n)
+
+    async def iter_any(self):
+        while not self.at_eof():
+            yield await self.readany()
+
+
+class MockResponse:
+    """
+    Lightweight response used by mocks instead of aiohttp ``ClientResponse``. It implements the common
+    part of ``ClientResponse`` public interface, without any connection related machinery.
+    """
+
+    def __init__(self, method, url, status=200, headers=None, body=b'', request_headers=None):
+        self.method = method
+        self.url = url
+        self.real_url = url
+        self.status = status
+        self.headers = CIMultiDictProxy(CIMultiDict(headers or {}))
+        self.body = body
+        self.history = ()
+        self.request_headers = request_headers
+        self.closed = False
+        self._content = None
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = MockStreamReader(self)
+        return self._content
+
+    @property
+    def reason(self):
+        try:
+            return HTTPStatus(self.status).phrase
+        except ValueError:
+            return None
+
+    @property
+    def ok(self):
+        return self.status < 400
+
+    @property
+    def request_info(self):
+        return RequestInfo(self.url, self.method, CIMultiDictProxy(CIMultiDict(self.request_headers or {})))
+
+    def _content_type_params(self):
+        content_type = self.headers.get('Content-Type', 'application/octet-stream')
+        parts = content_type.split(';')
+        params = {}
+        for part in parts[1:]:
+            key, _, value = part.partition('=')
+            params[key.strip().lower()] = value.strip().strip('"')
+        return parts[0].strip().lower(), params
+
+    @property
+    def content_type(self):
+        return self._content_type_params()[0]
+
+    @property
+    def charset(self):
+        return self._content_type_params()[1].get('charset')
+
+    async def start(self, connection):
+        # there is no connection to read from, it exists in order to be decorated by plugins (like Elapsed)
+        return self
+
+    async def read(self):
+        return self.body
+
+    async def text(self, encoding=None, errors='strict'):
+        return self.body.decode(encoding or self.charset or 'utf-8', errors)
+
+    async def json(self, *, encoding=None, loads=json.loads, content_type='application/json'):
+        return loads(await self.text(encoding=encoding))
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise ClientResponseError(self.request_info, self.history, status=self.status,
+                                      message=self.reason, headers=self.headers)
+
+    def release(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
 class BaseMock:
 
     def __init__(self, endpoint_desc, session, request_params,
@@ -193,12 +563,60 @@ class BaseMock:
         self.service_client = service_client
         self.loop = loop or get_event_loop()
 
-    async def __call__(self, *args, **kwargs):
+    @property
+    def lean(self):
+        return self.mock_desc.get('lean_response', False)
+
+    def _create_response(self, method, url, kwargs):
         try:
             from asyncio import create_task
         except ImportError:  # pragma: no cover
             create_task = self.loop.create_task
 
+        async def writer(*args, **kwargs):
+            return None
+
+        continue100 = Future()
+        continue100.set_result(False)
+
+        return self.service_client.create_response(method,
+                                                   URL(url),
+                                                   writer=create_task(writer()),
+                                                   continue100=continue100,
+                                                   timer=TimerContext(loop=self.loop),
+                                                   request_info=RequestInfo(URL(url),
+                                                                            method,
+                                                                            kwargs.get('headers', [])),
+                                                   traces=[],
+                                                   loop=self.loop,
+                                                   session=self.session)
+
+    def _wrap_response(self, response):
+        try:
+            wrap_response = self.service_client.wrap_response
+        except AttributeError:
+            return ObjectWrapper(response)
+        return wrap_response(response)
+
+    def set_headers(self, headers):
+        headers = CIMultiDictProxy(CIMultiDict(headers))
+        if self.lean:
+            self.response.headers = headers
+        else:
+            self.response._headers = headers
+
+    def set_body(self, body):
+        if self.lean:
+            self.response.body = body
+        else:
+            self.response._body = body
+
+    def get_body(self):
+        if self.lean:
+            return self.response.body
+        return self.response._body
+
+    async def __call__(self, *args, **kwargs):
         args = list(args)
         try:
             method = kwargs['method']
@@ -215,61 +633,206 @@ class BaseMock:
         self.args = args
         self.kwargs = kwargs
 
-        async def writer(*args, **kwargs):
-            return None
-
-        continue100 = Future()
-        continue100.set_result(False)
-
-        self.response = self.service_client.create_response(method,
-                                                            URL(url),
-                                                            writer=create_task(writer()),
-                                                            continue100=continue100,
-                                                            timer=TimerContext(loop=self.loop),
-                                                            request_info=RequestInfo(URL(url),
-                                                                                     method,
-                                                                                     kwargs.get('headers', [])),
-                                                            traces=[],
-                                                            loop=self.loop,
-                                                            session=self.session)
+        if self.lean:
+            self.response = self._wrap_response(MockResponse(method, url if isinstance(url, URL) else URL(url),
+                                                             request_headers=kwargs.get('headers')))
+        else:
+            self.response = self._create_response(method, url, kwargs)
 
         self.response.status = self.mock_desc.get('status', 200)
-        self.response._headers = CIMultiDictProxy(CIMultiDict(self.mock_desc.get('headers', {})))
+        self.set_headers(self.mock_desc.get('headers', {}))
 
         await self.prepare_response()
 
+        if 'latency' in self.mock_desc or 'faults' in self.mock_desc or 'bandwidth' in self.mock_desc:
+            await self.degrade_response()
+
         return self.response
 
+    def get_random(self):
+        """
+        Random generator used to sample latencies and faults. When ``seed`` is set on mock
+        definition, each endpoint uses its own generator, so sequences are deterministic.
+        """
+        seed = self.mock_desc.get('seed')
+        if seed is None:
+            return random
+
+        key = (self.service_client.name, self.endpoint_desc.get('endpoint'), seed)
+        try:
+            return _random_generators[key]
+        except KeyError:
+            rng = _random_generators[key] = random.Random(seed)
+            return rng
+
+    def choose_fault(self, rng):
+        faults = self.mock_desc.get('faults')
+        if not faults:
+            return None
+
+        u = rng.random()
+        for fault in faults:
+            u -= fault['rate']
+            if u < 0:
+                return fault
+        return None
+
+    async def apply_fault(self, fault):
+        error = fault.get('error')
+        if error is None:
+            self.response.status = fault['status']
+            body = fault.get('data', b'')
+            self.set_body(body.encode() if isinstance(body, str) else body)
+        elif error == 'reset':
+            raise ClientOSError(errno.ECONNRESET, 'Connection reset by peer')
+        elif error == 'disconnect':
+            raise ServerDisconnectedError()
+        elif error == 'timeout':
+            delay = fault.get('delay')
+            if delay is None:
+                await self.loop.create_future()
+            await sleep(delay)
+            raise ServerTimeoutError('Timeout on reading data from socket')
+        else:
+            raise ValueError(error)
+
+    async def degrade_response(self):
+        """
+        Applies degradation described on mock definition:
+
+        - ``latency``: Time to wait before response headers are returned. See :func:`sample_latency`.
+        - ``faults``: List of faults with their ``rate`` (0 to 1). A fault could set a ``status`` (and ``data``)
+          or raise an ``error``: ``reset`` (connection reset), ``disconnect`` (server disconnected)
+          or ``timeout`` (it waits until it is cancelled or ``delay`` seconds and then it raises a timeout).
+        - ``bandwidth``: Bytes per second used to deliver response body.
+        - ``seed``: Seed of random generator.
+        """
+        rng = self.get_random()
+        fault = self.choose_fault(rng)
+
+        latency = self.mock_desc.get('latency')
+        if latency is not None:
+            await sleep(sample_latency(rng, latency))
+
+        if fault is not None:
+            await self.apply_fault(fault)
+
+        bandwidth = self.mock_desc.get('bandwidth')
+        if bandwidth:
+            await self.delay_body(len(self.get_body() or b'') / bandwidth)
+
+    async def delay_body(self, delay):
+        """
+        Delays response body reading.
+
+        :param delay: Seconds to wait.
+        :type delay: float
+        """
+        def decorator(func):
+            @wraps(func)
+            async def read():
+                await sleep(delay)
+                return await func()
+
+            return read
+
+        try:
+            self.response.decorate_attr('read', decorator)
+        except AttributeError:
+            await sleep(delay)
 
-class BaseFileMock(BaseMock):
     async def prepare_response(self):
+        self.set_body(self.load_body())
+
+    def load_body(self):
+        """
+        Builds response body. It must return a byte-string.
+        """
+        raise NotImplementedError()
+
+
+class BaseFileMock(BaseMock):
+    """
+    File bodies are cached. Cached body is discarded when file modification time or size change.
+    """
+
+    def load_body(self):
         filename = self.mock_desc['file']
-        self.response._body = self.load_file(filename)
+        stat = os.stat(filename)
+        key = (type(self), filename)
+        version = (stat.st_mtime_ns, stat.st_size)
+
+        cached = _cache_get(_file_bodies, key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        body = self.load_file(filename)
+        _cache_set(_file_bodies, key, (version, body))
+        return body
 
 
 class RawFileMock(BaseFileMock):
 
     def load_file(self, filename):
-        return open(filename, "rb").read()
+        with open(filename, "rb") as f:
+            return f.read()
 
 
 class RawDataMock(BaseMock):
-    async def prepare_response(self):
+
+    def load_body(self):
         data = self.mock_desc['data']
         if isinstance(data, str):
             data = data.encode()
         elif not isinstance(data, bytes):
             raise ValueError(data)
-        self.response._body = data
+        return data
 
 
 class JsonDataMock(BaseMock):
-    async def prepare_response(self):
+    """
+    Data is encoded on each request. Using ``cache_body: true`` on mock definition encoded body is cached
+    by data object, so data must not be modified once it has been used.
+    """
+
+    def load_body(self):
         data = self.mock_desc['data']
         encoder = self.mock_desc.get('json_encoder', None)
 
-        if isinstance(data, (dict, Mapping, list)):
-            data = json.dumps(data, cls=encoder).encode()
-        else:
+        if not isinstance(data, (dict, Mapping, list)):
             raise ValueError(data)
-        self.response._body = data
+
+        if not self.mock_desc.get('cache_body', False):
+            return json.dumps(data, cls=encoder).encode()
+
+        key = (id(data), encoder)
+        cached = _cache_get(_json_bodies, key)
+        if cached is not None and cached[0] is data:
+            return cached[1]
+
+        body = json.dumps(data, cls=encoder).encode()
+        _cache_set(_json_bodies, key, (data, body))
+        return body
+
+
+class CassetteMock(BaseMock):
+    """
+    It replays responses recorded on a cassette (see :class:`~service_client.cassettes.Recorder`).
+    Cassette directory is set using ``cassette`` key. When ``preserve_timing`` is true, recorded
+    times to receive headers and body are reproduced.
+
+    It raises :class:`~service_client.cassettes.NoRecordError` when request was not recorded.
+    """
+
+    async def prepare_response(self):
+        cassette = load_cassette(self.mock_desc['cassette'])
+        record = cassette.next_record(fingerprint(self.method, self.url,
+                                                  self.kwargs.get('params'), self.kwargs.get('data')))
+
+        self.response.status = record['status']
+        self.set_headers(record['headers'])
+        self.set_body(cassette.load_body(record))
+
+        if self.mock_desc.get('preserve_timing', False):
+            await sleep(record['headers_elapsed'])
+            await self.delay_body(max(0, record['elapsed'] - record['headers_elapsed']))
@@ -1,13 +1,18 @@
 import logging
 import weakref
-from asyncio import TimeoutError, wait_for
-from datetime import datetime
+from asyncio import Semaphore, TimeoutError, wait_for
+from collections import OrderedDict, deque
+from datetime import timedelta
 from functools import wraps
+from time import monotonic
 from urllib.parse import quote_plus
 
+from aiohttp import TraceConfig
 from async_timeout import timeout as TimeoutContext
 from multidict import CIMultiDict
 
+from service_client.calls import QUEUED
+from service_client.log_dispatchers import QueueLogDispatcher
 from service_client.utils import IncompleteFormatter, random_token
 
 
@@ -88,10 +93,11 @@ class Timeout(BasePlugin):
 
 class Elapsed(BasePlugin):
 
-    def __init__(self, headers=True, read=True, parse=True):
+    def __init__(self, headers=True, read=True, parse=True, connection=False):
         self.headers = headers
         self.read = read
         self.parse = parse
+        self.connection = connection
 
     def _elapsed_enabled(self, elapsed_type, endpoint_desc, session, request_params):
         result = getattr(self, elapsed_type)
@@ -107,14 +113,84 @@ class Elapsed(BasePlugin):
 
         return result
 
+    def prepare_session_config(self, session_config):
+        if not self.connection:
+            return
+
+        session_config['trace_configs'] = list(session_config.get('trace_configs', [])) + \
+            [self._create_trace_config()]
+
+    def _create_trace_config(self):
+        trace_config = TraceConfig()
+        trace_config.on_request_start.append(self._on_request_start)
+        trace_config.on_connection_queued_start.append(self._trace_start('connection_queued'))
+        trace_config.on_connection_queued_end.append(self._trace_end('connection_queued'))
+        trace_config.on_dns_resolvehost_start.append(self._trace_start('dns'))
+        trace_config.on_dns_resolvehost_end.append(self._trace_end('dns'))
+        trace_config.on_connection_create_start.append(self._trace_start('connect'))
+        trace_config.on_connection_create_end.append(self._trace_end('connect'))
+        trace_config.on_connection_reuseconn.append(self._on_connection_reuseconn)
+        trace_config.on_request_chunk_sent.append(self._on_request_sent)
+        try:
+            trace_config.on_request_headers_sent.append(self._on_request_sent)
+        except AttributeError:  # pragma: no cover
+            pass
+        trace_config.on_request_end.append(self._on_request_end)
+        return trace_config
+
+    @staticmethod
+    def _trace_start(phase):
+        async def on_start(session, trace_config_ctx, params):
+            trace_config_ctx.starts[phase] = monotonic()
+
+        return on_start
+
+    @staticmethod
+    def _trace_end(phase):
+        async def on_end(session, trace_config_ctx, params):
+            now = monotonic()
+            try:
+                trace_config_ctx.elapsed[phase] = timedelta(seconds=now - trace_config_ctx.starts[phase])
+            except KeyError:  # pragma: no cover
+                pass
+            trace_config_ctx.ready = now
+
+        return on_end
+
+    async def _on_request_start(self, session, trace_config_ctx, params):
+        trace_config_ctx.start = trace_config_ctx.ready = monotonic()
+        trace_config_ctx.starts = {}
+        trace_config_ctx.elapsed = {}
+        trace_config_ctx.sent = None
+        trace_config_ctx.reused = False
+
+    async def _on_connection_reuseconn(self, session, trace_config_ctx, params):
+        trace_config_ctx.reused = True
+        trace_config_ctx.ready = monotonic()
+
+    async def _on_request_sent(self, session, trace_config_ctx, params):
+        trace_config_ctx.sent = trace_config_ctx.ready = monotonic()
+
+    async def _on_request_end(self, session, trace_config_ctx, params):
+        now = monotonic()
+        response = params.response
+
+        for phase, elapsed in trace_config_ctx.elapsed.items():
+            setattr(response, phase + '_elapsed', elapsed)
+
+        if trace_config_ctx.sent is not None:
+            response.request_sent_elapsed = timedelta(seconds=trace_config_ctx.sent - trace_config_ctx.start)
+        response.first_byte_elapsed = timedelta(seconds=now - trace_config_ctx.ready)
+        response.connection_reused = trace_config_ctx.reused
+
     def prepare_response(self, endpoint_desc, session, request_params, response):
 
         def decorator(func):
             @wraps(func)
             async def start_wrapper(*args, **kwargs):
-                response.start_headers = datetime.now()
+                response.start_headers = monotonic()
                 r = await func(*args, **kwargs)
-                response.headers_elapsed = datetime.now() - response.start_headers
+                response.headers_elapsed = timedelta(seconds=monotonic() - response.start_headers)
                 return r
 
             return start_wrapper
@@ -124,20 +200,20 @@ class Elapsed(BasePlugin):
 
     async def on_response(self, endpoint_desc, session, request_params, response):
         if self._elapsed_enabled('read', endpoint_desc, session, request_params):
-            response.start_read = datetime.now()
+            response.start_read = monotonic()
 
     async def on_read(self, endpoint_desc, session, request_params, response):
         try:
-            response.read_elapsed = datetime.now() - response.start_read
+            response.read_elapsed = timedelta(seconds=monotonic() - response.start_read)
         except AttributeError:
             pass
 
         if self._elapsed_enabled('parse', endpoint_desc, session, request_params):
-            response.start_parse = datetime.now()
+            response.start_parse = monotonic()
 
     async def on_parsed_response(self, endpoint_desc, session, request_params, response):
         try:
-            response.parse_elapsed = datetime.now() - response.start_parse
+            response.parse_elapsed = timedelta(seconds=monotonic() - response.start_parse)
         except AttributeError:
             pass
 
@@ -180,19 +256,141 @@ class QueryParams(BasePlugin):
         request_params['params'] = {k: v for k, v in query_params.items() if v is not None}
 
 
+class _SamplingState:
+    __slots__ = ('sampled', 'start')
+
+    def __init__(self, sampled, start):
+        self.sampled = sampled
+        self.start = start
+
+
 class BaseLogger(BasePlugin):
 
     def __init__(self, logger, max_body_length=0, level=logging.INFO,
                  on_exception_level=logging.CRITICAL,
-                 on_parse_exception_level=logging.CRITICAL):
+                 on_parse_exception_level=logging.CRITICAL,
+                 queue_size=None, overflow=QueueLogDispatcher.OVERFLOW_DROP,
+                 sample_rate=None, tail_status_codes=None, tail_latency=None, max_buffered=1000):
         self.logger = logger
         self.max_body_length = max_body_length
         self.level = level
         self.on_exception_level = on_exception_level
         self.on_parse_exception_level = on_parse_exception_level
 
-    def _prepare_body(self, body_string):
-        return body_string[:self.max_body_length]
+        if queue_size:
+            self.dispatcher = QueueLogDispatcher(logger, queue_size=queue_size, overflow=overflow)
+        else:
+            self.dispatcher = None
+
+        self.sample_rate = sample_rate
+        self.tail_status_codes = frozenset(tail_status_codes or [])
+        self.tail_latency = tail_latency
+        self.max_buffered = max_buffered
+        self.buffer_dropped = 0
+        self._sample_counters = {}
+        self._buffer = OrderedDict()
+        self._sampling_attr = '_log_sampling_{}'.format(id(self))
+
+    def _is_sampled(self, endpoint):
+        count = self._sample_counters.get(endpoint, 0)
+        self._sample_counters[endpoint] = count + 1
+        return self.sample_rate > 0 and count % self.sample_rate == 0
+
+    def _log_request(self, endpoint_desc, session, message, log_data):
+        """
+        Request records of calls not sampled are buffered until call outcome is known. Buffer is bounded
+        to ``max_buffered`` records, oldest ones are dropped when it is full.
+        """
+        if self.sample_rate is None:
+            self._log(self.level, message, log_data)
+            return
+
+        state = _SamplingState(self._is_sampled(endpoint_desc['endpoint']), monotonic())
+        session.override_attr(self._sampling_attr, state)
+
+        if state.sampled:
+            self._log(self.level, message, log_data)
+            return
+
+        self._buffer[state] = (self.level, message, log_data)
+        if len(self._buffer) > self.max_buffered:
+            self._buffer.popitem(last=False)
+            self.buffer_dropped += 1
+
+    def _flush_request(self, session):
+        state = getattr(session, self._sampling_attr, None)
+        if state is None:
+            return
+
+        try:
+            level, message, log_data = self._buffer.pop(state)
+        except KeyError:
+            return
+        self._log(level, message, log_data)
+
+    def _must_log_response(self, session, status):
+        """
+        Decides whether response must be logged. Buffered request record is emitted when response
+        matches tail rules, otherwise it is kept until call ends, so it is emitted if parsing fails.
+        """
+        state = getattr(session, self._sampling_attr, None)
+        if state is None or state.sampled:
+            return True
+
+        if status in self.tail_status_codes or \
+                (self.tail_latency is not None and monotonic() - state.start > self.tail_latency):
+            self._flush_request(session)
+            return True
+
+        return False
+
+    def on_call_end(self, endpoint_desc, session, request_params):
+        state = getattr(session, self._sampling_attr, None)
+        if state is not None:
+            self._buffer.pop(state, None)
+
+    def _log(self, level, message, log_data):
+        if self.dispatcher is None:
+            self.logger.log(level, message, extra=log_data)
+        else:
+            self.dispatcher.dispatch(level, message, log_data)
+
+    def close(self):
+        if self.dispatcher is not None:
+            # it must not block event loop, pending events are emitted by background thread
+            self.dispatcher.stop(timeout=None)
+
+    async def wait_closed(self):
+        if self.dispatcher is not None:
+            await self.service_client.loop.run_in_executor(None, self.dispatcher.join)
+
+    def _is_enabled(self, level):
+        try:
+            return self.logger.isEnabledFor(level)
+        except AttributeError:
+            return True
+
+    def _prepare_body(self, body):
+        if not isinstance(body, (str, bytes)):
+            if self.max_body_length <= 0:
+                return ''
+            body = str(body)
+        return body[:self.max_body_length]
+
+    async def _prepare_response_body(self, response):
+        """
+        Body is truncated before decoding it, so big bodies are not decoded just to be logged.
+        """
+        try:
+            return self._prepare_body(response.data)
+        except AttributeError:
+            pass
+
+        if self.max_body_length <= 0:
+            return ''
+
+        body = (await response.read())[:self.max_body_length]
+        return body.decode(response.charset or 'utf-8', errors='replace')
 
     def _prepare_record(self, endpoint_desc, session, request_params):
         log_data = {'endpoint': endpoint_desc['endpoint'],
@@ -225,10 +423,7 @@ class BaseLogger(BasePlugin):
         elif endpoint_desc.get('stream_response', False):
             log_data['body'] = '<STREAM>'
         else:
-            try:
-                log_data['body'] = self._prepare_body(response.data)
-            except AttributeError:
-                log_data['body'] = self._prepare_body((await response.text()))
+            log_data['body'] = await self._prepare_response_body(response)
 
         return log_data
 
@@ -249,13 +444,21 @@ class BaseLogger(BasePlugin):
         return log_data
 
     async def on_exception(self, endpoint_desc, session, request_params, ex):
+        if not self._is_enabled(self.on_exception_level):
+            return
+
+        self._flush_request(session)
         log_data = await self._prepare_exception_log_record(endpoint_desc, session, request_params, ex)
-        self.logger.log(self.on_exception_level, str(ex), extra=log_data)
+        self._log(self.on_exception_level, str(ex), log_data)
 
     async def on_parse_exception(self, endpoint_desc, session, request_params, response, ex):
+        if not self._is_enabled(self.on_parse_exception_level):
+            return
+
+        self._flush_request(session)
         log_data = await self._prepare_parse_response_exception_log_record(endpoint_desc, session,
                                                                            request_params, response, ex)
-        self.logger.log(self.on_parse_exception_level, str(ex), extra=log_data)
+        self._log(self.on_parse_exception_level, str(ex), log_data)
 
 
 class InnerLogger(BaseLogger):
@@ -281,12 +484,18 @@ class InnerLogger(BaseLogger):
         return log_data
 
     async def before_request(self, endpoint_desc, session, request_params):
+        if not self._is_enabled(self.level):
+            return
+
         log_data = await self._prepare_on_request_log_record(endpoint_desc, session, request_params)
-        self.logger.log(self.level, "Sending request", extra=log_data)
+        self._log_request(endpoint_desc, session, "Sending request", log_data)
 
     async def on_response(self, endpoint_desc, session, request_params, response):
+        if not self._is_enabled(self.level) or not self._must_log_response(session, response.status):
+            return
+
         log_data = await self._prepare_response_log_record(endpoint_desc, session, request_params, response)
-        self.logger.log(self.level, "Response received", extra=log_data)
+        self._log(self.level, "Response received", log_data)
 
 
 class OuterLogger(BaseLogger):
@@ -298,20 +507,31 @@ class OuterLogger(BaseLogger):
         elif endpoint_desc.get('stream_request', False):
             log_data['body'] = '<STREAM>'
         elif payload is not None:
-            log_data['body'] = self._prepare_body(str(payload))
+            log_data['body'] = self._prepare_body(payload)
         else:
             log_data['body'] = '<NO BODY>'
 
         return log_data
 
     async def prepare_payload(self, endpoint_desc, session, request_params, payload):
+        if not self._is_enabled(self.level):
+            return payload
+
         log_data = await self._prepare_prepare_payload_log_record(endpoint_desc, session,
                                                                   request_params, payload)
-        self.logger.log(self.level, "Sending request", extra=log_data)
+        self._log_request(endpoint_desc, session, "Sending request", log_data)
+        return payload
+
+    async def on_response(self, endpoint_desc, session, request_params, response):
+        if endpoint_desc.get('stream_response', False) and self._is_enabled(self.level):
+            self._must_log_response(session, response.status)
 
     async def on_parsed_response(self, endpoint_desc, session, request_params, response):
+        if not self._is_enabled(self.level) or not self._must_log_response(session, response.status):
+            return
+
         log_data = await self._prepare_response_log_record(endpoint_desc, session, request_params, response)
-        self.logger.log(self.level, "Response received", extra=log_data)
+        self._log(self.level, "Response received", log_data)
 
 
 class RequestLimitError(Exception):
@@ -332,31 +552,71 @@ class BaseLimitPlugin(BasePlugin):
     TOO_MANY_REQ_PENDING_MSG = "Too many requests pending"
     TOO_MUCH_TIME_MSG = "Request blocked too much time"
 
-    def __init__(self, limit=1, timeout=None, hard_limit=None):
+    def __init__(self, limit=1, timeout=None, hard_limit=None, queue_target=None, queue_interval=0.1):
         self.limit = limit
         self._counter = 0
         self._fut = None
         self._pending_futs = []
         self._timeout = timeout
         self._hard_limit = hard_limit
+        self._queue_target = queue_target
+        self._queue_interval = queue_interval
+        self._first_above_time = None
+        self._shedding = False
 
     @property
     def pending(self):
         return len(self._pending_futs)
 
-    async def _acquire(self):
+    @property
+    def shedding(self):
+        return self._shedding
+
+    def _update_shedding(self, sojourn):
+        """
+        CoDel-like control law. Shedding starts when every request acquired during
+        ``queue_interval`` seconds has been waiting more than ``queue_target`` seconds,
+        and it stops as soon as a request waits less than target.
+        """
+        if self._queue_target is None:
+            return
+
+        if sojourn < self._queue_target:
+            self._first_above_time = None
+            self._shedding = False
+            return
+
+        now = self.service_client.loop.time()
+        if self._first_above_time is None:
+            self._first_above_time = now + self._queue_interval
+        elif now >= self._first_above_time:
+            self._shedding = True
+
+    async def _acquire(self, call_info=None):
         timeout = self._timeout
+        start = self.service_client.loop.time()
+        waited = False
         while True:
             if self._counter < self.limit:
                 self._counter += 1
+                # only requests which have waited are sojourn samples: an arrival taking a free slot
+                # must not stop shedding while other requests are still queued
+                if waited:
+                    self._update_shedding(self.service_client.loop.time() - start)
                 break
 
             if self._hard_limit is not None and self._hard_limit < self.pending:
                 raise TooManyRequestsPendingError(self.TOO_MANY_REQ_PENDING_MSG)
 
+            if self._shedding:
+                raise TooManyRequestsPendingError(self.TOO_MANY_REQ_PENDING_MSG)
+
             fut = self.service_client.loop.create_future()
             self._pending_futs.append(fut)
+            if call_info is not None:
+                call_info.set_phase(QUEUED)
 
+            waited = True
             try:
                 now = self.service_client.loop.time()
                 await wait_for(fut, timeout=timeout, loop=self.service_client.loop)
@@ -371,14 +631,15 @@ class BaseLimitPlugin(BasePlugin):
         try:
             fut = self._pending_futs.pop(0)
         except IndexError:
-            pass
+            self._first_above_time = None
+            self._shedding = False
         else:
             fut.set_result(None)
 
     async def before_request(self, endpoint_desc, session, request_params):
         start = self.service_client.loop.time()
         try:
-            await self._acquire()
+            await self._acquire(getattr(session, 'call_info', None))
         finally:
             setattr(session,
                     self.SESSION_ATTR_TIME_BLOCKED,
@@ -421,3 +682,187 @@ class RateLimit(BaseLimitPlugin):
     async def on_exception(self, endpoint_desc, session, request_params, ex):
         if not isinstance(ex, RequestLimitError):
             self.service_client.loop.call_later(self.period, self._release)
+
+
+class ConnectorLimit(BasePlugin):
+    """
+    Limits concurrent calls of a service client, in total and by host, like connector ``limit`` and
+    ``limit_per_host`` do. Service clients add it by themselves when they use a shared connector built with
+    other limits. Slots are held until call ends (for ``stream_response`` endpoints, until response is returned).
+
+    :param limit: Maximum concurrent calls. 0 means no limit.
+    :type limit: int
+    :param limit_per_host: Maximum concurrent calls to same host and port. 0 means no limit.
+    :type limit_per_host: int
+    """
+
+    def __init__(self, limit=100, limit_per_host=0):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self._semaphore = None
+        self._hosts = {}
+        self._acquired_attr = '_connector_limit_{}'.format(id(self))
+
+    async def _acquire(self, semaphore, session):
+        if semaphore.locked():
+            call_info = getattr(session, 'call_info', None)
+            if call_info is not None:
+                call_info.set_phase(QUEUED)
+        await semaphore.acquire()
+
+    def _release_host(self, key):
+        entry = self._hosts[key]
+        entry[0].release()
+        entry[1] -= 1
+        if not entry[1]:
+            del self._hosts[key]
+
+    async def before_request(self, endpoint_desc, session, request_params):
+        acquired = []
+        session.override_attr(self._acquired_attr, acquired)
+
+        if self.limit:
+            if self._semaphore is None:
+                self._semaphore = Semaphore(self.limit)
+            await self._acquire(self._semaphore, session)
+            acquired.append(self._semaphore.release)
+
+        if self.limit_per_host:
+            url = request_params['url']
+            key = (url.host, url.port)
+            try:
+                entry = self._hosts[key]
+            except KeyError:
+                entry = self._hosts[key] = [Semaphore(self.limit_per_host), 0]
+            # host entry is kept while any call uses it, even waiting
+            entry[1] += 1
+            try:
+                await self._acquire(entry[0], session)
+            except BaseException:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._hosts[key]
+                raise
+            acquired.append(lambda: self._release_host(key))
+
+    def on_call_end(self, endpoint_desc, session, request_params):
+        for release in getattr(session, self._acquired_attr, ()):
+            release()
+        session.override_attr(self._acquired_attr, ())
+
+
+class LoopMonitor(BasePlugin):
+    """
+    Measures event loop lag using a periodic probe and time spent parsing responses, which blocks
+    event loop. Lag spikes are logged along with calls which were running on event loop meanwhile:
+    responses parsed slowly and calls which changed their phase during spike. Probe starts on first call.
+
+    Parse time includes ``on_read`` hooks of plugins after it and ``on_parsed_response`` hooks of plugins
+    before it, so slow synchronous hooks (like logging handlers) are detected, too.
+
+    :param interval: Probe interval in seconds.
+    :type interval: float
+    :param lag_threshold: Lag (in seconds) considered a spike.
+    :type lag_threshold: float
+    :param parse_threshold: Parse time (in seconds) considered slow.
+    :type parse_threshold: float
+    :param history: Number of slow parses kept on ``slow_parses``.
+    :type history: int
+    :param logger: Logger. **Default:** service client logger.
+    """
+
+    def __init__(self, interval=0.5, lag_threshold=0.1, parse_threshold=0.05, history=100, logger=None):
+        self.interval = interval
+        self.lag_threshold = lag_threshold
+        self.parse_threshold = parse_threshold
+        self.logger = logger
+
+        self.last_lag = 0
+        self.max_lag = 0
+        self.lag_spikes = 0
+        self.slow_parses = deque(maxlen=history)
+
+        self._loop = None
+        self._handle = None
+        self._expected = None
+
+    @property
+    def running(self):
+        return self._handle is not None
+
+    def start(self, loop):
+        if self._handle is None:
+            self._loop = loop
+            self._schedule()
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _get_logger(self):
+        return self.logger or self.service_client.logger
+
+    def _schedule(self):
+        self._expected = self._loop.time() + self.interval
+        self._handle = self._loop.call_at(self._expected, self._probe)
+
+    def _probe(self):
+        if self.service_client is None:
+            self._handle = None
+            return
+
+        now = self._loop.time()
+        lag = now - self._expected
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        if lag > self.lag_threshold:
+            self.lag_spikes += 1
+            self._report_lag(lag, self._expected - self.interval, now)
+
+        self._schedule()
+
+    def _report_lag(self, lag, since, until):
+        slow_parses = ['{0} ({1} bytes, {2} ms)'.format(endpoint, body_size, int(elapsed * 1000))
+                       for end, endpoint, body_size, elapsed in self.slow_parses if since <= end <= until]
+
+        # call phases are timed using time.monotonic, same clock as default event loop
+        call_since = monotonic() - (until - since)
+        calls = ['{0} ({1})'.format(call_info.endpoint, call_info.phase)
+                 for call_info in self.service_client.active_calls if call_info.phase_start >= call_since]
+
+        self._get_logger().warning("Event loop lag {0} ms. Slow parses: {1}. Active calls: {2}.".format(
+            int(lag * 1000), ', '.join(slow_parses) or 'none', ', '.join(calls) or 'none'))
+
+    async def prepare_session(self, endpoint_desc, session, request_params):
+        if self._handle is None:
+            self.start(self.service_client.loop)
+
+    async def on_read(self, endpoint_desc, session, request_params, response):
+        session.override_attr('loop_monitor_body_size', len(await response.read()))
+        session.override_attr('loop_monitor_parse_start', self.service_client.loop.time())
+
+    def _check_parse(self, endpoint_desc, session):
+        try:
+            start = session.loop_monitor_parse_start
+        except AttributeError:
+            return
+
+        end = self.service_client.loop.time()
+        elapsed = end - start
+        if elapsed < self.parse_threshold:
+            return
+
+        body_size = session.loop_monitor_body_size
+        self.slow_parses.append((end, endpoint_desc['endpoint'], body_size, elapsed))
+        self._get_logger().warning("Parsing response from {0} ({1} bytes) blocked event loop {2} ms".format(
+            endpoint_desc['endpoint'], body_size, int(elapsed * 1000)))
+
+    async def on_parsed_response(self, endpoint_desc, session, request_params, response):
+        self._check_parse(endpoint_desc, session)
+
+    async def on_parse_exception(self, endpoint_desc, session, request_params, response, ex):
+        self._check_parse(endpoint_desc, session)
+
+    def close(self):
+        self.stop()
@@ -0,0 +1,88 @@
+from functools import wraps
+from time import perf_counter
+
+
+class ProfileStats:
+    __slots__ = ('calls', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, elapsed):
+        self.calls += 1
+        self.total += elapsed
+        if self.min is None or elapsed < self.min:
+            self.min = elapsed
+        if self.max is None or elapsed > self.max:
+            self.max = elapsed
+
+    def as_dict(self):
+        return {'calls': self.calls,
+                'total': self.total,
+                'mean': self.total / self.calls if self.calls else None,
+                'min': self.min,
+                'max': self.max}
+
+
+class Profiler:
+    """
+    It records time spent on plugin hooks, on aiohttp I/O, on serializer and on parser.
+    Times are wall-clock, so asynchronous hooks include time they were suspended
+    (for example, time blocked on pool).
+    """
+
+    HOOKS = 'hooks'
+    IO = 'io'
+    SERIALIZER = 'serializer'
+    PARSER = 'parser'
+
+    def __init__(self):
+        self.stats = {}
+
+    def reset(self):
+        self.stats = {}
+
+    def record(self, category, name, elapsed):
+        try:
+            stats = self.stats[(category, name)]
+        except KeyError:
+            stats = self.stats[(category, name)] = ProfileStats()
+        stats.record(elapsed)
+
+    def wrap(self, category, name, func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(category, name, perf_counter() - start)
+
+        return wrapper
+
+    def wrap_async(self, category, name, func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                self.record(category, name, perf_counter() - start)
+
+        return wrapper
+
+    def report(self):
+        """
+        Builds a report of recorded times.
+
+        :return: Dictionary like ``{category: {name: {'calls': int, 'total': float, 'mean': float,
+            'min': float, 'max': float}}}``. Categories are ``hooks`` (names like ``Plugin.hook``),
+            ``io``, ``serializer`` and ``parser`` (names are endpoints).
+        """
+        result = {self.HOOKS: {}, self.IO: {}, self.SERIALIZER: {}, self.PARSER: {}}
+        for (category, name), stats in self.stats.items():
+            result.setdefault(category, {})[name] = stats.as_dict()
+        return result
@@ -1,3 +1,6 @@
+from collections.abc import Mapping
+
+
 def json_loader(filename):
     from json import load
     with open(filename) as f:
@@ -11,7 +14,6 @@ def yaml_loader(filename):
 
 
 def configuration_loader(filename):
-    from collections import Mapping
     from configure import Configuration
     config = Configuration.from_file(filename)
     config.configure()
@@ -20,3 +22,349 @@ def configuration_loader(filename):
         return {k: (to_dict(v) if isinstance(v, Mapping) else v) for k, v in mapping.items()}
 
     return to_dict(config)
+
+
+HTTP_METHODS = frozenset(['GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS', 'TRACE', 'CONNECT'])
+
+_MAPPING_KEYS = ('headers', 'query_params', 'path_tokens', 'mock', 'logger', 'elapsed')
+_BOOLEAN_KEYS = ('stream_request', 'stream_response')
+
+CACHE_VERSION = 1
+
+
+class SpecError(ValueError):
+    """
+    Spec is malformed. Problems found are listed on ``errors`` attribute.
+    """
+
+    def __init__(self, errors):
+        super(SpecError, self).__init__('Malformed spec:\n' + '\n'.join(errors))
+        self.errors = errors
+
+
+def _validate_endpoint(endpoint, desc):
+    from string import Formatter
+
+    if not isinstance(desc, Mapping):
+        return ['{}: endpoint definition must be a mapping'.format(endpoint)]
+
+    errors = []
+    path = desc.get('path', '')
+    if not isinstance(path, str):
+        errors.append('{}: path must be a string'.format(endpoint))
+    else:
+        try:
+            list(Formatter().parse(path))
+        except ValueError as ex:
+            errors.append('{}: malformed path "{}": {}'.format(endpoint, path, ex))
+
+    method = desc.get('method', 'GET')
+    if not isinstance(method, str) or method.upper() not in HTTP_METHODS:
+        errors.append('{}: unknown method {!r}'.format(endpoint, method))
+
+    for key in _MAPPING_KEYS:
+        if key in desc and not isinstance(desc[key], Mapping):
+            errors.append('{}: {} must be a mapping'.format(endpoint, key))
+
+    for key in _BOOLEAN_KEYS:
+        if key in desc and not isinstance(desc[key], bool):
+            errors.append('{}: {} must be a boolean'.format(endpoint, key))
+
+    timeout = desc.get('timeout')
+    if timeout is not None and (isinstance(timeout, bool) or not isinstance(timeout, (int, float))):
+        errors.append('{}: timeout must be a number'.format(endpoint))
+
+    return errors
+
+
+def validate_spec(spec):
+    """
+    Validates and normalises a spec. Endpoint methods are upper-cased.
+
+    :param spec: Service client spec.
+    :type spec: dict
+    :return: Normalised spec.
+    :rtype: dict
+    :raises SpecError: When any endpoint is malformed.
+    """
+
+    if not isinstance(spec, Mapping):
+        raise SpecError(['spec must be a mapping'])
+
+    errors = []
+    result = {}
+    for endpoint, desc in spec.items():
+        endpoint_errors = _validate_endpoint(endpoint, desc)
+        if endpoint_errors:
+            errors.extend(endpoint_errors)
+            continue
+
+        desc = dict(desc)
+        if 'method' in desc:
+            desc['method'] = desc['method'].upper()
+        result[endpoint] = desc
+
+    if errors:
+        raise SpecError(errors)
+    return result
+
+
+def cached_loader(filename, loader=yaml_loader, cache_dir=None):
+    """
+    Loads a spec file, validates and normalises it (see :func:`validate_spec`) and stores result on a
+    compiled cache. Next loads use cache while file content does not change.
+
+    Cache is keyed by file content hash, so files included by configuration files are not taken into account.
+
+    :param filename: Spec file.
+    :type filename: str
+    :param loader: Loader used when cache is not valid. **Default:** :func:`yaml_loader`
+    :type loader: callable
+    :param cache_dir: Cache directory. **Default:** ``__speccache__`` directory next to spec file.
+    :type cache_dir: str
+    :return: dict
+    """
+    import os
+    import pickle
+    from hashlib import sha1
+
+    with open(filename, 'rb') as f:
+        digest = sha1(f.read()).hexdigest()
+
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(filename)), '__speccache__')
+    cache_file = os.path.join(cache_dir, '{}.{}.pickle'.format(os.path.basename(filename), loader.__name__))
+
+    try:
+        with open(cache_file, 'rb') as f:
+            version, cached_digest, spec = pickle.load(f)
+    except Exception:
+        pass
+    else:
+        if version == CACHE_VERSION and cached_digest == digest:
+            return spec
+
+    spec = validate_spec(loader(filename))
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+        with open(tmp_file, 'wb') as f:
+            pickle.dump((CACHE_VERSION, digest, spec), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    except OSError:  # pragma: no cover
+        pass
+
+    return spec
+
+
+_OPERATION_METHODS = ('get', 'put', 'post', 'delete', 'options', 'head', 'patch', 'trace')
+_BINARY_CONTENT_TYPES = frozenset(['application/octet-stream', 'application/zip', 'application/pdf'])
+
+
+def _is_binary_schema(schema):
+    return schema.get('type') == 'file' or schema.get('format') == 'binary'
+
+
+class OpenAPISpec(Mapping):
+    """
+    Service client spec built from an OpenAPI 3 or Swagger 2 document. Endpoints are named by operation
+    identifier (operations without it are named by method and path) and they are built when they are used.
+    Document is read the first time spec is used.
+
+    :param filename: OpenAPI document file (JSON or YAML).
+    :type filename: str
+    :param include_base_path: Add ``basePath`` (Swagger 2) or first server path (OpenAPI 3) to endpoint paths.
+        **Default:** True
+    :type include_base_path: bool
+    """
+
+    def __init__(self, filename, include_base_path=True):
+        self.filename = filename
+        self.include_base_path = include_base_path
+        self._document = None
+        self._operations = None
+        self._endpoints = {}
+
+    @property
+    def document(self):
+        if self._document is None:
+            if self.filename.endswith('.json'):
+                self._document = json_loader(self.filename)
+            else:
+                from yaml import load
+                try:
+                    from yaml import CSafeLoader as SafeLoader
+                except ImportError:  # pragma: no cover
+                    from yaml import SafeLoader
+                with open(self.filename) as f:
+                    self._document = load(f, Loader=SafeLoader)
+        return self._document
+
+    @property
+    def is_swagger(self):
+        return 'swagger' in self.document
+
+    @property
+    def base_path(self):
+        if not self.include_base_path:
+            return ''
+        if self.is_swagger:
+            return self.document.get('basePath', '').rstrip('/')
+
+        from urllib.parse import urlparse
+        try:
+            return urlparse(self.document['servers'][0]['url']).path.rstrip('/')
+        except (KeyError, IndexError):
+            return ''
+
+    @property
+    def operations(self):
+        """
+        Operations index: endpoint name to ``(path, method)``.
+        """
+        if self._operations is None:
+            import re
+
+            operations = {}
+            for path, path_item in self.document.get('paths', {}).items():
+                for method in _OPERATION_METHODS:
+                    try:
+                        operation = path_item[method]
+                    except KeyError:
+                        continue
+                    name = operation.get('operationId') or \
+                        '{}_{}'.format(method, re.sub(r'\W+', '_', path).strip('_'))
+                    operations[name] = (path, method)
+            self._operations = operations
+        return self._operations
+
+    def resolve(self, obj):
+        """
+        Resolves local references (``$ref: '#/...'``).
+        """
+        while isinstance(obj, dict) and '$ref' in obj:
+            ref = obj['$ref']
+            if not ref.startswith('#/'):
+                raise ValueError('Only local references are supported: {}'.format(ref))
+            obj = self.document
+            for part in ref[2:].split('/'):
+                obj = obj[part.replace('~1', '/').replace('~0', '~')]
+        return obj
+
+    def _parameters(self, path_item, operation):
+        parameters = {}
+        for param in path_item.get('parameters', []) + operation.get('parameters', []):
+            param = self.resolve(param)
+            parameters[(param['name'], param['in'])] = param
+        return parameters.values()
+
+    def _default(self, param):
+        if 'default' in param:
+            return param['default']
+        return self.resolve(param.get('schema', {})).get('default')
+
+    def _content_types(self, operation):
+        if self.is_swagger:
+            consumes = operation.get('consumes', self.document.get('consumes', []))
+            produces = operation.get('produces', self.document.get('produces', []))
+            return consumes, produces
+
+        request_body = self.resolve(operation.get('requestBody', {}))
+        consumes = list(request_body.get('content', {}).keys())
+        produces = []
+        for status, response in sorted(operation.get('responses', {}).items(), key=lambda r: str(r[0])):
+            if str(status).startswith('2'):
+                produces = list(self.resolve(response).get('content', {}).keys())
+                break
+        return consumes, produces
+
+    def _is_stream_request(self, operation, parameters, consumes):
+        if any(c in _BINARY_CONTENT_TYPES for c in consumes):
+            return True
+        if self.is_swagger:
+            return any(p['in'] in ('formData', 'body') and _is_binary_schema(self.resolve(p.get('schema', p)))
+                       for p in parameters)
+        content = self.resolve(operation.get('requestBody', {})).get('content', {})
+        return any(_is_binary_schema(self.resolve(c.get('schema', {}))) for c in content.values())
+
+    def _is_stream_response(self, operation, produces):
+        if produces and all(c in _BINARY_CONTENT_TYPES for c in produces):
+            return True
+        for status, response in operation.get('responses', {}).items():
+            if not str(status).startswith('2'):
+                continue
+            response = self.resolve(response)
+            if self.is_swagger:
+                schemas = [response.get('schema', {})]
+            else:
+                schemas = [c.get('schema', {}) for c in response.get('content', {}).values()]
+            if any(_is_binary_schema(self.resolve(s)) for s in schemas):
+                return True
+        return False
+
+    def build_endpoint(self, path, method):
+        path_item = self.document['paths'][path]
+        operation = path_item[method]
+        parameters = list(self._parameters(path_item, operation))
+        consumes, produces = self._content_types(operation)
+
+        endpoint_desc = {'path': self.base_path + path, 'method': method.upper()}
+
+        headers = {}
+        if consumes:
+            headers['Content-Type'] = consumes[0]
+        if produces:
+            headers['Accept'] = produces[0]
+
+        query_params = {}
+        path_tokens = {}
+        for param in parameters:
+            default = self._default(param)
+            if default is None:
+                continue
+            if param['in'] == 'header':
+                headers[param['name']] = str(default)
+            elif param['in'] == 'query':
+                query_params[param['name']] = default
+            elif param['in'] == 'path':
+                path_tokens[param['name']] = default
+
+        if headers:
+            endpoint_desc['headers'] = headers
+        if query_params:
+            endpoint_desc['query_params'] = query_params
+        if path_tokens:
+            endpoint_desc['path_tokens'] = path_tokens
+        if self._is_stream_request(operation, parameters, consumes):
+            endpoint_desc['stream_request'] = True
+        if self._is_stream_response(operation, produces):
+            endpoint_desc['stream_response'] = True
+
+        return endpoint_desc
+
+    def __getitem__(self, name):
+        try:
+            return self._endpoints[name]
+        except KeyError:
+            pass
+
+        endpoint_desc = self._endpoints[name] = self.build_endpoint(*self.operations[name])
+        return endpoint_desc
+
+    def __iter__(self):
+        return iter(self.operations)
+
+    def __len__(self):
+        return len(self.operations)
+
+
+def openapi_loader(filename, include_base_path=True):
+    """
+    Loads an OpenAPI 3 or Swagger 2 document as service client spec. See :class:`OpenAPISpec`.
+
+    :param filename: OpenAPI document file (JSON or YAML).
+    :type filename: str
+    :return: OpenAPISpec
+    """
+    return OpenAPISpec(filename, include_base_path=include_base_path)
@@ -0,0 +1,143 @@
+from asyncio import get_event_loop
+
+from aiohttp import ClientOSError, ClientResponse, ServerDisconnectedError, ServerTimeoutError, web
+from multidict import MultiDict
+from yarl import URL
+
+from .mocks import Mock
+from .spec_loaders import SpecError
+from .utils import ObjectWrapper
+
+_SKIP_HEADERS = frozenset(['content-length', 'transfer-encoding', 'content-encoding'])
+
+
+class _StubServiceClient:
+
+    def __init__(self, name, loop):
+        self.name = name
+        self.loop = loop
+
+    def create_response(self, *args, **kwargs):
+        return ObjectWrapper(ClientResponse(*args, **kwargs))
+
+
+def _normalize_path(prefix, path):
+    return '/'.join([prefix.rstrip('/'), path.lstrip('/')]) or '/'
+
+
+def create_app(spec, name='StubServer', prefix='', base_path=None, namespaces=None, loop=None):
+    """
+    Builds an aiohttp application which serves endpoints defined on spec using their mock definitions.
+    Every mock type could be used (files, data, cassettes, latency and faults...) and mocks patched using
+    ``mock_manager`` are used, too. Endpoints without mock definition are not served.
+
+    It raises :class:`~service_client.spec_loaders.SpecError` when two mocked endpoints share method and path.
+
+    :param spec: Service client spec.
+    :type spec: dict
+    :param name: Service name used to look for patched mocks.
+    :type name: str
+    :param prefix: Path prefix of every endpoint.
+    :type prefix: str
+    :param base_path: Base path used to build urls passed to mocks (cassettes fingerprints use them).
+        **Default:** request url.
+    :type base_path: str
+    :param namespaces: Mock plugin namespaces.
+    :type namespaces: dict
+    :return: aiohttp.web.Application
+    """
+    service_client = _StubServiceClient(name, loop or get_event_loop())
+    mock_plugin = Mock(namespaces=namespaces)
+    mock_plugin.assign_service_client(service_client)
+
+    def build_handler(endpoint, desc):
+        async def handler(request):
+            endpoint_desc = dict(desc, endpoint=endpoint)
+            if base_path is None:
+                url = URL('{}://{}{}'.format(request.scheme, request.host, request.rel_url.path))
+            else:
+                url = URL(_normalize_path(base_path, request.rel_url.path[len(prefix.rstrip('/')):]))
+
+            request_params = {'params': MultiDict(request.query)}
+            body = await request.read()
+            if body:
+                request_params['data'] = body
+
+            session = ObjectWrapper(None)
+            await mock_plugin.prepare_session(endpoint_desc, session, request_params)
+
+            try:
+                response = await session.request(method=request.method, url=url, **request_params)
+                response_body = await response.read()
+            except (ClientOSError, ServerDisconnectedError, ServerTimeoutError):
+                if request.transport is not None:
+                    request.transport.close()
+                raise web.HTTPServiceUnavailable()
+
+            return web.Response(status=response.status,
+                                headers={k: v for k, v in response.headers.items()
+                                         if k.lower() not in _SKIP_HEADERS},
+                                body=response_body)
+
+        return handler
+
+    app = web.Application()
+    # Mock plugin keeps a weak reference to service client
+    app['service_client'] = service_client
+    routes = {}
+    errors = []
+    for endpoint, desc in spec.items():
+        if 'mock' not in desc:
+            continue
+
+        method = desc.get('method', 'GET').upper()
+        path = _normalize_path(prefix, desc.get('path', ''))
+        if (method, path) in routes:
+            errors.append("Endpoint {0}: route {1} {2} is already served by endpoint {3}".format(
+                endpoint, method, path, routes[(method, path)]))
+            continue
+        routes[(method, path)] = endpoint
+
+        app.router.add_route(method, path, build_handler(endpoint, desc))
+
+    if errors:
+        raise SpecError(errors)
+
+    return app
+
+
+class StubServer:
+    """
+    Local HTTP server which serves a service client spec using its mock definitions. It allows to
+    test or benchmark service clients through whole network stack, without remote services.
+
+    .. code-block:: python
+
+        server = StubServer(spec)
+        await server.start()
+        service = ServiceClient(spec=spec, base_path=server.base_path)
+
+    Parameters are the same as :func:`create_app` besides ``host`` and ``port``.
+    """
+
+    def __init__(self, spec, host='127.0.0.1', port=0, **kwargs):
+        self.spec = spec
+        self.host = host
+        self.port = port
+        self.kwargs = kwargs
+        self._runner = None
+
+    @property
+    def base_path(self):
+        return 'http://{}:{}{}'.format(self.host, self.port, self.kwargs.get('prefix', '').rstrip('/'))
+
+    async def start(self):
+        self._runner = web.AppRunner(create_app(self.spec, **self.kwargs), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        await self._runner.cleanup()
+        self._runner = None
@@ -0,0 +1,124 @@
+import os
+from asyncio import ensure_future, sleep
+
+from .plugins import BasePlugin
+from .spec_loaders import json_loader, validate_spec, yaml_loader
+
+
+class SpecWatcher(BasePlugin):
+    """
+    Watches a spec file and replaces service client spec (and base path) when file changes. File is
+    loaded on an executor and validated before replacing anything, so malformed files are logged and
+    ignored. Calls in progress keep using their endpoint definition (calls which have not built their
+    url yet use new base path) and connector is not rebuilt. File is checked when watcher starts (on first
+    call or using ``start`` method) and every ``interval`` seconds after that.
+
+    By default whole file is the spec. When ``spec_key`` is set, spec is taken from that key of file and
+    base path from ``base_path_key``. Base path could be a list of backends, which are set on ``LoadBalancer``
+    plugins, too.
+
+    :param filename: Spec file.
+    :type filename: str
+    :param loader: Spec loader function. **Default:** by file extension (JSON or YAML).
+    :param interval: Seconds between file checks.
+    :type interval: float
+    :param spec_key: File key with spec.
+    :type spec_key: str
+    :param base_path_key: File key with base path.
+    :type base_path_key: str
+    """
+
+    def __init__(self, filename, loader=None, interval=5, spec_key=None, base_path_key=None):
+        self.filename = filename
+        self.loader = loader or (json_loader if filename.endswith('.json') else yaml_loader)
+        self.interval = interval
+        self.spec_key = spec_key
+        self.base_path_key = base_path_key
+
+        self.reloads = 0
+        self.last_error = None
+        self._version = None
+        self._task = None
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self._task is None:
+            self._task = ensure_future(self._watch(), loop=self.service_client.loop)
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _watch(self):
+        while True:
+            try:
+                await self.check()
+            except Exception as ex:
+                self.service_client.logger.exception(ex)
+            await sleep(self.interval)
+
+    def _get_version(self):
+        stat = os.stat(self.filename)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load(self):
+        data = self.loader(self.filename)
+        if self.spec_key is None:
+            return validate_spec(data), None
+
+        base_path = data[self.base_path_key] if self.base_path_key is not None else None
+        return validate_spec(data[self.spec_key]), base_path
+
+    async def check(self):
+        """
+        Reloads file if it has changed.
+
+        :return: True if spec has been replaced.
+        """
+        try:
+            version = self._get_version()
+        except OSError as ex:
+            self.last_error = ex
+            self.service_client.logger.warning("Spec file {0} is not available: {1}".format(self.filename, ex))
+            return False
+
+        if version == self._version:
+            return False
+
+        self._version = version
+        try:
+            spec, base_path = await self.service_client.loop.run_in_executor(None, self._load)
+        except Exception as ex:
+            self.last_error = ex
+            self.service_client.logger.error("Spec file {0} could not be loaded: {1}".format(self.filename, ex))
+            return False
+
+        self.apply(spec, base_path)
+        return True
+
+    def apply(self, spec, base_path=None):
+        """
+        Replaces service client spec and, if it is set, base path and load balancer backends.
+        """
+        service_client = self.service_client
+        service_client.spec = spec
+        if base_path is not None:
+            service_client.base_path = base_path
+            for plugin in service_client._plugins:
+                if hasattr(plugin, 'set_backends'):
+                    plugin.set_backends(base_path)
+
+        self.reloads += 1
+        self.last_error = None
+        service_client.logger.info("Spec reloaded from {0}".format(self.filename))
+
+    async def prepare_session(self, endpoint_desc, session, request_params):
+        if self._task is None:
+            self.start()
+
+    def close(self):
+        self.stop()
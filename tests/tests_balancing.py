@@ -0,0 +1,261 @@
+from asyncio import TimeoutError, ensure_future, sleep, wait_for
+from unittest.mock import patch
+
+from aiohttp import ClientConnectionError, web
+from asynctest.case import TestCase
+
+from service_client import ServiceClient
+from service_client.balancing import Backend, ConsistentHashPolicy, EWMAPolicy, LeastOutstandingPolicy, LoadBalancer, \
+    PowerOfTwoChoicesPolicy, RoundRobinPolicy
+from service_client.plugins import Pool, TooManyRequestsPendingError
+from service_client.utils import ObjectWrapper
+
+
+class PoliciesTest(TestCase):
+
+    def setUp(self):
+        self.backends = [Backend('http://a'), Backend('http://b'), Backend('http://c')]
+
+    def choose(self, policy):
+        return policy.choose(self.backends, {}, {}).base_path
+
+    def test_round_robin(self):
+        policy = RoundRobinPolicy()
+        self.assertEqual([self.choose(policy) for _ in range(4)], ['http://a', 'http://b', 'http://c', 'http://a'])
+
+    def test_least_outstanding(self):
+        self.backends[0].outstanding = 2
+        self.backends[1].outstanding = 1
+        self.backends[2].outstanding = 3
+        self.assertEqual(self.choose(LeastOutstandingPolicy()), 'http://b')
+
+        self.backends[0].outstanding = 1
+        self.assertEqual({self.choose(LeastOutstandingPolicy(seed=i)) for i in range(20)}, {'http://a', 'http://b'})
+
+    def test_power_of_two_choices(self):
+        self.backends[2].outstanding = 10
+        policy = PowerOfTwoChoicesPolicy(seed=1)
+        self.assertNotIn('http://c', {self.choose(policy) for _ in range(50)})
+
+        self.assertEqual(PowerOfTwoChoicesPolicy().choose(self.backends[:1], {}, {}), self.backends[0])
+
+    def test_ewma(self):
+        self.backends[0].ewma = 0.1
+        self.backends[1].ewma = 0.01
+        self.backends[2].ewma = 0.02
+        self.backends[2].outstanding = 5
+        policy = EWMAPolicy(seed=1)
+        self.assertEqual({self.choose(policy) for _ in range(50)}, {'http://b', 'http://a'})
+        self.assertGreater([self.choose(policy) for _ in range(50)].count('http://b'), 25)
+
+    def test_ewma_prefers_unknown(self):
+        self.backends[0].ewma = 0.1
+        self.backends[1].ewma = 0.1
+        policy = EWMAPolicy(seed=1)
+        self.assertEqual({self.choose(policy) for _ in range(50)}, {'http://a', 'http://b', 'http://c'})
+        self.assertGreater([self.choose(policy) for _ in range(60)].count('http://c'), 30)
+
+
+class LoadBalancerTest(TestCase):
+
+    async def setUp(self):
+        self.runners = []
+        self.statuses = []
+        self.base_paths = []
+        for i in range(3):
+            self.statuses.append(200)
+
+            async def handler(request, i=i):
+                await sleep(float(request.query.get('delay', 0)))
+                return web.Response(status=self.statuses[i], body=str(i).encode())
+
+            app = web.Application()
+            app.router.add_get('/test', handler)
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            site = web.TCPSite(runner, '127.0.0.1', 0)
+            await site.start()
+            self.runners.append(runner)
+            self.base_paths.append('http://127.0.0.1:{}'.format(site._server.sockets[0].getsockname()[1]))
+
+        self.plugin = LoadBalancer(consecutive_errors=2, ejection_time=10)
+        self.service_client = ServiceClient(spec={'test': {'path': '/test'}}, plugins=[self.plugin],
+                                            base_path=self.base_paths)
+
+    async def tearDown(self):
+        await self.service_client.aclose()
+        for runner in self.runners:
+            await runner.cleanup()
+
+    async def test_round_robin(self):
+        responses = [(await self.service_client.call('test')).data for _ in range(6)]
+        self.assertEqual(responses, [b'0', b'1', b'2', b'0', b'1', b'2'])
+        self.assertEqual([b.requests for b in self.plugin.backends], [2, 2, 2])
+        self.assertEqual([b.outstanding for b in self.plugin.backends], [0, 0, 0])
+        self.assertTrue(all(b.ewma > 0 for b in self.plugin.backends))
+
+    async def test_least_outstanding(self):
+        self.plugin.policy = LeastOutstandingPolicy()
+        slow = ensure_future(self.service_client.call('test', params={'delay': '0.1'}))
+        await sleep(0.01)
+
+        busy = self.plugin.backends.index(self.service_client.active_calls[0].session.backend)
+        self.assertEqual(self.plugin.backends[busy].outstanding, 1)
+        responses = {(await self.service_client.call('test')).data for _ in range(10)}
+        self.assertNotIn(str(busy).encode(), responses)
+        await slow
+
+    async def test_ejection(self):
+        self.statuses[1] = 500
+        responses = [(await self.service_client.call('test')).data for _ in range(6)]
+        self.assertEqual(responses, [b'0', b'1', b'2', b'0', b'1', b'2'])
+
+        backend = self.plugin.backends[1]
+        self.assertEqual(backend.errors, 2)
+        self.assertTrue(backend.is_ejected(backend.ejected_until - 1))
+        self.assertEqual(backend.as_dict()['ejected'], True)
+
+        responses = {(await self.service_client.call('test')).data for _ in range(6)}
+        self.assertEqual(responses, {b'0', b'2'})
+
+        with patch('service_client.balancing.monotonic', return_value=backend.ejected_until + 1):
+            self.assertEqual(len(self.plugin.get_available_backends()), 3)
+
+    async def test_ejection_exception(self):
+        await self.runners[1].cleanup()
+        for _ in range(6):
+            try:
+                await self.service_client.call('test')
+            except ClientConnectionError:
+                pass
+
+        self.assertTrue(self.plugin.backends[1].as_dict()['ejected'])
+        self.assertEqual(self.plugin.backends[1].outstanding, 0)
+
+    async def test_max_ejection_ratio(self):
+        self.statuses[0] = self.statuses[1] = self.statuses[2] = 500
+        for _ in range(6):
+            await self.service_client.call('test')
+
+        self.assertEqual(sum(1 for b in self.plugin.backends if b.as_dict()['ejected']), 1)
+
+    async def test_exceptions_not_related_with_backend(self):
+        session = ObjectWrapper(None)
+        await self.plugin.prepare_base_path({}, session, {}, self.base_paths)
+        session.backend.consecutive_errors = 1
+
+        await self.plugin.on_exception({}, session, {}, TooManyRequestsPendingError())
+        self.assertEqual(session.backend.consecutive_errors, 1)
+        self.plugin.on_call_end({}, session, {})
+        self.assertEqual(session.backend.outstanding, 0)
+
+        await self.plugin.prepare_base_path({}, session, {}, self.base_paths)
+        await self.plugin.on_exception({}, session, {}, TimeoutError())
+        self.assertEqual(session.backend.errors, 1)
+        self.assertEqual(session.backend.consecutive_errors, 1)
+
+    async def test_cancelled_calls(self):
+        for _ in range(3):
+            with self.assertRaises(TimeoutError):
+                await wait_for(self.service_client.call('test', params={'delay': '1'}), timeout=0.05)
+
+        self.assertEqual([b.outstanding for b in self.plugin.backends], [0, 0, 0])
+        self.assertEqual([b.errors for b in self.plugin.backends], [0, 0, 0])
+
+    async def test_error_preparing_request(self):
+        class FailingPlugin:
+            async def prepare_request_params(self, endpoint_desc, session, request_params):
+                raise ValueError('wrong params')
+
+        self.service_client.add_plugins([FailingPlugin()])
+        for _ in range(3):
+            with self.assertRaises(ValueError):
+                await self.service_client.call('test')
+
+        self.assertEqual([b.requests for b in self.plugin.backends], [1, 1, 1])
+        self.assertEqual([b.outstanding for b in self.plugin.backends], [0, 0, 0])
+
+    async def test_set_backends(self):
+        await self.service_client.call('test')
+        backend = self.plugin.backends[0]
+
+        self.plugin.set_backends([self.base_paths[2], self.base_paths[0]])
+        self.assertEqual([b.base_path for b in self.plugin.backends], [self.base_paths[2], self.base_paths[0]])
+        self.assertIs(self.plugin.backends[1], backend)
+        self.assertEqual(backend.requests, 1)
+
+    async def test_pool_rejection(self):
+        self.service_client.add_plugins([Pool(limit=1, hard_limit=0)])
+        calls = [ensure_future(self.service_client.call('test', params={'delay': '0.05'})) for _ in range(2)]
+        await sleep(0.01)
+
+        with self.assertRaises(TooManyRequestsPendingError):
+            await self.service_client.call('test')
+        await calls[0]
+        await calls[1]
+        self.assertEqual([b.outstanding for b in self.plugin.backends], [0, 0, 0])
+        self.assertEqual([b.errors for b in self.plugin.backends], [0, 0, 0])
+
+    async def test_warm_up(self):
+        self.assertEqual(await self.service_client.warm_up(connections=2), 6)
+
+    async def test_consistent_hash(self):
+        self.plugin.policy = ConsistentHashPolicy('user_id', method='ring')
+
+        responses = {}
+        for user_id in range(10):
+            responses[user_id] = {(await self.service_client.call('test', params={'user_id': user_id})).data
+                                  for _ in range(3)}
+        self.assertTrue(all(len(r) == 1 for r in responses.values()))
+        self.assertGreater(len(set.union(*responses.values())), 1)
+
+
+class ConsistentHashPolicyTest(TestCase):
+
+    def setUp(self):
+        self.backends = [Backend('http://backend{}'.format(i)) for i in range(5)]
+
+    def assignments(self, policy, backends, keys=range(1000)):
+        return {key: policy.choose(backends, {}, {'user_id': key}).base_path for key in keys}
+
+    def check_minimal_remapping(self, policy):
+        before = self.assignments(policy, self.backends)
+        self.assertEqual(before, self.assignments(policy, self.backends))
+        self.assertEqual(len(set(before.values())), 5)
+
+        # removed backend keys are remapped, other keys stay
+        after = self.assignments(policy, self.backends[:2] + self.backends[3:])
+        moved = [key for key in before if before[key] != after[key]]
+        self.assertEqual({before[key] for key in moved}, {'http://backend2'})
+
+        # added backend takes keys only from other backends, roughly a share of them
+        after = self.assignments(policy, self.backends + [Backend('http://backend5')])
+        moved = [key for key in before if before[key] != after[key]]
+        self.assertEqual({after[key] for key in moved}, {'http://backend5'})
+        self.assertLess(len(moved), 300)
+
+    def test_rendezvous(self):
+        self.check_minimal_remapping(ConsistentHashPolicy('user_id'))
+
+    def test_ring(self):
+        self.check_minimal_remapping(ConsistentHashPolicy('user_id', method='ring'))
+
+    def test_unknown_method(self):
+        with self.assertRaises(ValueError):
+            ConsistentHashPolicy('user_id', method='unknown')
+
+    def test_key_sources(self):
+        policy = ConsistentHashPolicy('user_id')
+        self.assertEqual(policy.get_key({}, {'user_id': 1}), 1)
+        self.assertEqual(policy.get_key({}, {'params': {'user_id': 2}}), 2)
+        self.assertEqual(policy.get_key({'path_tokens': {'user_id': 3}}, {}), 3)
+        self.assertEqual(policy.get_key({'query_params': {'user_id': 4}}, {'params': None}), 4)
+        self.assertIsNone(policy.get_key({}, {}))
+
+        policy = ConsistentHashPolicy(lambda endpoint_desc, request_params: endpoint_desc['endpoint'])
+        self.assertEqual(policy.get_key({'endpoint': 'test'}, {}), 'test')
+
+    def test_fallback(self):
+        policy = ConsistentHashPolicy('user_id')
+        self.assertEqual([policy.choose(self.backends, {}, {}).base_path for _ in range(2)],
+                         ['http://backend0', 'http://backend1'])
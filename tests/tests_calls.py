@@ -0,0 +1,36 @@
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from service_client.calls import CONNECTING, PREPARING, CallInfo
+
+
+class CallInfoTest(TestCase):
+
+    @patch('service_client.calls.monotonic')
+    def test_phases(self, mock_monotonic):
+        mock_monotonic.return_value = 10
+        call_info = CallInfo('endpoint')
+        self.assertEqual(call_info.phase, PREPARING)
+
+        mock_monotonic.return_value = 12
+        call_info.set_phase(CONNECTING)
+        mock_monotonic.return_value = 15
+        self.assertEqual(call_info.phase, CONNECTING)
+        self.assertEqual(call_info.elapsed, 5)
+        self.assertEqual(call_info.phase_elapsed, 3)
+
+        self.assertEqual(call_info.as_dict(), {'endpoint': 'endpoint',
+                                               'tracking_token': None,
+                                               'phase': CONNECTING,
+                                               'elapsed': 5,
+                                               'phase_elapsed': 3})
+        self.assertEqual(repr(call_info), '<CallInfo endpoint connecting 5.000s>')
+
+    def test_tracking_token(self):
+        call_info = CallInfo('endpoint')
+        call_info.session = Mock(tracking_token='token')
+        self.assertEqual(call_info.tracking_token, 'token')
+
+    def test_slots(self):
+        with self.assertRaises(AttributeError):
+            CallInfo('endpoint').foo = 'bar'
@@ -0,0 +1,132 @@
+import json
+import os
+from tempfile import TemporaryDirectory
+
+from asynctest.case import TestCase
+from unittest.mock import patch
+
+from service_client import ServiceClient
+from service_client.cassettes import INDEX_FILENAME, NoRecordError, Recorder, fingerprint, load_cassette
+from service_client.mocks import Mock
+from service_client.plugins import QueryParams
+
+
+class FingerprintTest(TestCase):
+
+    def test_query_order(self):
+        self.assertEqual(fingerprint('get', 'http://example.com/path?b=2&a=1'),
+                         fingerprint('GET', 'http://example.com/path', params={'a': '1', 'b': '2'}))
+
+    def test_body(self):
+        self.assertEqual(fingerprint('POST', 'http://example.com/path', data='data'),
+                         fingerprint('POST', 'http://example.com/path', data=b'data'))
+        self.assertNotEqual(fingerprint('POST', 'http://example.com/path', data=b'data'),
+                            fingerprint('POST', 'http://example.com/path', data=b'other'))
+
+    def test_method(self):
+        self.assertNotEqual(fingerprint('GET', 'http://example.com/path'),
+                            fingerprint('DELETE', 'http://example.com/path'))
+
+
+class CassetteTest(TestCase):
+
+    async def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'cassette')
+
+    async def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _create_client(self, spec, plugins):
+        client = ServiceClient(name='test_service', spec=spec, plugins=plugins, base_path='http://example.com',
+                               loop=self.loop)
+        self.addCleanup(client.close)
+        return client
+
+    async def _record(self):
+        spec = {'get_user': {'path': '/user', 'method': 'get',
+                             'mock': {'mock_type': 'default:JsonDataMock',
+                                      'data': {'name': 'john'},
+                                      'headers': {'Content-Type': 'application/json'}}},
+                'create_user': {'path': '/user', 'method': 'post',
+                                'mock': {'mock_type': 'default:RawDataMock', 'data': 'created', 'status': 201}},
+                'stream': {'path': '/stream', 'method': 'get', 'stream_response': True,
+                           'mock': {'mock_type': 'default:RawDataMock', 'data': 'stream'}}}
+
+        recorder = Recorder(self.path)
+        client = self._create_client(spec, [Mock(), QueryParams(), recorder])
+        await client.call('get_user', params={'id': 1})
+        await client.call('create_user', payload=b'john')
+        await client.call('stream')
+        recorder.close()
+
+    def _replay_client(self, **mock_desc):
+        mock = {'mock_type': 'default:CassetteMock', 'cassette': self.path}
+        mock.update(mock_desc)
+        spec = {'get_user': {'path': '/user', 'method': 'get', 'mock': mock},
+                'create_user': {'path': '/user', 'method': 'post', 'mock': mock}}
+        return self._create_client(spec, [Mock(), QueryParams()])
+
+    async def test_record(self):
+        await self._record()
+
+        with open(os.path.join(self.path, INDEX_FILENAME)) as f:
+            records = [json.loads(line) for line in f]
+
+        self.assertEqual([(r['endpoint'], r['method'], r['status']) for r in records],
+                         [('get_user', 'GET', 200), ('create_user', 'POST', 201)])
+        self.assertEqual(records[0]['service_name'], 'test_service')
+        self.assertEqual(records[0]['headers'], [['Content-Type', 'application/json']])
+        self.assertEqual(records[0]['fingerprint'], fingerprint('GET', 'http://example.com/user?id=1'))
+        self.assertGreaterEqual(records[0]['elapsed'], records[0]['headers_elapsed'])
+
+        cassette = load_cassette(self.path)
+        self.assertEqual(cassette.load_body(records[0]), b'{"name": "john"}')
+        self.assertEqual(cassette.load_body(records[1]), b'created')
+
+    async def test_replay(self):
+        await self._record()
+        client = self._replay_client()
+
+        response = await client.call('get_user', params={'id': 1})
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.headers['Content-Type'], 'application/json')
+        self.assertEqual(response.data, b'{"name": "john"}')
+
+        response = await client.call('create_user', payload=b'john')
+        self.assertEqual(response.status, 201)
+        self.assertEqual(response.data, b'created')
+
+    async def test_replay_not_recorded(self):
+        await self._record()
+        client = self._replay_client()
+
+        with self.assertRaises(NoRecordError):
+            await client.call('get_user', params={'id': 2})
+
+    async def test_replay_preserve_timing(self):
+        await self._record()
+        record = load_cassette(self.path).records[fingerprint('GET', 'http://example.com/user?id=1')][0]
+        client = self._replay_client(preserve_timing=True)
+        delays = []
+
+        async def fake_sleep(delay):
+            delays.append(delay)
+
+        with patch('service_client.mocks.sleep', fake_sleep):
+            await client.call('get_user', params={'id': 1})
+
+        self.assertEqual(delays, [record['headers_elapsed'], record['elapsed'] - record['headers_elapsed']])
+
+    async def test_same_fingerprint_in_order(self):
+        await self._record()
+        with open(os.path.join(self.path, INDEX_FILENAME)) as f:
+            first = json.loads(f.readline())
+        second = dict(first, status=404)
+        with open(os.path.join(self.path, INDEX_FILENAME), 'a') as f:
+            f.write(json.dumps(second) + '\n')
+
+        client = self._replay_client()
+        statuses = [(await client.call('get_user', params={'id': 1})).status for _ in range(3)]
+
+        self.assertEqual(statuses, [200, 404, 200])
@@ -0,0 +1,195 @@
+from asyncio import ensure_future, gather, sleep
+
+from asynctest import patch
+from asynctest.case import TestCase
+
+from service_client import ServiceClient
+from service_client.calls import QUEUED
+from service_client.connectors import ConnectorRegistry, connector_registry
+from service_client.mocks import Mock, MockResponse, mock_manager
+from service_client.plugins import BasePlugin, ConnectorLimit
+
+
+class ConnectorRegistryTest(TestCase):
+
+    def setUp(self):
+        self.registry = ConnectorRegistry()
+
+    async def test_acquire_release(self):
+        connector = self.registry.acquire('shared', self.loop, limit=10)
+        self.assertIs(self.registry.acquire('shared', self.loop, limit=10), connector)
+        self.assertEqual(connector.limit, 10)
+        self.assertEqual(self.registry.ref_count('shared', self.loop), 2)
+
+        self.assertIsNone(self.registry.release('shared', self.loop))
+        self.assertFalse(connector.closed)
+        self.assertIs(self.registry.get('shared', self.loop), connector)
+
+        await self.registry.release('shared', self.loop)
+        self.assertTrue(connector.closed)
+        self.assertIsNone(self.registry.get('shared', self.loop))
+        self.assertEqual(self.registry.ref_count('shared', self.loop), 0)
+        self.assertEqual(len(self.registry), 0)
+
+    async def test_different_parameters(self):
+        connector = self.registry.acquire('shared', self.loop, limit=10)
+
+        self.assertIs(self.registry.acquire('shared', self.loop, limit=20), connector)
+        self.assertIs(self.registry.acquire('shared', self.loop), connector)
+        self.assertEqual(connector.limit, 10)
+        self.assertEqual(self.registry.ref_count('shared', self.loop), 3)
+
+        self.registry.release('shared', self.loop)
+        self.registry.release('shared', self.loop)
+        await self.registry.release('shared', self.loop)
+        self.assertTrue(connector.closed)
+
+        connector = self.registry.acquire('shared', self.loop, limit=20)
+        self.assertEqual(connector.limit, 20)
+        await self.registry.release('shared', self.loop)
+
+    async def test_different_names(self):
+        connector1 = self.registry.acquire('shared1', self.loop)
+        connector2 = self.registry.acquire('shared2', self.loop)
+        self.assertIsNot(connector1, connector2)
+        self.assertEqual(len(self.registry), 2)
+
+        await self.registry.release('shared1', self.loop)
+        await self.registry.release('shared2', self.loop)
+
+    async def test_closed_connector(self):
+        connector = self.registry.acquire('shared', self.loop)
+        await connector.close()
+
+        new_connector = self.registry.acquire('shared', self.loop)
+        self.assertIsNot(new_connector, connector)
+        self.assertEqual(self.registry.ref_count('shared', self.loop), 1)
+
+        await self.registry.release('shared', self.loop)
+
+
+class SharedConnectorTest(TestCase):
+
+    async def test_shared_connector(self):
+        config = {'shared_connector': 'test', 'connector': {'limit': 5}}
+        service_client1 = ServiceClient(name='TestService1', config=config, base_path='http://foo.com')
+        service_client2 = ServiceClient(name='TestService2', config=config, base_path='http://bar.com')
+
+        self.assertIs(service_client1.connector, service_client2.connector)
+        self.assertIs(connector_registry.get('test', self.loop), service_client1.connector)
+        self.assertFalse(service_client1.session.connector_owner)
+        self.assertEqual(service_client1.connector.limit, 5)
+
+        service_client1.close()
+        await sleep(0)
+        self.assertTrue(service_client1.session.closed)
+        self.assertFalse(service_client2.connector.closed)
+
+        service_client1.close()
+        self.assertEqual(connector_registry.ref_count('test', self.loop), 1)
+
+        service_client2.close()
+        await sleep(0)
+        self.assertTrue(service_client2.connector.closed)
+        self.assertIsNone(connector_registry.get('test', self.loop))
+
+    async def test_different_limits(self):
+        service_client1 = ServiceClient(name='TestService1', base_path='http://foo.com',
+                                        config={'shared_connector': 'test', 'connector': {'limit': 10}})
+        service_client2 = ServiceClient(name='TestService2', base_path='http://bar.com',
+                                        config={'shared_connector': 'test',
+                                                'connector': {'limit': 20, 'limit_per_host': 2}})
+        service_client3 = ServiceClient(name='TestService3', base_path='http://baz.com',
+                                        config={'shared_connector': 'test',
+                                                'connector': {'limit': 10, 'keepalive_timeout': 5}})
+        self.addCleanup(service_client1.aclose)
+        self.addCleanup(service_client2.aclose)
+        self.addCleanup(service_client3.aclose)
+
+        self.assertIs(service_client1.connector, service_client2.connector)
+        self.assertIs(service_client1.connector, service_client3.connector)
+        self.assertEqual(service_client1.connector.limit, 10)
+        self.assertEqual(connector_registry.ref_count('test', self.loop), 3)
+
+        self.assertFalse([plugin for plugin in service_client1._plugins if isinstance(plugin, ConnectorLimit)])
+        self.assertFalse([plugin for plugin in service_client3._plugins if isinstance(plugin, ConnectorLimit)])
+
+        plugins = [plugin for plugin in service_client2._plugins if isinstance(plugin, ConnectorLimit)]
+        self.assertEqual(len(plugins), 1)
+        self.assertEqual(plugins[0].limit, 20)
+        self.assertEqual(plugins[0].limit_per_host, 2)
+
+    async def test_own_limit_enforced(self):
+        started = []
+        release = self.loop.create_future()
+
+        async def request(method, url, **kwargs):
+            started.append(url)
+            await release
+            return MockResponse(method, url, body=b'ok')
+
+        spec = {'test': {'path': '/test', 'method': 'get',
+                         'mock': {'mock_type': 'default:RawDataMock', 'data': 'ok'}}}
+        service_client1 = ServiceClient(name='TestService1', base_path='http://foo.com',
+                                        config={'shared_connector': 'test'})
+        service_client2 = ServiceClient(name='TestService2', spec=spec, plugins=[Mock()], base_path='http://bar.com',
+                                        config={'shared_connector': 'test', 'connector': {'limit_per_host': 1}})
+        self.addCleanup(service_client1.aclose)
+        self.addCleanup(service_client2.aclose)
+        # blocked calls are released before closing clients, even when test fails
+        self.addCleanup(lambda: release.done() or release.set_result(None))
+
+        with mock_manager.use_mock(mock=request, service_name='TestService2', limit=2):
+            calls = [ensure_future(service_client2.call('test')) for _ in range(2)]
+            await sleep(0.01)
+            self.assertEqual(len(started), 1)
+            self.assertEqual(service_client2.count_active_calls(phase=QUEUED), 1)
+
+            release.set_result(None)
+            responses = await gather(*calls)
+
+        self.assertEqual(len(started), 2)
+        self.assertEqual([response.data for response in responses], [b'ok', b'ok'])
+
+    async def test_own_connector(self):
+        service_client = ServiceClient(name='TestService', base_path='http://foo.com')
+        self.assertIsNone(service_client.shared_connector)
+        self.assertTrue(service_client.session.connector_owner)
+        self.assertEqual(len(connector_registry), 0)
+
+        service_client.close()
+        await sleep(0)
+        self.assertTrue(service_client.connector.closed)
+
+    async def test_close_after_failed_acquire(self):
+        config = {'shared_connector': 'test', 'connector': {'limit': 5}}
+        service_client1 = ServiceClient(name='TestService1', config=config, base_path='http://foo.com')
+
+        service_client2 = ServiceClient.__new__(ServiceClient)
+        with patch.object(connector_registry, 'acquire', side_effect=RuntimeError('acquire failed')):
+            with self.assertRaises(RuntimeError):
+                service_client2.__init__(name='TestService2', config=config, base_path='http://bar.com')
+
+        self.assertIsNone(service_client2.shared_connector)
+        service_client2.close()
+        await service_client2.aclose()
+        self.assertEqual(connector_registry.ref_count('test', self.loop), 1)
+        self.assertFalse(service_client1.connector.closed)
+
+        await service_client1.aclose()
+        self.assertTrue(service_client1.connector.closed)
+
+    async def test_close_after_failed_init(self):
+        class FailingPlugin(BasePlugin):
+            def prepare_session_config(self, session_config):
+                raise RuntimeError('bad session config')
+
+        service_client = ServiceClient.__new__(ServiceClient)
+        with self.assertRaises(RuntimeError):
+            service_client.__init__(name='TestService', plugins=[FailingPlugin()], profile=True,
+                                    config={'shared_connector': 'test'}, base_path='http://foo.com')
+
+        service_client.close()
+        await service_client.aclose()
+        self.assertIsNotNone(service_client.profiler)
+        self.assertEqual(len(connector_registry), 0)
@@ -1,10 +1,12 @@
+import json
 import logging
 from collections import OrderedDict
 from unittest.case import TestCase
+from urllib.parse import urlencode
 
 from datetime import timedelta
 
-from service_client.formatters import ServiceClientFormatter
+from service_client.formatters import ServiceClientFormatter, ServiceClientJsonFormatter
 
 
 class ServiceClientFormatterTest(TestCase):
@@ -123,3 +125,98 @@ foobar"""
         log_text = "UNKNOWN | GET http://example.com"
 
         self.assertEqual(self.formatter.formatMessage(log_entry), log_text)
+
+
+class ServiceClientFormatterStyleTest(TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger('test')
+
+    def test_str_format_style(self):
+        formatter = ServiceClientFormatter(fmt='{action} | {method} {full_url}',
+                                           response_fmt=' | {status_code} {status_text}\n{headers}',
+                                           headers_fmt='{name}={value}',
+                                           headers_sep=', ',
+                                           style='{')
+        log_entry = self.logger.makeRecord('test', logging.INFO, 'test_request', 22, 'Test Message', tuple(), None,
+                                           extra={'action': 'RESPONSE',
+                                                  'method': 'GET',
+                                                  'url': 'http://example.com',
+                                                  'params': {'q': 'a b'},
+                                                  'headers': OrderedDict([('A', '1'), ('B', '2')]),
+                                                  'status_code': 200})
+
+        self.assertEqual(formatter.formatMessage(log_entry),
+                         'RESPONSE | GET http://example.com?q=a+b | 200 OK\nA=1, B=2')
+
+    def test_query_params_quoting(self):
+        formatter = ServiceClientFormatter(fmt='%(full_url)s')
+        params = OrderedDict([('a', 1), ('b', 'x y'), ('c', 'ñ'), ('d', b'\xff'), ('e', 'a/b&c'), ('f', 'A-z_.~')])
+        log_entry = self.logger.makeRecord('test', logging.INFO, 'test_request', 22, 'Test Message', tuple(), None,
+                                           extra={'url': 'http://example.com', 'params': params})
+
+        self.assertEqual(formatter.formatMessage(log_entry), 'http://example.com?' + urlencode(params))
+
+    def test_template_style(self):
+        formatter = ServiceClientFormatter(fmt='$action ${method}', request_fmt=' 100%', style='$')
+        log_entry = self.logger.makeRecord('test', logging.INFO, 'test_request', 22, 'Test Message', tuple(), None,
+                                           extra={'action': 'REQUEST',
+                                                  'method': 'GET'})
+
+        self.assertEqual(formatter.formatMessage(log_entry), 'REQUEST GET 100%')
+
+    def test_not_referenced_fields(self):
+        formatter = ServiceClientFormatter(fmt='%(action)s', request_fmt=' static %%')
+        log_entry = self.logger.makeRecord('test', logging.INFO, 'test_request', 22, 'Test Message', tuple(), None,
+                                           extra={'action': 'REQUEST',
+                                                  'headers': {'A': '1'},
+                                                  'elapsed': timedelta(seconds=1),
+                                                  'status_code': 200})
+
+        self.assertEqual(formatter.formatMessage(log_entry), 'REQUEST static %')
+        self.assertEqual(log_entry.headers, {'A': '1'})
+        self.assertEqual(log_entry.elapsed, timedelta(seconds=1))
+        self.assertFalse(hasattr(log_entry, 'status_text'))
+        self.assertFalse(hasattr(log_entry, 'full_url'))
+
+
+class ServiceClientJsonFormatterTest(TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger('test')
+        self.extra = {'action': 'RESPONSE',
+                      'method': 'GET',
+                      'url': 'http://example.com',
+                      'headers': OrderedDict([('Test-Header-1', 'header value 1')]),
+                      'body': 'foobar',
+                      'status_code': 404,
+                      'elapsed': timedelta(seconds=0.25),
+                      'exception': AttributeError('test exception')}
+
+    def test_format(self):
+        formatter = ServiceClientJsonFormatter()
+        log_entry = self.logger.makeRecord('test', logging.INFO, 'test_request', 22, 'Test Message', tuple(), None,
+                                           extra=self.extra)
+
+        data = json.loads(formatter.format(log_entry))
+
+        self.assertEqual(data['level'], 'INFO')
+        self.assertEqual(data['logger'], 'test')
+        self.assertEqual(data['message'], 'Test Message')
+        self.assertIn('timestamp', data)
+        self.assertEqual(data['action'], 'RESPONSE')
+        self.assertEqual(data['headers'], {'Test-Header-1': 'header value 1'})
+        self.assertEqual(data['status_code'], 404)
+        self.assertEqual(data['status_text'], 'Not Found')
+        self.assertEqual(data['elapsed'], 0.25)
+        self.assertEqual(data['exception'], "AttributeError('test exception')")
+        self.assertNotIn('lineno', data)
+
+    def test_fields(self):
+        formatter = ServiceClientJsonFormatter(fields=['method', 'url', 'missing'])
+        log_entry = self.logger.makeRecord('test', logging.INFO, 'test_request', 22, 'Test Message', tuple(), None,
+                                           extra=self.extra)
+
+        data = json.loads(formatter.format(log_entry))
+
+        self.assertEqual(set(data), {'timestamp', 'level', 'logger', 'message', 'method', 'url'})
@@ -0,0 +1,149 @@
+import logging
+from threading import Event
+from time import time
+from unittest.case import TestCase
+
+from multidict import CIMultiDict
+from yarl import URL
+
+from service_client.log_dispatchers import ExceptionSnapshot, QueueLogDispatcher
+
+
+class BlockingHandler(logging.Handler):
+
+    def __init__(self):
+        super(BlockingHandler, self).__init__()
+        self.records = []
+        self.handling = Event()
+        self.unblock = Event()
+        self.unblock.set()
+
+    def emit(self, record):
+        self.handling.set()
+        self.unblock.wait(1)
+        self.records.append(record)
+
+
+class QueueLogDispatcherTests(TestCase):
+
+    def setUp(self):
+        self.handler = BlockingHandler()
+        self.logger = logging.getLogger('test.dispatcher')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+
+    def test_dispatch(self):
+        dispatcher = QueueLogDispatcher(self.logger, queue_size=10)
+        t = time()
+        dispatcher.dispatch(logging.INFO, 'message', {'endpoint': 'test_endpoint'})
+        dispatcher.stop()
+
+        self.assertFalse(dispatcher.running)
+        self.assertEqual(len(self.handler.records), 1)
+        record = self.handler.records[0]
+        self.assertEqual(record.getMessage(), 'message')
+        self.assertEqual(record.levelno, logging.INFO)
+        self.assertEqual(record.endpoint, 'test_endpoint')
+        self.assertGreaterEqual(record.created, t)
+        self.assertLessEqual(record.created, time())
+
+    def test_dispatch_snapshot(self):
+        dispatcher = QueueLogDispatcher(self.logger, queue_size=10)
+        self.handler.unblock.clear()
+        dispatcher.dispatch(logging.INFO, 'blocking', {})
+        self.assertTrue(self.handler.handling.wait(1))
+
+        headers = CIMultiDict({'Content-Type': 'application/json'})
+        params = {'a': [1, 2]}
+        ex = ValueError('error')
+        dispatcher.dispatch(logging.INFO, 'message', {'headers': headers, 'params': params, 'exception': ex,
+                                                      'url': URL('http://foo.com'), 'other': object()})
+        headers['X-Other'] = 'value'
+        params['a'].append(3)
+        params['b'] = 'b'
+
+        self.handler.unblock.set()
+        dispatcher.stop()
+
+        record = self.handler.records[1]
+        self.assertEqual(dict(record.headers), {'Content-Type': 'application/json'})
+        self.assertEqual(record.headers['content-type'], 'application/json')
+        self.assertEqual(record.params, {'a': (1, 2)})
+        self.assertIsInstance(record.exception, ExceptionSnapshot)
+        self.assertEqual(repr(record.exception), "ValueError('error')")
+        self.assertEqual(record.url, URL('http://foo.com'))
+        self.assertIsInstance(record.other, str)
+
+    def test_stop_without_waiting(self):
+        dispatcher = QueueLogDispatcher(self.logger, queue_size=1)
+        self.handler.unblock.clear()
+        dispatcher.dispatch(logging.INFO, 'blocking', {})
+        self.assertTrue(self.handler.handling.wait(1))
+        dispatcher.dispatch(logging.INFO, 'message', {})
+
+        dispatcher.stop(timeout=None)
+        self.assertTrue(dispatcher.running)
+
+        dispatcher.dispatch(logging.INFO, 'stopping', {})
+        self.assertEqual(dispatcher.dropped, 1)
+
+        self.handler.unblock.set()
+        self.assertTrue(dispatcher.join())
+
+        self.assertFalse(dispatcher.running)
+        self.assertEqual([r.getMessage() for r in self.handler.records], ['blocking', 'message'])
+
+        dispatcher.dispatch(logging.INFO, 'restarted', {})
+        dispatcher.stop()
+        self.assertEqual(self.handler.records[-1].getMessage(), 'restarted')
+        self.assertTrue(dispatcher.queue.empty())
+
+    def test_level_disabled(self):
+        dispatcher = QueueLogDispatcher(self.logger, queue_size=10)
+        dispatcher.dispatch(logging.DEBUG, 'message', {})
+        dispatcher.stop()
+
+        self.assertEqual(self.handler.records, [])
+
+    def test_errors(self):
+        dispatcher = QueueLogDispatcher(self.logger, queue_size=10)
+        dispatcher.dispatch(logging.INFO, 'message', {'message': 'overwrite not allowed'})
+        dispatcher.dispatch(logging.INFO, 'message', {})
+        dispatcher.stop()
+
+        self.assertEqual(dispatcher.errors, 1)
+        self.assertEqual(len(self.handler.records), 1)
+
+    def _fill(self, dispatcher):
+        self.handler.unblock.clear()
+        dispatcher.dispatch(logging.INFO, 'blocking', {})
+        self.assertTrue(self.handler.handling.wait(1))
+
+        for i in range(4):
+            dispatcher.dispatch(logging.INFO, 'message {}'.format(i), {})
+
+        self.handler.unblock.set()
+        dispatcher.stop()
+
+        return [r.getMessage() for r in self.handler.records]
+
+    def test_overflow_drop(self):
+        dispatcher = QueueLogDispatcher(self.logger, queue_size=2)
+
+        self.assertEqual(self._fill(dispatcher), ['blocking', 'message 0', 'message 1'])
+        self.assertEqual(dispatcher.dropped, 2)
+
+    def test_overflow_drop_oldest(self):
+        dispatcher = QueueLogDispatcher(self.logger, queue_size=2,
+                                        overflow=QueueLogDispatcher.OVERFLOW_DROP_OLDEST)
+
+        self.assertEqual(self._fill(dispatcher), ['blocking', 'message 2', 'message 3'])
+        self.assertEqual(dispatcher.dropped, 2)
+
+    def test_wrong_overflow(self):
+        with self.assertRaises(ValueError):
+            QueueLogDispatcher(self.logger, overflow='block')
@@ -0,0 +1,166 @@
+from unittest import TestCase as SyncTestCase
+
+from asynctest.case import TestCase
+
+from service_client.metrics import LatencyHistogram, Metrics, prometheus_exposition
+from service_client.plugins import TooManyRequestsPendingError
+from service_client.utils import ObjectWrapper
+
+
+class LatencyHistogramTests(SyncTestCase):
+
+    def setUp(self):
+        self.histogram = LatencyHistogram(sub_buckets=8)
+
+    def test_empty(self):
+        self.assertEqual(self.histogram.snapshot(), {'count': 0,
+                                                     'sum': 0.0,
+                                                     'min': None,
+                                                     'max': None,
+                                                     'p50': None,
+                                                     'p90': None,
+                                                     'p99': None,
+                                                     'p999': None})
+
+    def test_percentiles(self):
+        for i in range(1, 1001):
+            self.histogram.record(i / 1000)
+
+        self.assertEqual(self.histogram.count, 1000)
+        self.assertAlmostEqual(self.histogram.sum, 500.5)
+        self.assertEqual(self.histogram.min, 0.001)
+        self.assertEqual(self.histogram.max, 1)
+        self.assertAlmostEqual(self.histogram.percentile(50), 0.5, delta=0.5 / 8)
+        self.assertAlmostEqual(self.histogram.percentile(99), 0.99, delta=0.99 / 8)
+        self.assertEqual(self.histogram.percentile(100), 1)
+
+    def test_tiny_and_huge_values(self):
+        self.histogram.record(0)
+        self.histogram.record(10000)
+
+        self.assertEqual(self.histogram.counts[0], 1)
+        self.assertEqual(self.histogram.counts[-1], 1)
+        self.assertEqual(self.histogram.percentile(50), 0.000001)
+        self.assertEqual(self.histogram.percentile(100), 10000)
+
+    def test_constant_memory(self):
+        size = len(self.histogram.counts)
+        for i in range(10000):
+            self.histogram.record(i * 0.0001)
+        self.assertEqual(len(self.histogram.counts), size)
+
+    def test_cumulative_buckets(self):
+        self.histogram.record(0.0015)
+        self.histogram.record(0.003)
+
+        buckets = list(self.histogram.cumulative_buckets())
+
+        self.assertEqual(len(buckets), self.histogram.max_exponent + 2)
+        self.assertEqual(buckets[0], (0.000001, 0))
+        self.assertIn((0.002048, 1), buckets)
+        self.assertIn((0.004096, 2), buckets)
+        self.assertEqual(buckets[-1], (float('inf'), 2))
+        self.assertEqual([c for _, c in buckets], sorted(c for _, c in buckets))
+
+
+class MetricsTests(TestCase):
+
+    async def setUp(self):
+        class ServiceMock:
+            name = 'test_service'
+
+        class ResponseMock:
+            status = 200
+
+        self.plugin = Metrics()
+        self.service = ServiceMock()
+        self.plugin.assign_service_client(self.service)
+
+        self.response = ResponseMock()
+        self.endpoint_desc = {'path': '/test1/path/noway',
+                              'method': 'GET',
+                              'endpoint': 'test_endpoint'}
+
+    async def _call(self, status=200, ex=None, **session_attrs):
+        session = ObjectWrapper(object())
+        for k, v in session_attrs.items():
+            setattr(session, k, v)
+
+        await self.plugin.prepare_session(self.endpoint_desc, session, {})
+        if ex is None:
+            self.response.status = status
+            await self.plugin.on_response(self.endpoint_desc, session, {}, self.response)
+        else:
+            await self.plugin.on_exception(self.endpoint_desc, session, {}, ex)
+
+        return session
+
+    async def test_start_mark_not_logged(self):
+        session = await self._call()
+        self.assertEqual(session.get_wrapper_data(), {})
+
+    async def test_snapshot(self):
+        await self._call(status=200, blocked_by_pool=0.01)
+        await self._call(status=201, blocked_by_pool=0.02)
+        await self._call(status=503)
+        await self._call(ex=TooManyRequestsPendingError(), blocked_by_pool=0.1)
+
+        snapshot = self.plugin.snapshot()
+        self.assertEqual(snapshot['service_name'], 'test_service')
+        self.assertEqual(list(snapshot['endpoints'].keys()), ['test_endpoint'])
+
+        metrics = snapshot['endpoints']['test_endpoint']
+        self.assertEqual(metrics['responses'], {'2xx': 2, '5xx': 1, 'exception': 1})
+        self.assertEqual(metrics['latency']['count'], 4)
+        self.assertEqual(metrics['blocked_by_pool']['count'], 3)
+        self.assertEqual(metrics['blocked_by_pool']['max'], 0.1)
+        self.assertEqual(metrics['blocked_by_ratelimit']['count'], 0)
+
+    async def test_reset(self):
+        await self._call()
+        self.plugin.reset()
+        self.assertEqual(self.plugin.snapshot()['endpoints'], {})
+
+    async def test_prometheus(self):
+        await self._call(status=200, blocked_by_ratelimit=0.003)
+        await self._call(status=404)
+
+        text = self.plugin.to_prometheus()
+        lines = text.splitlines()
+
+        self.assertTrue(text.endswith('\n'))
+        self.assertEqual(lines[0], '# HELP service_client_responses_total Responses by status class.')
+        self.assertEqual(lines[1], '# TYPE service_client_responses_total counter')
+        self.assertIn('service_client_responses_total{service="test_service",endpoint="test_endpoint",'
+                      'status_class="2xx"} 1', lines)
+        self.assertIn('service_client_responses_total{service="test_service",endpoint="test_endpoint",'
+                      'status_class="4xx"} 1', lines)
+        self.assertIn('# TYPE service_client_request_duration_seconds histogram', lines)
+        self.assertIn('service_client_request_duration_seconds_count{service="test_service",'
+                      'endpoint="test_endpoint"} 2', lines)
+        self.assertIn('service_client_request_duration_seconds_bucket{service="test_service",'
+                      'endpoint="test_endpoint",le="+Inf"} 2', lines)
+        self.assertIn('service_client_ratelimit_wait_seconds_bucket{service="test_service",'
+                      'endpoint="test_endpoint",le="0.004096"} 1', lines)
+        self.assertIn('service_client_pool_wait_seconds_count{service="test_service",'
+                      'endpoint="test_endpoint"} 0', lines)
+
+    async def test_prometheus_several_plugins(self):
+        class OtherServiceMock:
+            name = 'other "service"'
+
+        other = Metrics()
+        other_service = OtherServiceMock()
+        other.assign_service_client(other_service)
+
+        await self._call()
+        session = ObjectWrapper(object())
+        await other.prepare_session(self.endpoint_desc, session, {})
+        await other.on_response(self.endpoint_desc, session, {}, self.response)
+
+        lines = prometheus_exposition(self.plugin, other).splitlines()
+
+        self.assertEqual(lines.count('# TYPE service_client_responses_total counter'), 1)
+        self.assertEqual(lines.count('# TYPE service_client_request_duration_seconds histogram'), 1)
+        self.assertIn('service_client_responses_total{service="other \\"service\\"",endpoint="test_endpoint",'
+                      'status_class="2xx"} 1', lines)
@@ -1,11 +1,24 @@
+import errno
+import json
+import logging
 import os
-
-from aiohttp import ClientResponse, hdrs
+from asyncio import TimeoutError, ensure_future, gather, sleep, wait_for
+from datetime import timedelta
+from random import Random
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from aiohttp import ClientOSError, ClientResponse, ClientResponseError, ServerDisconnectedError, ServerTimeoutError, \
+    hdrs
 from aiohttp.client import ClientSession
 from asynctest.case import TestCase
 from multidict import CIMultiDict
 
-from service_client.mocks import Mock, RawDataMock, RawFileMock, mock_manager
+from service_client import ServiceClient
+from service_client.mocks import Mock, MockManager, MockResponse, NoMock, RawDataMock, RawFileMock, clear_body_caches, \
+    mock_manager, reset_random_generators, sample_latency
+from service_client.metrics import Metrics
+from service_client.plugins import Elapsed, InnerLogger
 from service_client.utils import ObjectWrapper
 
 MOCKS_DIR = os.path.join(os.path.dirname(__file__), 'mock_files')
@@ -41,6 +54,9 @@ class TestMocker(TestCase):
         )()
         self.plugin.assign_service_client(self.service_client)
 
+    async def tearDown(self):
+        await self.session.close()
+
     async def test_calling_mock(self):
         from .mocks import FakeMock
         await self.plugin.prepare_session(self.service_desc, self.session, {})
@@ -182,3 +198,394 @@ class TestMocker(TestCase):
         with self.assertRaises(ValueError):
             await self.plugin.prepare_session(self.service_desc, self.session, {})
             await self.session.request('POST', 'default_url')
+
+
+class MockManagerTest(TestCase):
+
+    def setUp(self):
+        self.manager = MockManager()
+
+    def test_newest_first_between_wildcards(self):
+        with self.manager.use_mock('endpoint', endpoint='test_endpoint'), \
+                self.manager.use_mock('service', service_name='test_service'), \
+                self.manager.use_mock('any'):
+            self.assertEqual([d.mock for d in self.manager.mocks], ['any', 'service', 'endpoint'])
+            self.assertEqual(self.manager.next_mock('test_service', 'test_endpoint').mock, 'any')
+            self.assertEqual(self.manager.next_mock('other_service', 'test_endpoint').mock, 'endpoint')
+            self.assertEqual(self.manager.next_mock('test_service', 'test_endpoint').mock, 'service')
+
+            with self.assertRaises(NoMock):
+                self.manager.next_mock('test_service', 'test_endpoint')
+
+        self.assertEqual(self.manager.mocks, [])
+
+    def test_offset_between_buckets(self):
+        with self.manager.use_mock('exact', service_name='test_service', endpoint='test_endpoint'), \
+                self.manager.use_mock('any', offset=1):
+            self.assertEqual(self.manager.next_mock('test_service', 'test_endpoint').mock, 'exact')
+            self.assertEqual(self.manager.next_mock('test_service', 'test_endpoint').mock, 'any')
+
+    def test_push_twice(self):
+        definition = self.manager.use_mock('mock', offset=1)
+
+        for _ in range(2):
+            with definition:
+                with self.assertRaises(NoMock):
+                    self.manager.next_mock('test_service', 'test_endpoint')
+                self.assertIs(self.manager.next_mock('test_service', 'test_endpoint'), definition)
+
+    def test_scope(self):
+        with self.manager.use_mock('outer', limit=3):
+            with self.manager.scope():
+                with self.manager.use_mock('inner'):
+                    pass
+                self.manager.push(self.manager.use_mock('leaked'))
+
+                self.assertEqual([d.mock for d in self.manager.mocks], ['leaked', 'outer'])
+
+            self.assertEqual([d.mock for d in self.manager.mocks], ['outer'])
+
+    async def test_concurrent_tasks(self):
+        results = {}
+
+        async def run_test(name):
+            @self.manager.use_mock(name, service_name='test_service', limit=2)
+            async def test():
+                await sleep(0)
+                results[name] = [self.manager.next_mock('test_service', 'test_endpoint').mock]
+                await sleep(0)
+                results[name].append(self.manager.next_mock('test_service', 'test_endpoint').mock)
+
+            await test()
+
+        await gather(run_test('first'), run_test('second'))
+
+        self.assertEqual(results, {'first': ['first', 'first'], 'second': ['second', 'second']})
+        self.assertEqual(self.manager.mocks, [])
+
+    async def test_shared_scope_on_child_tasks(self):
+        @self.manager.use_mock('mock')
+        async def test():
+            await ensure_future(sleep(0))
+            self.assertEqual(self.manager.next_mock('test_service', 'test_endpoint').mock, 'mock')
+
+            async def child():
+                with self.assertRaises(NoMock):
+                    self.manager.next_mock('test_service', 'test_endpoint')
+
+            await ensure_future(child())
+
+        await test()
+
+
+class MockCacheTest(TestCase):
+
+    async def setUp(self):
+        clear_body_caches()
+        self.plugin = Mock()
+        self.session = ObjectWrapper(ClientSession())
+        self.service_client = type(
+            'DynTestServiceClient',
+            (),
+            {'name': 'test_service_name',
+             'create_response': lambda self, *args, **kwargs: ObjectWrapper(ClientResponse(*args, **kwargs)),
+             'loop': self.loop}
+        )()
+        self.plugin.assign_service_client(self.service_client)
+
+        self.tmp_dir = TemporaryDirectory()
+        self.filename = os.path.join(self.tmp_dir.name, 'body.data')
+        with open(self.filename, 'wb') as f:
+            f.write(b'first')
+
+    async def tearDown(self):
+        self.tmp_dir.cleanup()
+        await self.session.close()
+
+    async def _read(self, mock_desc):
+        await self.plugin.prepare_session({'mock': mock_desc, 'endpoint': 'test_endpoint'}, self.session, {})
+        response = await self.session.request('GET', 'default_url')
+        return await response.read()
+
+    async def test_factory_cached(self):
+        mock_desc = {'mock_type': 'default:RawDataMock', 'data': 'data'}
+        with patch.object(self.plugin.loader, 'get_factory_by_class',
+                          wraps=self.plugin.loader.get_factory_by_class) as get_factory_by_class:
+            await self._read(mock_desc)
+            await self._read(mock_desc)
+
+        get_factory_by_class.assert_called_once_with(RawDataMock)
+
+    async def test_file_body_cached(self):
+        mock_desc = {'mock_type': 'default:RawFileMock', 'file': self.filename}
+
+        with patch.object(RawFileMock, 'load_file', side_effect=RawFileMock.load_file, autospec=True) as load_file:
+            self.assertEqual(await self._read(mock_desc), b'first')
+            self.assertEqual(await self._read(mock_desc), b'first')
+
+            self.assertEqual(load_file.call_count, 1)
+
+            with open(self.filename, 'wb') as f:
+                f.write(b'second body')
+
+            self.assertEqual(await self._read(mock_desc), b'second body')
+            self.assertEqual(load_file.call_count, 2)
+
+    async def test_json_body_cached(self):
+        data = {'key': 'value'}
+        mock_desc = {'mock_type': 'default:JsonDataMock', 'data': data, 'cache_body': True}
+
+        with patch('service_client.mocks.json.dumps', wraps=json.dumps) as dumps:
+            self.assertEqual(await self._read(mock_desc), b'{"key": "value"}')
+            self.assertEqual(await self._read(dict(mock_desc)), b'{"key": "value"}')
+            self.assertEqual(dumps.call_count, 1)
+
+            self.assertEqual(await self._read({'mock_type': 'default:JsonDataMock', 'data': {'key': 'other'},
+                                               'cache_body': True}),
+                             b'{"key": "other"}')
+            self.assertEqual(dumps.call_count, 2)
+
+    async def test_json_body_not_cached(self):
+        mock_desc = {'mock_type': 'default:JsonDataMock', 'data': {'key': 'value'}}
+
+        with patch('service_client.mocks.json.dumps', wraps=json.dumps) as dumps:
+            await self._read(mock_desc)
+            await self._read(mock_desc)
+            self.assertEqual(dumps.call_count, 2)
+
+    async def test_json_body_modified_data(self):
+        data = {'key': ['value']}
+        mock_desc = {'mock_type': 'default:JsonDataMock', 'data': data}
+
+        self.assertEqual(await self._read(mock_desc), b'{"key": ["value"]}')
+
+        data['key'].append('other')
+        self.assertEqual(await self._read(mock_desc), b'{"key": ["value", "other"]}')
+
+        data['new'] = 1
+        self.assertEqual(await self._read(mock_desc), b'{"key": ["value", "other"], "new": 1}')
+
+
+class FixedRandom:
+
+    def __init__(self, value):
+        self.value = value
+
+    def random(self):
+        return self.value
+
+
+class DegradedMockTest(TestCase):
+
+    async def setUp(self):
+        reset_random_generators()
+        self.plugin = Mock()
+        self.session = ObjectWrapper(ClientSession())
+        self.service_client = type(
+            'DynTestServiceClient',
+            (),
+            {'name': 'test_service_name',
+             'create_response': lambda self, *args, **kwargs: ObjectWrapper(ClientResponse(*args, **kwargs)),
+             'loop': self.loop}
+        )()
+        self.plugin.assign_service_client(self.service_client)
+        self.delays = []
+
+    async def tearDown(self):
+        await self.session.close()
+
+    async def _sleep(self, delay):
+        self.delays.append(delay)
+
+    async def _request(self, **mock_desc):
+        mock_desc.setdefault('mock_type', 'default:RawDataMock')
+        mock_desc.setdefault('data', b'0123456789')
+        await self.plugin.prepare_session({'mock': mock_desc, 'endpoint': 'test_endpoint'}, self.session, {})
+        with patch('service_client.mocks.sleep', self._sleep):
+            response = await self.session.request('GET', 'default_url')
+            await response.read()
+        return response
+
+    async def test_fixed_latency(self):
+        response = await self._request(latency=0.1)
+
+        self.assertEqual(response.status, 200)
+        self.assertEqual(self.delays, [0.1])
+
+    async def test_uniform_latency_seed(self):
+        mock_desc = {'latency': {'distribution': 'uniform', 'min': 0.01, 'max': 0.1}, 'seed': 1}
+        for _ in range(3):
+            await self._request(**mock_desc)
+        first = self.delays
+
+        reset_random_generators()
+        self.delays = []
+        for _ in range(3):
+            await self._request(**mock_desc)
+
+        self.assertEqual(self.delays, first)
+        self.assertEqual(len(set(first)), 3)
+        for delay in first:
+            self.assertTrue(0.01 <= delay <= 0.1)
+
+    def test_percentiles_latency(self):
+        latency = {'distribution': 'percentiles', 'percentiles': {'50': 0.02, '90': 0.1, '100': 0.5}}
+
+        self.assertEqual(sample_latency(FixedRandom(0.1), latency), 0.02)
+        self.assertAlmostEqual(sample_latency(FixedRandom(0.7), latency), 0.06)
+        self.assertAlmostEqual(sample_latency(FixedRandom(0.95), latency), 0.3)
+
+    def test_lognormal_latency(self):
+        latency = {'distribution': 'lognormal', 'median': 0.05, 'sigma': 0.5}
+        rng = Random(1)
+        values = sorted(sample_latency(rng, latency) for _ in range(1001))
+
+        self.assertTrue(all(v > 0 for v in values))
+        self.assertTrue(0.04 < values[500] < 0.06)
+
+    def test_unknown_distribution(self):
+        with self.assertRaises(ValueError):
+            sample_latency(Random(1), {'distribution': 'pareto'})
+
+    async def test_status_fault(self):
+        response = await self._request(faults=[{'rate': 1, 'status': 503, 'data': 'unavailable'}])
+
+        self.assertEqual(response.status, 503)
+        self.assertEqual(await response.read(), b'unavailable')
+
+    async def test_fault_rate(self):
+        mock_desc = {'faults': [{'rate': 0.5, 'status': 503}], 'seed': 2}
+        statuses = [(await self._request(**mock_desc)).status for _ in range(200)]
+
+        self.assertTrue(60 < statuses.count(503) < 140)
+        self.assertEqual(set(statuses), {200, 503})
+
+    async def test_reset_fault(self):
+        with self.assertRaises(ClientOSError) as ctx:
+            await self._request(faults=[{'rate': 1, 'error': 'reset'}])
+
+        self.assertEqual(ctx.exception.errno, errno.ECONNRESET)
+
+    async def test_disconnect_fault(self):
+        with self.assertRaises(ServerDisconnectedError):
+            await self._request(faults=[{'rate': 1, 'error': 'disconnect'}])
+
+    async def test_timeout_fault_delay(self):
+        with self.assertRaises(ServerTimeoutError):
+            await self._request(faults=[{'rate': 1, 'error': 'timeout', 'delay': 5}])
+
+        self.assertEqual(self.delays, [5])
+
+    async def test_timeout_fault_hangs(self):
+        with self.assertRaises(TimeoutError):
+            await wait_for(self._request(faults=[{'rate': 1, 'error': 'timeout'}]), timeout=0.01)
+
+    async def test_bandwidth(self):
+        response = await self._request(latency=0.1, bandwidth=100)
+
+        self.assertEqual(self.delays, [0.1, 0.1])
+        self.assertEqual(await response.read(), b'0123456789')
+
+
+class LeanResponseTest(TestCase):
+
+    spec = {'get_user': {'path': '/user', 'method': 'get',
+                         'mock': {'mock_type': 'default:JsonDataMock',
+                                  'data': {'name': 'jöhn'},
+                                  'headers': {'Content-Type': 'application/json; charset=utf-8'}}},
+            'not_found': {'path': '/user', 'method': 'get',
+                          'mock': {'mock_type': 'default:RawDataMock', 'data': 'not found', 'status': 404,
+                                   'lean_response': True}}}
+
+    def _create_client(self, plugins):
+        client = ServiceClient(name='test_service', spec=self.spec, plugins=plugins,
+                               base_path='http://example.com', loop=self.loop)
+        self.addCleanup(client.aclose)
+        return client
+
+    async def test_lean_response(self):
+        prepared = []
+
+        class PrepareResponsePlugin:
+            def prepare_response(self, endpoint_desc, session, request_params, response):
+                prepared.append(endpoint_desc['endpoint'])
+
+        client = self._create_client([Mock(lean_responses=True), PrepareResponsePlugin()])
+
+        with patch('service_client.ClientResponse', side_effect=AssertionError):
+            response = await client.call('get_user')
+
+        self.assertIsInstance(response._obj, MockResponse)
+        self.assertEqual(prepared, ['get_user'])
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.reason, 'OK')
+        self.assertTrue(response.ok)
+        self.assertEqual(response.content_type, 'application/json')
+        self.assertEqual(response.charset, 'utf-8')
+        self.assertEqual(response.data, '{"name": "j\\u00f6hn"}'.encode())
+        self.assertEqual(await response.json(), {'name': 'jöhn'})
+        self.assertEqual(str(response.url), 'http://example.com/user')
+        response.raise_for_status()
+
+    async def test_lean_response_plugins(self):
+        logger = logging.getLogger('test.lean_response')
+        logger.propagate = False
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(logging.NullHandler())
+
+        client = self._create_client([Mock(lean_responses=True), Elapsed(), InnerLogger(logger), Metrics()])
+
+        response = await client.call('get_user')
+
+        self.assertIsInstance(response._obj, MockResponse)
+        self.assertEqual(response.data, '{"name": "j\\u00f6hn"}'.encode())
+        self.assertIsInstance(response.read_elapsed, timedelta)
+        self.assertIsInstance(response.parse_elapsed, timedelta)
+
+        response = await client.call('not_found')
+        self.assertEqual(response.status, 404)
+
+    async def test_lean_response_by_endpoint(self):
+        client = self._create_client([Mock()])
+
+        response = await client.call('not_found')
+
+        self.assertIsInstance(response._obj, MockResponse)
+        self.assertEqual(await response.text(), 'not found')
+        with self.assertRaises(ClientResponseError) as ctx:
+            response.raise_for_status()
+        self.assertEqual(ctx.exception.status, 404)
+
+        response = await client.call('get_user')
+        self.assertIsInstance(response._obj, ClientResponse)
+
+    async def test_lean_status_fault(self):
+        spec = {'fault': {'path': '/user', 'method': 'get',
+                          'mock': {'mock_type': 'default:RawDataMock', 'data': 'data', 'lean_response': True,
+                                   'faults': [{'rate': 1, 'status': 503, 'data': 'unavailable'}]}}}
+        client = ServiceClient(spec=spec, plugins=[Mock()], base_path='http://example.com', loop=self.loop)
+        self.addCleanup(client.aclose)
+
+        response = await client.call('fault')
+
+        self.assertEqual(response.status, 503)
+        self.assertEqual(response.data, b'unavailable')
+
+    async def test_lean_stream_response(self):
+        spec = {'stream': {'path': '/stream', 'method': 'get', 'stream_response': True,
+                           'mock': {'mock_type': 'default:RawDataMock', 'data': 'first\nsecond',
+                                    'lean_response': True}}}
+        client = ServiceClient(spec=spec, plugins=[Mock()], base_path='http://example.com', loop=self.loop)
+        self.addCleanup(client.aclose)
+
+        response = await client.call('stream')
+        self.assertEqual([chunk async for chunk in response.content.iter_chunked(4)],
+                         [b'firs', b't\nse', b'cond'])
+        self.assertTrue(response.content.at_eof())
+        self.assertEqual(await response.content.read(), b'')
+
+        response = await client.call('stream')
+        self.assertEqual(await response.content.readline(), b'first\n')
+        self.assertEqual(await response.content.read(3), b'sec')
+        self.assertEqual(await response.content.readany(), b'ond')
+        self.assertEqual([chunk async for chunk in response.content.iter_any()], [])
@@ -7,20 +7,27 @@ import logging
 from asyncio import TimeoutError
 from asyncio.tasks import Task, ensure_future, gather, shield, sleep, wait, wait_for
 from datetime import datetime, timedelta
+from time import monotonic, sleep as time_sleep
+from types import SimpleNamespace
+from unittest.mock import MagicMock
 
 try:
     all_tasks = Task.all_tasks
 except AttributeError:  # pragma: no cover
     from asyncio import all_tasks
 
+from aiohttp import TraceConfig
 from aiohttp.client import ClientSession
 from asynctest.case import TestCase
 from multidict import CIMultiDict
 from yarl import URL
 
-from service_client import ConnectionClosedError
-from service_client.plugins import Elapsed, Headers, InnerLogger, OuterLogger, PathTokens, Pool, \
-    QueryParams, RateLimit, Timeout, TooManyRequestsPendingError, TooMuchTimePendingError, TrackingToken
+from service_client import ConnectionClosedError, ServiceClient
+from service_client.json import json_decoder
+from service_client.mocks import Mock
+from service_client.plugins import ConnectorLimit, Elapsed, Headers, InnerLogger, LoopMonitor, OuterLogger, \
+    PathTokens, Pool, QueryParams, RateLimit, Timeout, TooManyRequestsPendingError, TooMuchTimePendingError, \
+    TrackingToken
 from service_client.utils import ObjectWrapper
 from tests import create_fake_response
 
@@ -417,23 +424,23 @@ class ElapsedTest(TestCase):
         response = ObjectWrapper(ResponseMock(0.1))
         self.plugin.prepare_response(self.endpoint_desc, self.session, self.request_params, response)
 
-        t = datetime.now()
+        t = monotonic()
         await response.start()
         self.assertGreater(response.headers_elapsed, timedelta(seconds=0.1))
         self.assertLess(response.headers_elapsed, timedelta(seconds=0.2))
         self.assertGreater(response.start_headers, t)
-        self.assertLess(response.start_headers, datetime.now())
+        self.assertLess(response.start_headers, monotonic())
 
     async def test_headers_elapsed_2(self):
         response = ObjectWrapper(ResponseMock(0.2))
         self.plugin.prepare_response(self.endpoint_desc, self.session, self.request_params, response)
 
-        t = datetime.now()
+        t = monotonic()
         await response.start()
         self.assertGreater(response.headers_elapsed, timedelta(seconds=0.2))
         self.assertLess(response.headers_elapsed, timedelta(seconds=0.3))
         self.assertGreater(response.start_headers, t)
-        self.assertLess(response.start_headers, datetime.now())
+        self.assertLess(response.start_headers, monotonic())
 
     async def test_no_headers_elapsed_endpoint(self):
         self.endpoint_desc['elapsed'] = {'headers': False}
@@ -455,7 +462,7 @@ class ElapsedTest(TestCase):
 
     async def test_read_elapsed(self):
         response = ObjectWrapper(ResponseMock(0.1))
-        t = datetime.now()
+        t = monotonic()
         await self.plugin.on_response(self.endpoint_desc, self.session, self.request_params, response)
         await sleep(0.1)
         await self.plugin.on_read(self.endpoint_desc, self.session, self.request_params, response)
@@ -463,11 +470,11 @@ class ElapsedTest(TestCase):
         self.assertGreater(response.read_elapsed, timedelta(seconds=0.1))
         self.assertLess(response.read_elapsed, timedelta(seconds=0.2))
         self.assertGreater(response.start_read, t)
-        self.assertLess(response.start_read, datetime.now())
+        self.assertLess(response.start_read, monotonic())
 
     async def test_read_elapsed_2(self):
         response = ObjectWrapper(ResponseMock(0.2))
-        t = datetime.now()
+        t = monotonic()
         await self.plugin.on_response(self.endpoint_desc, self.session, self.request_params, response)
         await sleep(0.2)
         await self.plugin.on_read(self.endpoint_desc, self.session, self.request_params, response)
@@ -475,7 +482,7 @@ class ElapsedTest(TestCase):
         self.assertGreater(response.read_elapsed, timedelta(seconds=0.2))
         self.assertLess(response.read_elapsed, timedelta(seconds=0.3))
         self.assertGreater(response.start_read, t)
-        self.assertLess(response.start_read, datetime.now())
+        self.assertLess(response.start_read, monotonic())
 
     async def test_no_read_elapsed_endpoint(self):
         self.endpoint_desc['elapsed'] = {'read': False}
@@ -497,7 +504,7 @@ class ElapsedTest(TestCase):
 
     async def test_parse_elapsed(self):
         response = ObjectWrapper(ResponseMock(0.1))
-        t = datetime.now()
+        t = monotonic()
         await self.plugin.on_read(self.endpoint_desc, self.session, self.request_params, response)
         await sleep(0.1)
         await self.plugin.on_parsed_response(self.endpoint_desc, self.session, self.request_params, response)
@@ -505,11 +512,11 @@ class ElapsedTest(TestCase):
         self.assertGreater(response.parse_elapsed, timedelta(seconds=0.1))
         self.assertLess(response.parse_elapsed, timedelta(seconds=0.2))
         self.assertGreater(response.start_parse, t)
-        self.assertLess(response.start_parse, datetime.now())
+        self.assertLess(response.start_parse, monotonic())
 
     async def test_parse_elapsed_2(self):
         response = ObjectWrapper(ResponseMock(0.2))
-        t = datetime.now()
+        t = monotonic()
         await self.plugin.on_read(self.endpoint_desc, self.session, self.request_params, response)
         await sleep(0.2)
         await self.plugin.on_parsed_response(self.endpoint_desc, self.session, self.request_params, response)
@@ -517,7 +524,7 @@ class ElapsedTest(TestCase):
         self.assertGreater(response.parse_elapsed, timedelta(seconds=0.2))
         self.assertLess(response.parse_elapsed, timedelta(seconds=0.3))
         self.assertGreater(response.start_parse, t)
-        self.assertLess(response.start_parse, datetime.now())
+        self.assertLess(response.start_parse, monotonic())
 
     async def test_no_parse_elapsed_endpoint(self):
         self.endpoint_desc['elapsed'] = {'parse': False}
@@ -538,6 +545,74 @@ class ElapsedTest(TestCase):
         self.assertFalse(hasattr(response, 'start_parse'))
 
 
+class ElapsedConnectionTest(TestCase):
+
+    async def setUp(self):
+        self.plugin = Elapsed(connection=True)
+        self.session_config = {}
+        self.plugin.prepare_session_config(self.session_config)
+        self.trace_config = self.session_config['trace_configs'][0]
+        self.trace_config_ctx = SimpleNamespace()
+        self.response = ObjectWrapper(ResponseMock(0.1))
+
+    async def _send(self, signal, params=None):
+        for callback in getattr(self.trace_config, signal):
+            await callback(None, self.trace_config_ctx, params)
+
+    async def test_no_trace_config(self):
+        session_config = {'trace_configs': ['other_trace_config']}
+        Elapsed().prepare_session_config(session_config)
+        self.assertEqual(session_config, {'trace_configs': ['other_trace_config']})
+
+    async def test_keep_trace_configs(self):
+        session_config = {'trace_configs': ['other_trace_config']}
+        self.plugin.prepare_session_config(session_config)
+        self.assertEqual(len(session_config['trace_configs']), 2)
+        self.assertEqual(session_config['trace_configs'][0], 'other_trace_config')
+        self.assertIsInstance(session_config['trace_configs'][1], TraceConfig)
+
+    async def test_new_connection(self):
+        await self._send('on_request_start')
+        await self._send('on_connection_queued_start')
+        await sleep(0.01)
+        await self._send('on_connection_queued_end')
+        await self._send('on_connection_create_start')
+        await self._send('on_dns_resolvehost_start')
+        await sleep(0.02)
+        await self._send('on_dns_resolvehost_end')
+        await sleep(0.01)
+        await self._send('on_connection_create_end')
+        await sleep(0.01)
+        await self._send('on_request_chunk_sent')
+        await sleep(0.05)
+        await self._send('on_request_end', SimpleNamespace(response=self.response))
+
+        self.assertGreaterEqual(self.response.connection_queued_elapsed, timedelta(seconds=0.01))
+        self.assertLess(self.response.connection_queued_elapsed, timedelta(seconds=0.02))
+        self.assertGreaterEqual(self.response.dns_elapsed, timedelta(seconds=0.02))
+        self.assertLess(self.response.dns_elapsed, timedelta(seconds=0.03))
+        self.assertGreaterEqual(self.response.connect_elapsed, timedelta(seconds=0.03))
+        self.assertLess(self.response.connect_elapsed, timedelta(seconds=0.04))
+        self.assertGreaterEqual(self.response.request_sent_elapsed, timedelta(seconds=0.05))
+        self.assertLess(self.response.request_sent_elapsed, timedelta(seconds=0.07))
+        self.assertGreaterEqual(self.response.first_byte_elapsed, timedelta(seconds=0.05))
+        self.assertLess(self.response.first_byte_elapsed, timedelta(seconds=0.06))
+        self.assertFalse(self.response.connection_reused)
+
+    async def test_reused_connection(self):
+        await self._send('on_request_start')
+        await self._send('on_connection_reuseconn')
+        await sleep(0.02)
+        await self._send('on_request_end', SimpleNamespace(response=self.response))
+
+        self.assertTrue(self.response.connection_reused)
+        self.assertGreaterEqual(self.response.first_byte_elapsed, timedelta(seconds=0.02))
+        self.assertLess(self.response.first_byte_elapsed, timedelta(seconds=0.03))
+        self.assertFalse(hasattr(self.response, 'connect_elapsed'))
+        self.assertFalse(hasattr(self.response, 'dns_elapsed'))
+        self.assertFalse(hasattr(self.response, 'request_sent_elapsed'))
+
+
 class TrackingTokenTest(TestCase):
 
     async def setUp(self):
@@ -792,6 +867,311 @@ class InnerLogTest(TestCase):
                                     'exception': ex}})
 
 
+class InnerLogLazyTest(TestCase):
+
+    async def setUp(self):
+        this = self
+
+        class SessionMock:
+            async def request(self, *args, **kwargs):
+                response = ObjectWrapper(await create_fake_response('get', URL('http://test.test'),
+                                                                    session=self, loop=this.loop))
+
+                response._body = 'ñññ'.encode()
+                response.status = 200
+                response._headers = CIMultiDict({"content-type": "text/plain; charset=utf-8"})
+                return response
+
+        class LoggerMock:
+            enabled_level = logging.INFO
+            calls = []
+
+            def isEnabledFor(self, level):
+                return level >= self.enabled_level
+
+            def log(self, level, message, *args, **kwargs):
+                self.calls.append((level, message, kwargs))
+
+        class ServiceMock:
+            name = 'test_service'
+
+        self.logger = LoggerMock()
+        self.plugin = InnerLogger(self.logger, max_body_length=3)
+        self.service = ServiceMock()
+        self.plugin.assign_service_client(self.service)
+
+        self.session = ObjectWrapper(SessionMock())
+        self.endpoint_desc = {'path': '/test1/path/noway',
+                              'method': 'POST',
+                              'endpoint': 'test_endpoint'}
+
+        self.request_params = {'path_param1': 'foo'}
+
+    async def _request(self):
+        resp = await self.session.request()
+        resp.reads = 0
+
+        def decorator(func):
+            async def read():
+                resp.reads += 1
+                return await func()
+            return read
+
+        resp.decorate_attr('read', decorator)
+        return resp
+
+    async def test_level_disabled(self):
+        self.logger.enabled_level = logging.WARNING
+        resp = await self._request()
+
+        await self.plugin.before_request(self.endpoint_desc, self.session, self.request_params)
+        await self.plugin.on_response(self.endpoint_desc, self.session, self.request_params, resp)
+
+        self.assertEqual(self.logger.calls, [])
+        self.assertEqual(resp.reads, 0)
+
+    async def test_exception_level_enabled(self):
+        self.logger.enabled_level = logging.WARNING
+        ex = AttributeError('Testing Exception')
+
+        await self.plugin.on_exception(self.endpoint_desc, self.session, self.request_params, ex)
+
+        self.assertEqual(len(self.logger.calls), 1)
+        self.assertEqual(self.logger.calls[0][0], logging.CRITICAL)
+
+    async def test_exception_level_disabled(self):
+        self.logger.enabled_level = logging.CRITICAL + 1
+        ex = AttributeError('Testing Exception')
+        resp = await self._request()
+
+        await self.plugin.on_exception(self.endpoint_desc, self.session, self.request_params, ex)
+        await self.plugin.on_parse_exception(self.endpoint_desc, self.session, self.request_params, resp, ex)
+
+        self.assertEqual(self.logger.calls, [])
+
+    async def test_truncate_bytes_before_decode(self):
+        resp = await self._request()
+
+        await self.plugin.on_response(self.endpoint_desc, self.session, self.request_params, resp)
+
+        self.assertEqual(self.logger.calls[0][2]['extra']['body'], 'ñ\ufffd')
+
+    async def test_no_body_length_no_read(self):
+        self.plugin.max_body_length = 0
+        resp = await self._request()
+
+        await self.plugin.on_response(self.endpoint_desc, self.session, self.request_params, resp)
+
+        self.assertEqual(self.logger.calls[0][2]['extra']['body'], '')
+        self.assertEqual(resp.reads, 0)
+
+
+class InnerLogQueueTest(TestCase):
+
+    async def setUp(self):
+        class ListHandler(logging.Handler):
+            records = []
+
+            def emit(self, record):
+                self.records.append(record)
+
+        class ServiceMock:
+            name = 'test_service'
+
+        self.handler = ListHandler()
+        self.logger = logging.getLogger('test.inner_logger.queue')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(self.handler)
+
+        self.plugin = InnerLogger(self.logger, max_body_length=3, queue_size=10)
+        self.service = ServiceMock()
+        self.plugin.assign_service_client(self.service)
+
+        self.session = ObjectWrapper(object())
+        self.endpoint_desc = {'path': '/test1/path/noway',
+                              'method': 'POST',
+                              'endpoint': 'test_endpoint'}
+
+    async def tearDown(self):
+        self.plugin.close()
+        self.logger.removeHandler(self.handler)
+
+    async def test_before_request(self):
+        await self.plugin.before_request(self.endpoint_desc, self.session, {'data': 'data text'})
+        self.plugin.close()
+        self.plugin.dispatcher.stop(timeout=1)
+
+        self.assertEqual(len(self.handler.records), 1)
+        record = self.handler.records[0]
+        self.assertEqual(record.getMessage(), 'Sending request')
+        self.assertEqual(record.action, 'REQUEST')
+        self.assertEqual(record.body, 'dat')
+        self.assertEqual(record.endpoint, 'test_endpoint')
+        self.assertEqual(record.service_name, 'test_service')
+        self.assertEqual(self.plugin.dispatcher.dropped, 0)
+
+    async def test_aclose_waits_for_events(self):
+        class SlowHandler(logging.Handler):
+            def emit(self, record):
+                time_sleep(0.05)
+                self.handled.append(record.getMessage())
+
+        handler = SlowHandler()
+        handler.handled = []
+        self.logger.addHandler(handler)
+        self.addCleanup(self.logger.removeHandler, handler)
+
+        plugin = InnerLogger(self.logger, queue_size=10)
+        service_client = ServiceClient(name='test_service', plugins=[Mock(), plugin], base_path='http://foo.com',
+                                       spec={'test': {'path': '/test', 'method': 'get',
+                                                      'mock': {'mock_type': 'default:RawDataMock', 'data': 'ok'}}})
+        await service_client.call('test')
+        await service_client.aclose()
+
+        self.assertFalse(plugin.dispatcher.running)
+        self.assertEqual(len(handler.handled), 2)
+
+
+class InnerLogSamplingTest(TestCase):
+
+    async def setUp(self):
+        class LoggerMock:
+            calls = []
+
+            def isEnabledFor(self, level):
+                return True
+
+            def log(self, level, message, *args, **kwargs):
+                self.calls.append((level, message, kwargs['extra']))
+
+        class ServiceMock:
+            name = 'test_service'
+
+        self.logger = LoggerMock()
+        self.plugin = InnerLogger(self.logger, sample_rate=3, tail_status_codes=[500], tail_latency=0.5)
+        self.service = ServiceMock()
+        self.plugin.assign_service_client(self.service)
+
+        self.endpoint_desc = {'path': '/test1/path/noway',
+                              'method': 'GET',
+                              'endpoint': 'test_endpoint'}
+
+    async def _call(self, status=200, endpoint_desc=None, ex=None, parse_ex=None):
+        endpoint_desc = endpoint_desc or self.endpoint_desc
+        session = ObjectWrapper(object())
+        await self.plugin.before_request(endpoint_desc, session, {})
+
+        if ex is not None:
+            await self.plugin.on_exception(endpoint_desc, session, {}, ex)
+        else:
+            response = ObjectWrapper(ResponseMock(0))
+            response.status = status
+            response.data = 'body'
+            response.headers = {}
+            await self.plugin.on_response(endpoint_desc, session, {}, response)
+            if parse_ex is not None:
+                await self.plugin.on_parse_exception(endpoint_desc, session, {}, response, parse_ex)
+
+        self.plugin.on_call_end(endpoint_desc, session, {})
+        return session
+
+    def _actions(self):
+        return [c[2]['action'] for c in self.logger.calls]
+
+    async def test_head_sampling(self):
+        for _ in range(4):
+            await self._call()
+
+        self.assertEqual(self._actions(), ['REQUEST', 'RESPONSE', 'REQUEST', 'RESPONSE'])
+        self.assertEqual(self.plugin._buffer, {})
+
+    async def test_head_sampling_by_endpoint(self):
+        await self._call()
+        await self._call(endpoint_desc=dict(self.endpoint_desc, endpoint='other_endpoint'))
+
+        self.assertEqual(self._actions(), ['REQUEST', 'RESPONSE', 'REQUEST', 'RESPONSE'])
+        self.assertEqual([c[2]['endpoint'] for c in self.logger.calls],
+                         ['test_endpoint', 'test_endpoint', 'other_endpoint', 'other_endpoint'])
+
+    async def test_tail_status(self):
+        await self._call()
+        await self._call(status=500)
+        await self._call(status=404)
+
+        self.assertEqual(self._actions(), ['REQUEST', 'RESPONSE', 'REQUEST', 'RESPONSE'])
+        self.assertEqual(self.logger.calls[3][2]['status_code'], 500)
+        self.assertEqual(self.plugin._buffer, {})
+
+    async def test_tail_latency(self):
+        await self._call()
+
+        session = ObjectWrapper(object())
+        await self.plugin.before_request(self.endpoint_desc, session, {})
+        getattr(session, self.plugin._sampling_attr).start -= 1
+        response = ObjectWrapper(ResponseMock(0))
+        response.status = 200
+        response.data = 'body'
+        response.headers = {}
+        await self.plugin.on_response(self.endpoint_desc, session, {}, response)
+
+        self.assertEqual(self._actions(), ['REQUEST', 'RESPONSE', 'REQUEST', 'RESPONSE'])
+
+    async def test_tail_exception(self):
+        await self._call()
+        await self._call(ex=AttributeError('Testing Exception'))
+
+        self.assertEqual(self._actions(), ['REQUEST', 'RESPONSE', 'REQUEST', 'EXCEPTION'])
+        self.assertEqual(self.logger.calls[3][0], logging.CRITICAL)
+
+    async def test_tail_parse_exception(self):
+        await self._call()
+        await self._call(parse_ex=ValueError('Wrong body'))
+
+        self.assertEqual(self._actions(), ['REQUEST', 'RESPONSE', 'REQUEST', 'EXCEPTION'])
+        self.assertEqual(self.plugin._buffer, {})
+
+    async def test_tail_parse_exception_service_client(self):
+        self.plugin.sample_rate = 0
+        spec = {'test': {'path': '/test', 'method': 'get',
+                         'mock': {'mock_type': 'default:RawDataMock', 'data': 'not json'}},
+                'other': {'path': '/other', 'method': 'get',
+                          'mock': {'mock_type': 'default:RawDataMock', 'data': '{}'}}}
+        service_client = ServiceClient(name='test_service', spec=spec, plugins=[Mock(), self.plugin],
+                                       base_path='http://foo.com', parser=json_decoder)
+        self.addCleanup(service_client.aclose)
+
+        await service_client.call('other')
+        with self.assertRaises(ValueError):
+            await service_client.call('test')
+
+        self.assertEqual(self._actions(), ['REQUEST', 'EXCEPTION'])
+        self.assertEqual([c[2]['endpoint'] for c in self.logger.calls], ['test', 'test'])
+        self.assertEqual(self.plugin._buffer, {})
+
+    async def test_only_tail(self):
+        self.plugin.sample_rate = 0
+        await self._call()
+        await self._call(status=500)
+
+        self.assertEqual(self._actions(), ['REQUEST', 'RESPONSE'])
+
+    async def test_max_buffered(self):
+        self.plugin.sample_rate = 0
+        self.plugin.max_buffered = 1
+
+        first = ObjectWrapper(object())
+        await self.plugin.before_request(self.endpoint_desc, first, {})
+        await self.plugin.before_request(self.endpoint_desc, ObjectWrapper(object()), {})
+
+        self.assertEqual(len(self.plugin._buffer), 1)
+        self.assertEqual(self.plugin.buffer_dropped, 1)
+
+        await self.plugin.on_exception(self.endpoint_desc, first, {}, AttributeError('Testing Exception'))
+
+        self.assertEqual(self._actions(), ['EXCEPTION'])
+
+
 class OuterLogTest(TestCase):
 
     async def setUp(self):
@@ -849,6 +1229,21 @@ class OuterLogTest(TestCase):
                                     'path_param2': 'bar',
                                     'service_name': 'test_service'}})
 
+    async def test_prepare_payload_return_payload(self):
+        payload = {'key': 'value'}
+        self.assertIs((await self.plugin.prepare_payload(self.endpoint_desc, self.session,
+                                                         self.request_params, payload)),
+                      payload)
+        self.assertEqual(self.logger.kwargs['extra']['body'], "{'k")
+
+    async def test_prepare_payload_level_disabled(self):
+        self.logger.isEnabledFor = lambda level: False
+        payload = {'key': 'value'}
+        self.assertIs((await self.plugin.prepare_payload(self.endpoint_desc, self.session,
+                                                         self.request_params, payload)),
+                      payload)
+        self.assertFalse(hasattr(self.logger, 'kwargs'))
+
     async def test_prepare_payload_hidden_data(self):
         self.endpoint_desc['logger'] = {'hidden_request_body': True}
         await self.plugin.prepare_payload(self.endpoint_desc, self.session, self.request_params, 'aaaaa')
@@ -930,6 +1325,14 @@ class OuterLogTest(TestCase):
                                     'elapsed': resp.elapsed,
                                     'headers': resp.headers}})
 
+    async def test_on_parse_response_no_string_data(self):
+        resp = await self.session.request()
+        resp.data = {'key': 'value'}
+        await self.plugin.prepare_payload(self.endpoint_desc, self.session, self.request_params, None)
+        await self.plugin.on_parsed_response(self.endpoint_desc, self.session, self.request_params, resp)
+
+        self.assertEqual(self.logger.kwargs['extra']['body'], "{'k")
+
     async def test_on_parse_exception(self):
         ex = AttributeError('Testing Exception')
         resp = await self.session.request()
@@ -1075,6 +1478,90 @@ class PoolTest(TestCase):
                                           self.request_params, None)
 
 
+class PoolSheddingTest(TestCase):
+
+    async def setUp(self):
+        class ServiceMock:
+            name = 'test_service'
+            loop = self.loop
+
+        self.plugin = Pool(limit=1, queue_target=0.01, queue_interval=0.02)
+
+        self.service = ServiceMock()
+        self.plugin.assign_service_client(self.service)
+
+        self.session = ObjectWrapper(object())
+        self.endpoint_desc = {'path': '/test1/path/noway',
+                              'method': 'POST',
+                              'endpoint': 'test_endpoint'}
+        self.request_params = {}
+
+    async def _release_after(self, delay):
+        await sleep(delay)
+        await self.plugin.on_response(self.endpoint_desc, self.session,
+                                      self.request_params, None)
+
+    async def _overload(self):
+        await self.plugin.before_request(self.endpoint_desc, self.session, self.request_params)
+
+        fut_1 = ensure_future(self.plugin.before_request(self.endpoint_desc, self.session,
+                                                         self.request_params))
+        fut_2 = ensure_future(self.plugin.before_request(self.endpoint_desc, self.session,
+                                                         self.request_params))
+
+        await self._release_after(0.05)
+        await wait_for(fut_1, 0.1)
+        self.assertFalse(self.plugin.shedding)
+
+        await self._release_after(0.03)
+        await wait_for(fut_2, 0.1)
+
+    async def test_shedding(self):
+        await self._overload()
+        self.assertTrue(self.plugin.shedding)
+
+        with self.assertRaisesRegex(TooManyRequestsPendingError, "Too many requests pending on pool"):
+            await wait_for(self.plugin.before_request(self.endpoint_desc, self.session,
+                                                      self.request_params), timeout=0.01)
+
+        self.assertLessEqual(self.session.blocked_by_pool, 0.01)
+
+    async def test_stop_shedding_when_queue_drains(self):
+        await self._overload()
+        self.assertTrue(self.plugin.shedding)
+
+        await self.plugin.on_response(self.endpoint_desc, self.session,
+                                      self.request_params, None)
+        self.assertFalse(self.plugin.shedding)
+
+        await self.plugin.before_request(self.endpoint_desc, self.session, self.request_params)
+        self.assertFalse(self.plugin.shedding)
+
+    async def test_free_slot_arrival_keeps_shedding(self):
+        await self._overload()
+        self.assertTrue(self.plugin.shedding)
+
+        # a request is still queued when a slot gets free and a new arrival takes it at once
+        waiter = self.loop.create_future()
+        self.plugin._pending_futs.append(waiter)
+        self.plugin._counter -= 1
+        await self.plugin.before_request(self.endpoint_desc, self.session, self.request_params)
+
+        self.assertEqual(self.plugin.pending, 1)
+        self.assertTrue(self.plugin.shedding)
+
+    async def test_no_shedding_under_target(self):
+        await self.plugin.before_request(self.endpoint_desc, self.session, self.request_params)
+
+        for _ in range(5):
+            fut = ensure_future(self.plugin.before_request(self.endpoint_desc, self.session,
+                                                           self.request_params))
+            await self._release_after(0)
+            await wait_for(fut, 0.1)
+
+        self.assertFalse(self.plugin.shedding)
+
+
 class RateLimitTest(TestCase):
 
     async def setUp(self):
@@ -1213,3 +1700,138 @@ class RateLimitTest(TestCase):
                                           self.request_params, None)
 
             await sleep(0.2)
+
+
+class ConnectorLimitTest(TestCase):
+
+    async def setUp(self):
+        class ServiceMock:
+            name = 'test_service'
+            loop = self.loop
+
+        self.service = ServiceMock()
+        self.endpoint_desc = {'endpoint': 'test_endpoint'}
+
+    def _create_plugin(self, **kwargs):
+        plugin = ConnectorLimit(**kwargs)
+        plugin.assign_service_client(self.service)
+        return plugin
+
+    async def _start_call(self, plugin, url='http://foo.com/test'):
+        session = ObjectWrapper(SimpleNamespace())
+        request_params = {'url': URL(url)}
+        fut = ensure_future(plugin.before_request(self.endpoint_desc, session, request_params))
+        await sleep(0)
+        return fut, session, request_params
+
+    async def test_limit(self):
+        plugin = self._create_plugin(limit=1)
+
+        fut1, session1, request_params1 = await self._start_call(plugin)
+        fut2, session2, request_params2 = await self._start_call(plugin, 'http://bar.com/test')
+        self.assertTrue(fut1.done())
+        self.assertFalse(fut2.done())
+
+        plugin.on_call_end(self.endpoint_desc, session1, request_params1)
+        await wait_for(fut2, 0.1)
+
+        plugin.on_call_end(self.endpoint_desc, session2, request_params2)
+        self.assertFalse(plugin._semaphore.locked())
+
+    async def test_limit_per_host(self):
+        plugin = self._create_plugin(limit=0, limit_per_host=1)
+
+        fut1, session1, request_params1 = await self._start_call(plugin)
+        fut2, session2, request_params2 = await self._start_call(plugin)
+        fut3, session3, request_params3 = await self._start_call(plugin, 'http://bar.com/test')
+        self.assertTrue(fut1.done())
+        self.assertFalse(fut2.done())
+        self.assertTrue(fut3.done())
+
+        plugin.on_call_end(self.endpoint_desc, session1, request_params1)
+        await wait_for(fut2, 0.1)
+
+        # slots are released once
+        plugin.on_call_end(self.endpoint_desc, session1, request_params1)
+        plugin.on_call_end(self.endpoint_desc, session2, request_params2)
+        plugin.on_call_end(self.endpoint_desc, session3, request_params3)
+        self.assertEqual(plugin._hosts, {})
+
+    async def test_cancelled_while_waiting(self):
+        plugin = self._create_plugin(limit=0, limit_per_host=1)
+
+        fut1, session1, request_params1 = await self._start_call(plugin)
+        fut2, session2, request_params2 = await self._start_call(plugin)
+        fut2.cancel()
+        await wait([fut2])
+        plugin.on_call_end(self.endpoint_desc, session2, request_params2)
+        self.assertIn(('foo.com', 80), plugin._hosts)
+
+        plugin.on_call_end(self.endpoint_desc, session1, request_params1)
+        self.assertEqual(plugin._hosts, {})
+
+        fut3, session3, request_params3 = await self._start_call(plugin)
+        self.assertTrue(fut3.done())
+        plugin.on_call_end(self.endpoint_desc, session3, request_params3)
+
+
+class LoopMonitorTest(TestCase):
+
+    async def setUp(self):
+        def parser(data, **kwargs):
+            if kwargs['endpoint_desc']['endpoint'] == 'slow':
+                time_sleep(0.05)
+            return data
+
+        self.logger = MagicMock()
+        self.plugin = LoopMonitor(interval=0.01, lag_threshold=0.03, parse_threshold=0.03, logger=self.logger)
+        mock = {'mock_type': 'default:RawDataMock', 'data': 'x' * 100}
+        self.service_client = ServiceClient(spec={'slow': {'path': '/slow', 'mock': mock},
+                                                  'fast': {'path': '/fast', 'mock': mock},
+                                                  'delayed': {'path': '/delayed', 'mock': dict(mock, latency=0.05)}},
+                                            plugins=[Mock(), self.plugin], parser=parser,
+                                            base_path='http://test.test')
+
+    async def tearDown(self):
+        await self.service_client.aclose()
+        self.assertFalse(self.plugin.running)
+
+    async def test_fast_parse(self):
+        self.assertFalse(self.plugin.running)
+        await self.service_client.call('fast')
+        self.assertTrue(self.plugin.running)
+        await sleep(0.03)
+
+        self.assertEqual(len(self.plugin.slow_parses), 0)
+        self.assertEqual(self.plugin.lag_spikes, 0)
+        self.assertLess(self.plugin.last_lag, 0.03)
+        self.logger.warning.assert_not_called()
+
+    async def test_slow_parse(self):
+        await self.service_client.call('slow')
+        await sleep(0.03)
+
+        self.assertEqual(len(self.plugin.slow_parses), 1)
+        end, endpoint, body_size, elapsed = self.plugin.slow_parses[0]
+        self.assertEqual((endpoint, body_size), ('slow', 100))
+        self.assertGreaterEqual(elapsed, 0.05)
+
+        self.assertEqual(self.plugin.lag_spikes, 1)
+        self.assertGreaterEqual(self.plugin.max_lag, 0.03)
+
+        self.assertEqual(self.logger.warning.call_count, 2)
+        self.assertTrue(self.logger.warning.call_args_list[0][0][0].startswith(
+            'Parsing response from slow (100 bytes) blocked event loop'))
+        message = self.logger.warning.call_args_list[1][0][0]
+        self.assertTrue(message.startswith('Event loop lag'))
+        self.assertIn('Slow parses: slow (100 bytes', message)
+        self.assertIn('Active calls: none.', message)
+
+    async def test_lag_active_calls(self):
+        call = ensure_future(self.service_client.call('delayed'))
+        await sleep(0.01)
+        self.plugin._report_lag(0.1, self.loop.time() - 1, self.loop.time())
+        await call
+
+        message = self.logger.warning.call_args[0][0]
+        self.assertEqual(message, 'Event loop lag 100 ms. Slow parses: none. Active calls: delayed (awaiting_headers).')
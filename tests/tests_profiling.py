@@ -0,0 +1,60 @@
+from time import sleep as sync_sleep
+
+from asyncio import sleep
+from asynctest.case import TestCase
+
+from service_client.profiling import Profiler
+
+
+class ProfilerTests(TestCase):
+
+    async def setUp(self):
+        self.profiler = Profiler()
+
+    async def test_empty_report(self):
+        self.assertEqual(self.profiler.report(), {'hooks': {}, 'io': {}, 'serializer': {}, 'parser': {}})
+
+    async def test_wrap(self):
+        def func(a, b=1):
+            sync_sleep(0.01)
+            return a + b
+
+        wrapped = self.profiler.wrap(Profiler.PARSER, 'endpoint', func)
+
+        self.assertEqual(wrapped(1, b=2), 3)
+        self.assertEqual(wrapped(1), 2)
+
+        stats = self.profiler.report()['parser']['endpoint']
+        self.assertEqual(stats['calls'], 2)
+        self.assertGreaterEqual(stats['min'], 0.01)
+        self.assertGreaterEqual(stats['total'], 0.02)
+        self.assertAlmostEqual(stats['mean'], stats['total'] / 2)
+
+    async def test_wrap_async(self):
+        async def func():
+            await sleep(0.01)
+            return 'result'
+
+        wrapped = self.profiler.wrap_async(Profiler.HOOKS, 'Plugin.hook', func)
+
+        self.assertEqual((await wrapped()), 'result')
+
+        stats = self.profiler.report()['hooks']['Plugin.hook']
+        self.assertEqual(stats['calls'], 1)
+        self.assertGreaterEqual(stats['max'], 0.01)
+
+    async def test_record_exception(self):
+        async def func():
+            raise KeyError()
+
+        wrapped = self.profiler.wrap_async(Profiler.IO, 'endpoint', func)
+
+        with self.assertRaises(KeyError):
+            await wrapped()
+
+        self.assertEqual(self.profiler.report()['io']['endpoint']['calls'], 1)
+
+    async def test_reset(self):
+        self.profiler.record(Profiler.IO, 'endpoint', 0.1)
+        self.profiler.reset()
+        self.assertEqual(self.profiler.report()['io'], {})
@@ -1,3 +1,4 @@
+from asyncio import ensure_future, sleep, wait_for
 from asyncio.tasks import Task
 
 from multidict import CIMultiDict
@@ -7,12 +8,14 @@ try:
 except AttributeError:  # pragma: no cover
     from asyncio import current_task
 
-from aiohttp import RequestInfo
+from aiohttp import ClientError, RequestInfo, web
 from asynctest.case import TestCase
 from asynctest.mock import patch
 from yarl import URL
 
-from service_client import ServiceClient
+from service_client import ConnectionClosedError, ServiceClient
+from service_client.calls import AWAITING_HEADERS, PARSING, QUEUED
+from service_client.plugins import Pool, TrackingToken
 from service_client.utils import ObjectWrapper
 from tests import create_fake_response
 
@@ -624,3 +627,277 @@ class ServiceBasicTest(TestCase):
                                                                                 headers=CIMultiDict()),
                                                        traces=[], loop=self.loop, session=self.service_client.session)
         self.assertIsInstance(response, ObjectWrapper)
+
+
+class SessionConfigPlugin:
+
+    def prepare_session_config(self, session_config):
+        session_config['trace_configs'] = ['trace_config']
+
+
+class ServiceSessionConfigTest(TestCase):
+
+    @patch('service_client.ClientSession')
+    async def test_prepare_session_config(self, mock_session):
+        service_client = ServiceClient(name="TestService", spec={},
+                                       plugins=[SessionConfigPlugin()],
+                                       config={'session': {'read_timeout': 10}},
+                                       base_path='http://foo.com/sdsd')
+
+        self.assertEqual(mock_session.call_args[1]['trace_configs'], ['trace_config'])
+        self.assertEqual(mock_session.call_args[1]['read_timeout'], 10)
+        self.assertEqual(service_client.config, {'session': {'read_timeout': 10}})
+
+
+class ServiceProfileTest(TestCase):
+
+    @patch('service_client.ClientSession')
+    def setUp(self, mock_session):
+        self.mock_session = mock_session
+
+        async def request(*args, **kwargs):
+            self.response = await create_fake_response('get', 'http://test.test', session=self.mock_session)
+            self.response._body = b'bbbb'
+            return self.response
+
+        async def close():
+            pass
+
+        self.mock_session.request.side_effect = request
+        self.mock_session.close.side_effect = close
+        self.mock_session.return_value = self.mock_session
+        self.mock_session.closed = True
+
+        self.spec = {'testService1': {'path': '/path/to/service1',
+                                      'method': 'post'}}
+
+        self.plugin = FakePlugin()
+
+        self.service_client = ServiceClient(name="TestService", spec=self.spec, plugins=[self.plugin],
+                                            base_path='http://foo.com/sdsd')
+        self.profiled_client = ServiceClient(name="TestService", spec=self.spec, plugins=[self.plugin],
+                                             base_path='http://foo.com/sdsd', profile=True)
+
+    async def tearDown(self):
+        self.service_client.close()
+        self.profiled_client.close()
+
+    async def test_profile_disabled(self):
+        await self.service_client.call('testService1', payload='aaaa')
+        self.assertIsNone(self.service_client.profiler)
+
+    async def test_profile(self):
+        self.service_client = self.profiled_client
+        await self.service_client.call('testService1', payload='aaaa')
+        await self.service_client.call('testService1', payload='aaaa')
+
+        report = self.service_client.profiler.report()
+
+        self.assertEqual(report['hooks']['FakePlugin.assign_service_client']['calls'], 1)
+        for hook in ['prepare_session', 'prepare_path', 'prepare_request_params', 'prepare_payload',
+                     'before_request', 'on_response', 'on_read', 'on_parsed_response']:
+            self.assertEqual(report['hooks']['FakePlugin.' + hook]['calls'], 2, hook)
+        self.assertNotIn('FakePlugin.on_exception', report['hooks'])
+
+        self.assertEqual(report['serializer']['testService1']['calls'], 2)
+        self.assertEqual(report['parser']['testService1']['calls'], 2)
+        self.assertEqual(report['io']['testService1']['calls'], 4)
+        self.assertGreater(report['io']['testService1']['total'], 0)
+
+
+class ServiceWarmUpTest(TestCase):
+
+    async def setUp(self):
+        self.peers = set()
+
+        async def handler(request):
+            self.peers.add(request.transport.get_extra_info('peername'))
+            return web.Response(body=b'ok')
+
+        app = web.Application()
+        app.router.add_get('/test', handler)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        self.base_path = 'http://127.0.0.1:{}'.format(site._server.sockets[0].getsockname()[1])
+        self.other_base_path = 'http://localhost:{}'.format(site._server.sockets[0].getsockname()[1])
+        self.spec = {'test': {'path': '/test'}}
+
+    async def tearDown(self):
+        await self.runner.cleanup()
+
+    def _parked_connections(self, service_client):
+        return sum(len(conns) for conns in service_client.connector._conns.values())
+
+    async def test_warm_up(self):
+        service_client = ServiceClient(spec=self.spec, base_path=self.base_path)
+        self.assertIsNone(service_client.warm_up_task)
+
+        self.assertEqual(await service_client.warm_up(connections=3), 3)
+        self.assertEqual(self._parked_connections(service_client), 3)
+
+        await service_client.call('test')
+        self.assertEqual(self._parked_connections(service_client), 3)
+        self.assertEqual(len(self.peers), 1)
+
+        service_client.close()
+        await service_client.session.close()
+
+    async def test_warm_up_connector_limit(self):
+        service_client = ServiceClient(spec=self.spec, base_path=self.base_path,
+                                       config={'connector': {'limit_per_host': 2}})
+
+        self.assertEqual(await service_client.warm_up(connections=5), 2)
+
+        service_client.close()
+        await service_client.session.close()
+
+    async def test_warm_up_backends_connector_limit(self):
+        service_client = ServiceClient(spec=self.spec, base_path=[self.base_path, self.other_base_path],
+                                       config={'connector': {'limit': 2}})
+
+        self.assertEqual(await wait_for(service_client.warm_up(connections=2), timeout=5), 2)
+        self.assertEqual(self._parked_connections(service_client), 2)
+
+        service_client.close()
+        await service_client.session.close()
+
+    async def test_warm_up_backends_over_connector_limit(self):
+        service_client = ServiceClient(spec=self.spec, base_path=[self.base_path, self.other_base_path],
+                                       config={'connector': {'limit': 1}, 'warm_up': 2})
+
+        self.assertEqual(await wait_for(service_client.warm_up_task, timeout=5), 2)
+
+        service_client.close()
+        await service_client.session.close()
+
+    async def test_warm_up_error(self):
+        service_client = ServiceClient(spec=self.spec, base_path='http://127.0.0.1:1')
+
+        self.assertEqual(await service_client.warm_up(connections=2), 0)
+
+        service_client.close()
+        await service_client.session.close()
+
+    async def test_warm_up_config(self):
+        service_client = ServiceClient(spec=self.spec, base_path=self.base_path, config={'warm_up': 2})
+
+        self.assertEqual(await service_client.warm_up_task, 2)
+        self.assertEqual(self._parked_connections(service_client), 2)
+
+        service_client.close()
+        await service_client.session.close()
+
+
+class BaseDelayServerTest(TestCase):
+
+    async def setUp(self):
+        async def handler(request):
+            await sleep(float(request.query.get('delay', 0)))
+            return web.Response(body=b'ok')
+
+        app = web.Application()
+        app.router.add_get('/test', handler)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        self.service_client = ServiceClient(spec={'test': {'path': '/test'}},
+                                            plugins=[TrackingToken()],
+                                            base_path='http://127.0.0.1:{}'.format(
+                                                site._server.sockets[0].getsockname()[1]))
+
+    async def tearDown(self):
+        await self.service_client.aclose()
+        await self.runner.cleanup()
+
+
+class ServiceDrainTest(BaseDelayServerTest):
+
+    async def test_aclose_without_calls(self):
+        self.assertTrue(await self.service_client.aclose())
+        self.assertTrue(self.service_client.session.closed)
+
+    async def test_aclose_drains(self):
+        calls = [ensure_future(self.service_client.call('test', params={'delay': '0.1'})) for _ in range(3)]
+        await sleep(0.01)
+        self.assertEqual(self.service_client.in_flight, 3)
+
+        closing = ensure_future(self.service_client.aclose(drain_timeout=5))
+        await sleep(0)
+        with self.assertRaises(ConnectionClosedError):
+            await self.service_client.call('test')
+
+        self.assertTrue(await closing)
+        self.assertEqual([(await c).data for c in calls], [b'ok', b'ok', b'ok'])
+        self.assertEqual(self.service_client.in_flight, 0)
+        self.assertTrue(self.service_client.session.closed)
+
+    async def test_aclose_drain_timeout(self):
+        pool = Pool(limit=1)
+        self.service_client.add_plugins([pool])
+
+        slow = ensure_future(self.service_client.call('test', params={'delay': '1'}))
+        queued = ensure_future(self.service_client.call('test'))
+        await sleep(0.01)
+        self.assertEqual(pool.pending, 1)
+
+        self.assertFalse(await self.service_client.aclose(drain_timeout=0.05))
+        self.assertTrue(self.service_client.session.closed)
+
+        with self.assertRaises(ClientError):
+            await slow
+        with self.assertRaises(ConnectionClosedError):
+            await queued
+
+
+class ServiceActiveCallsTest(BaseDelayServerTest):
+
+    async def test_active_calls(self):
+        self.assertEqual(self.service_client.active_calls, [])
+
+        calls = [ensure_future(self.service_client.call('test', params={'delay': '0.1'}, tracking_token=str(i)))
+                 for i in range(2)]
+        await sleep(0.05)
+
+        self.assertEqual(self.service_client.in_flight, 2)
+        self.assertEqual([(c.endpoint, c.tracking_token, c.phase) for c in self.service_client.active_calls],
+                         [('test', '0', AWAITING_HEADERS), ('test', '1', AWAITING_HEADERS)])
+        self.assertGreater(self.service_client.active_calls[0].elapsed, 0.04)
+        self.assertEqual(self.service_client.count_active_calls(phase=AWAITING_HEADERS), 2)
+        self.assertEqual(self.service_client.count_active_calls(endpoint='other'), 0)
+        self.assertEqual(self.service_client.count_active_calls(older_than=0.04), 2)
+        self.assertEqual(self.service_client.count_active_calls(older_than=10), 0)
+
+        await calls[0]
+        await calls[1]
+        self.assertEqual(self.service_client.active_calls, [])
+
+    async def test_queued_call(self):
+        self.service_client.add_plugins([Pool(limit=1)])
+
+        calls = [ensure_future(self.service_client.call('test', params={'delay': '0.1'})) for _ in range(2)]
+        await sleep(0.05)
+
+        self.assertEqual([c.phase for c in self.service_client.active_calls], [AWAITING_HEADERS, QUEUED])
+
+        await calls[0]
+        await calls[1]
+        self.assertEqual(self.service_client.in_flight, 0)
+
+    async def test_parsing_phase(self):
+        phases = []
+
+        def parser(data, session, **kwargs):
+            phases.append(session.call_info.phase)
+            return data
+
+        self.service_client.parser = parser
+        await self.service_client.call('test')
+        self.assertEqual(phases, [PARSING])
+
+    async def test_failed_call(self):
+        with self.assertRaises(KeyError):
+            await self.service_client.call('unknown')
+        self.assertEqual(self.service_client.in_flight, 0)
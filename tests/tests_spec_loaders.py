@@ -1,6 +1,10 @@
 import os
+from tempfile import TemporaryDirectory
 from unittest.case import TestCase
-from service_client.spec_loaders import json_loader, yaml_loader, configuration_loader
+from unittest.mock import Mock
+
+from service_client.spec_loaders import SpecError, cached_loader, configuration_loader, json_loader, \
+    openapi_loader, validate_spec, yaml_loader
 
 SPECS_DIR = os.path.join(os.path.dirname(__file__), 'specs')
 
@@ -29,3 +33,145 @@ class ConfigurationLoaderTests(TestCase):
                                               "method": "get"},
                                 "endpoint2": {"path": "/bbbbbb",
                                               "method": "post"}})
+
+
+class ValidateSpecTests(TestCase):
+
+    def test_normalise(self):
+        spec = validate_spec({'endpoint1': {'path': '/users/{user_id}', 'method': 'get'},
+                              'endpoint2': {'path': '/users'}})
+
+        self.assertEqual(spec, {'endpoint1': {'path': '/users/{user_id}', 'method': 'GET'},
+                                'endpoint2': {'path': '/users'}})
+
+    def test_errors(self):
+        with self.assertRaises(SpecError) as ctx:
+            validate_spec({'endpoint1': {'path': '/users/{user_id', 'method': 'get'},
+                           'endpoint2': {'path': '/users', 'method': 'fetch'},
+                           'endpoint3': {'headers': ['a'], 'stream_response': 'yes', 'timeout': '5'},
+                           'endpoint4': 'path',
+                           'endpoint5': {'path': '/ok'}})
+
+        self.assertEqual(len(ctx.exception.errors), 6)
+        self.assertTrue(ctx.exception.errors[0].startswith('endpoint1: malformed path'))
+        self.assertEqual(ctx.exception.errors[1:], ["endpoint2: unknown method 'fetch'",
+                                                    'endpoint3: headers must be a mapping',
+                                                    'endpoint3: stream_response must be a boolean',
+                                                    'endpoint3: timeout must be a number',
+                                                    'endpoint4: endpoint definition must be a mapping'])
+
+    def test_not_mapping(self):
+        with self.assertRaises(SpecError):
+            validate_spec(['endpoint1'])
+
+
+class CachedLoaderTests(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.filename = os.path.join(self.tmp_dir.name, 'spec.yaml')
+        with open(os.path.join(SPECS_DIR, 'spec.yaml')) as src, open(self.filename, 'w') as dst:
+            dst.write(src.read())
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_cache(self):
+        loader = Mock(side_effect=yaml_loader, __name__='yaml_loader')
+
+        self.assertEqual(cached_loader(self.filename, loader=loader), {"endpoint1": {"path": "/ssssss",
+                                                                                     "method": "GET"}})
+        self.assertEqual(cached_loader(self.filename, loader=loader), {"endpoint1": {"path": "/ssssss",
+                                                                                     "method": "GET"}})
+        self.assertEqual(loader.call_count, 1)
+        self.assertTrue(os.path.exists(os.path.join(self.tmp_dir.name, '__speccache__',
+                                                    'spec.yaml.yaml_loader.pickle')))
+
+        with open(self.filename, 'a') as f:
+            f.write('\nendpoint2:\n  path: /other\n')
+
+        self.assertEqual(cached_loader(self.filename, loader=loader), {"endpoint1": {"path": "/ssssss",
+                                                                                     "method": "GET"},
+                                                                       "endpoint2": {"path": "/other"}})
+        self.assertEqual(loader.call_count, 2)
+
+    def test_cache_dir(self):
+        cache_dir = os.path.join(self.tmp_dir.name, 'cache')
+        cached_loader(self.filename, cache_dir=cache_dir)
+
+        self.assertEqual(os.listdir(cache_dir), ['spec.yaml.yaml_loader.pickle'])
+
+    def test_malformed(self):
+        with open(self.filename, 'a') as f:
+            f.write('\nendpoint2:\n  method: fetch\n')
+
+        with self.assertRaises(SpecError):
+            cached_loader(self.filename)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir.name, '__speccache__')))
+
+
+class OpenAPILoaderTests(TestCase):
+
+    def setUp(self):
+        self.spec = openapi_loader(os.path.join(SPECS_DIR, 'openapi.yaml'))
+
+    def test_lazy(self):
+        self.assertIsNone(self.spec._document)
+        self.assertEqual(set(self.spec), {'getUser', 'updateUser', 'get_users_user_id_avatar', 'uploadAvatar'})
+        self.assertEqual(len(self.spec), 4)
+        self.assertEqual(self.spec._endpoints, {})
+
+        self.assertIs(self.spec['getUser'], self.spec['getUser'])
+        self.assertEqual(list(self.spec._endpoints), ['getUser'])
+
+    def test_endpoint(self):
+        self.assertEqual(self.spec['getUser'], {'path': '/v1/users/{user_id}',
+                                                'method': 'GET',
+                                                'headers': {'Accept': 'application/json',
+                                                            'X-Tenant': 'main'},
+                                                'query_params': {'fields': 'all'},
+                                                'path_tokens': {'user_id': 1}})
+        self.assertEqual(self.spec['updateUser'], {'path': '/v1/users/{user_id}',
+                                                   'method': 'PUT',
+                                                   'headers': {'Content-Type': 'application/json'},
+                                                   'path_tokens': {'user_id': 1}})
+
+    def test_stream(self):
+        self.assertTrue(self.spec['get_users_user_id_avatar']['stream_response'])
+        self.assertNotIn('stream_request', self.spec['get_users_user_id_avatar'])
+        self.assertTrue(self.spec['uploadAvatar']['stream_request'])
+        self.assertNotIn('stream_response', self.spec['uploadAvatar'])
+
+    def test_without_base_path(self):
+        spec = openapi_loader(os.path.join(SPECS_DIR, 'openapi.yaml'), include_base_path=False)
+        self.assertEqual(spec['getUser']['path'], '/users/{user_id}')
+
+    def test_valid_spec(self):
+        validate_spec(dict(self.spec))
+
+    def test_unknown_operation(self):
+        with self.assertRaises(KeyError):
+            self.spec['unknown']
+
+    def test_external_reference(self):
+        with self.assertRaises(ValueError):
+            self.spec.resolve({'$ref': 'other.yaml#/components/schemas/User'})
+
+
+class SwaggerLoaderTests(TestCase):
+
+    def setUp(self):
+        self.spec = openapi_loader(os.path.join(SPECS_DIR, 'swagger.json'))
+
+    def test_endpoint(self):
+        self.assertEqual(self.spec['listFiles'], {'path': '/api/files',
+                                                  'method': 'GET',
+                                                  'headers': {'Accept': 'application/json',
+                                                              'X-Token': 'anonymous'},
+                                                  'query_params': {'page_size': 20}})
+
+    def test_stream(self):
+        self.assertTrue(self.spec['uploadFile']['stream_request'])
+        self.assertEqual(self.spec['uploadFile']['headers']['Content-Type'], 'multipart/form-data')
+        self.assertTrue(self.spec['downloadFile']['stream_response'])
+        self.assertEqual(self.spec['downloadFile']['headers'], {'Accept': 'application/octet-stream'})
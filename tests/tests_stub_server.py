@@ -0,0 +1,102 @@
+from aiohttp import ClientError, ClientSession
+from asynctest.case import TestCase
+
+from service_client import ServiceClient
+from service_client.mocks import MockResponse, mock_manager
+from service_client.plugins import PathTokens, QueryParams
+from service_client.spec_loaders import SpecError
+from service_client.stub_server import StubServer, create_app
+
+
+class QueryRecorderMock:
+
+    def __init__(self):
+        self.params = None
+
+    async def __call__(self, method, url, params=None, **kwargs):
+        self.params = params
+        return MockResponse(method, url, body=b'recorded')
+
+
+class StubServerTest(TestCase):
+
+    spec = {'get_user': {'path': '/users/{user_id}', 'method': 'get',
+                         'mock': {'mock_type': 'default:JsonDataMock',
+                                  'data': {'name': 'john'},
+                                  'headers': {'Content-Type': 'application/json'}}},
+            'create_user': {'path': 'users', 'method': 'post',
+                            'mock': {'mock_type': 'default:RawDataMock', 'data': 'created', 'status': 201}},
+            'reset': {'path': '/reset', 'method': 'get',
+                      'mock': {'mock_type': 'default:RawDataMock', 'data': '',
+                               'faults': [{'rate': 1, 'error': 'reset'}]}},
+            'no_mock': {'path': '/no_mock', 'method': 'get'}}
+
+    async def setUp(self):
+        self.server = StubServer(self.spec, prefix='/api', loop=self.loop)
+        await self.server.start()
+        self.client = ServiceClient(name='test_service', spec=self.spec, plugins=[PathTokens(), QueryParams()],
+                                    base_path=self.server.base_path, loop=self.loop)
+
+    async def tearDown(self):
+        await self.client.aclose()
+        await self.server.stop()
+
+    async def test_json_mock(self):
+        response = await self.client.call('get_user', user_id=1)
+
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.headers['Content-Type'], 'application/json')
+        self.assertEqual(response.data, b'{"name": "john"}')
+
+    async def test_raw_data_mock_status(self):
+        response = await self.client.call('create_user', payload=b'john')
+
+        self.assertEqual(response.status, 201)
+        self.assertEqual(response.data, b'created')
+
+    async def test_not_mocked_endpoint(self):
+        response = await self.client.call('no_mock')
+
+        self.assertEqual(response.status, 404)
+
+    async def test_reset_fault(self):
+        with self.assertRaises(ClientError):
+            await self.client.call('reset')
+
+    async def test_patched_mock(self):
+        with mock_manager.patch_mock_desc(patch={'data': {'name': 'patched'}},
+                                          service_name='StubServer', endpoint='get_user'):
+            response = await self.client.call('get_user', user_id=1)
+
+        self.assertEqual(response.data, b'{"name": "patched"}')
+
+    def test_base_path(self):
+        self.assertEqual(self.server.base_path, 'http://127.0.0.1:{}/api'.format(self.server.port))
+
+    async def test_repeated_query_params(self):
+        mock = QueryRecorderMock()
+        with mock_manager.use_mock(mock=mock, service_name='StubServer', endpoint='get_user'):
+            async with ClientSession() as session:
+                async with session.get(self.server.base_path + '/users/1?tag=a&tag=b') as response:
+                    self.assertEqual(await response.read(), b'recorded')
+
+        self.assertEqual(mock.params.getall('tag'), ['a', 'b'])
+
+
+class CreateAppTest(TestCase):
+
+    def test_duplicated_route(self):
+        spec = {'get_user': {'path': '/users', 'method': 'get',
+                             'mock': {'mock_type': 'default:RawDataMock', 'data': 'user'}},
+                'list_users': {'path': 'users', 'method': 'GET',
+                               'mock': {'mock_type': 'default:RawDataMock', 'data': 'users'}},
+                'create_user': {'path': '/users', 'method': 'post',
+                                'mock': {'mock_type': 'default:RawDataMock', 'data': 'created'}}}
+
+        with self.assertRaises(SpecError) as ctx:
+            create_app(spec, loop=self.loop)
+
+        self.assertEqual(len(ctx.exception.errors), 1)
+        self.assertIn('GET /users', ctx.exception.errors[0])
+        self.assertIn('get_user', ctx.exception.errors[0])
+        self.assertIn('list_users', ctx.exception.errors[0])
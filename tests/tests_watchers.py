@@ -0,0 +1,122 @@
+import json
+import os
+from asyncio import sleep
+from tempfile import TemporaryDirectory
+
+from asynctest.case import TestCase
+
+from service_client import ServiceClient
+from service_client.balancing import LoadBalancer
+from service_client.mocks import Mock
+from service_client.spec_loaders import SpecError
+from service_client.watchers import SpecWatcher
+
+
+class SpecWatcherTest(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.filename = os.path.join(self.tmp_dir.name, 'spec.json')
+        self.write({'test': {'path': '/v1', 'method': 'get',
+                             'mock': {'mock_type': 'default:RawDataMock', 'data': 'v1'}}})
+
+        self.watcher = SpecWatcher(self.filename, interval=0.01)
+        self.service_client = ServiceClient(spec={'test': {'path': '/v0',
+                                                           'mock': {'mock_type': 'default:RawDataMock',
+                                                                    'data': 'v0'}}},
+                                            plugins=[Mock(), self.watcher], base_path='http://test.test')
+
+    async def tearDown(self):
+        await self.service_client.aclose()
+        self.assertFalse(self.watcher.running)
+        self.tmp_dir.cleanup()
+
+    def write(self, data, mtime=None):
+        with open(self.filename, 'w') as f:
+            json.dump(data, f)
+        if mtime is not None:
+            os.utime(self.filename, (mtime, mtime))
+
+    async def test_check(self):
+        self.assertTrue(await self.watcher.check())
+        self.assertEqual(self.service_client.spec['test']['method'], 'GET')
+        self.assertEqual((await self.service_client.call('test')).data, b'v1')
+        self.assertEqual(self.watcher.reloads, 1)
+
+        self.assertFalse(await self.watcher.check())
+        self.assertEqual(self.watcher.reloads, 1)
+
+    async def test_watch(self):
+        self.assertFalse(self.watcher.running)
+        self.assertEqual((await self.service_client.call('test')).data, b'v0')
+        self.assertTrue(self.watcher.running)
+        await sleep(0.05)
+        self.assertEqual((await self.service_client.call('test')).data, b'v1')
+
+        self.write({'test': {'path': '/v2', 'mock': {'mock_type': 'default:RawDataMock', 'data': 'v2'}}}, mtime=1)
+        await sleep(0.05)
+        self.assertEqual((await self.service_client.call('test')).data, b'v2')
+        self.assertEqual(self.watcher.reloads, 2)
+
+    async def test_malformed_spec(self):
+        await self.watcher.check()
+        spec = self.service_client.spec
+
+        self.write({'test': {'path': '/v2', 'method': 'FOO'}}, mtime=1)
+        self.assertFalse(await self.watcher.check())
+        self.assertIsInstance(self.watcher.last_error, SpecError)
+        self.assertIs(self.service_client.spec, spec)
+
+        with open(self.filename, 'w') as f:
+            f.write('{')
+        os.utime(self.filename, (2, 2))
+        self.assertFalse(await self.watcher.check())
+        self.assertIsInstance(self.watcher.last_error, ValueError)
+        self.assertIs(self.service_client.spec, spec)
+
+    async def test_missing_file(self):
+        os.remove(self.filename)
+        self.assertFalse(await self.watcher.check())
+        self.assertIsInstance(self.watcher.last_error, OSError)
+
+    async def test_in_flight_call(self):
+        await self.watcher.check()
+        self.service_client.spec['test']['mock']['latency'] = 0.05
+        call = self.loop.create_task(self.service_client.call('test'))
+        await sleep(0.01)
+
+        self.write({'test': {'path': '/v2', 'mock': {'mock_type': 'default:RawDataMock', 'data': 'v2'}}}, mtime=1)
+        await self.watcher.check()
+        self.assertEqual((await call).data, b'v1')
+        self.assertEqual((await self.service_client.call('test')).data, b'v2')
+
+
+class SpecWatcherBasePathTest(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.filename = os.path.join(self.tmp_dir.name, 'spec.json')
+        with open(self.filename, 'w') as f:
+            json.dump({'base_path': ['http://backend1', 'http://backend3'],
+                       'endpoints': {'test': {'path': '/test'}}}, f)
+
+        self.watcher = SpecWatcher(self.filename, spec_key='endpoints', base_path_key='base_path')
+        self.balancer = LoadBalancer()
+        self.service_client = ServiceClient(spec={}, plugins=[self.watcher, self.balancer],
+                                            base_path=['http://backend1', 'http://backend2'])
+
+    async def tearDown(self):
+        await self.service_client.aclose()
+        self.tmp_dir.cleanup()
+
+    async def test_base_path(self):
+        self.balancer.set_backends(self.service_client.base_path)
+        backend = self.balancer.backends[0]
+        connector = self.service_client.connector
+
+        await self.watcher.check()
+        self.assertEqual(self.service_client.spec, {'test': {'path': '/test'}})
+        self.assertEqual(self.service_client.base_path, ['http://backend1', 'http://backend3'])
+        self.assertEqual([b.base_path for b in self.balancer.backends], ['http://backend1', 'http://backend3'])
+        self.assertIs(self.balancer.backends[0], backend)
+        self.assertIs(self.service_client.connector, connector)